@@ -0,0 +1,191 @@
+'''
+==================
+Bitboard Automata
+==================
+
+A pure python cellular automata kernel that works on a whole
+column of tiles at once, for builds that can't use numpy.
+
+Each column of a level is stored as one python int, with bit y
+set if the tile at y is a wall. Shifting a column up or down by
+one bit lines every tile up with its neighbor to the north or
+south, and the columns to either side give the neighbors to the
+east and west, so all eight neighbors of every tile in a column
+are available as eight ints. Adding them up with bitwise full
+adders (a "bit-sliced" adder) gives each tile's wall count as
+four ints, one per binary digit, and comparing those against
+the rule's threshold gives the new column. Each of these steps
+is one python operation for the whole column instead of one
+per tile.
+
+The rule is the one used throughout this project: a tile with
+more than neighbors walls around it becomes a wall, one with
+fewer becomes a floor, and one with exactly neighbors stays as
+it is. Tiles on the edge of the level never change.
+
+Note that this is a synchronous automata: every tile in a step
+is updated from the previous step's tiles. The getAdjacentWalls
+loops in the generators update tiles in place, so later tiles
+see the new values of earlier ones, which a bitboard can't do.
+That makes the bitboard engines an alternative to the in place
+loops, not a drop in replacement that gives the same levels.
+referenceStep is the tile by tile version of step, which step
+must always agree with.
+
+smoothStep does the same for the smoothing passes of
+cleanUpMap (neighborhoodRules.smoothingRule), counting only the
+walls to the north, south, east and west. It is also
+synchronous, so it is a stand in for the in place sweeps rather
+than a copy of them, and referenceSmoothStep is its tile by
+tile version.
+'''
+
+import neighborhoodRules
+
+# translation tables between tiles (0 and 1) and the text "0" and "1"
+_tilesToText = bytearray(range(256))
+_tilesToText[0:2] = b"01"
+_tilesToText = bytes(_tilesToText)
+_textToTiles = bytearray(range(256))
+_textToTiles[48:50] = b"\x00\x01"
+_textToTiles = bytes(_textToTiles)
+
+def packColumn(tiles):
+	# a column of tiles (any sequence of 0s and 1s, including bytes) as an int
+	return int(bytearray(tiles).translate(_tilesToText)[::-1].decode("ascii") or "0", 2)
+
+def unpackColumn(column, height):
+	# an int back to a bytearray of height tiles
+	if not height:
+		return bytearray()
+	return bytearray(format(column, "0%db" % height)[::-1].encode("ascii")).translate(_textToTiles)
+
+def toBitboard(level):
+	# one int per column, bit y set for a wall
+	return [packColumn(column) for column in level]
+
+def fromBitboard(board, height):
+	return [list(unpackColumn(column, height)) for column in board]
+
+def _fullAdd(a, b, c):
+	# returns the sum and carry bits of three bits, for every bit at once
+	partial = a ^ b
+	return partial ^ c, (a & b) | (partial & c)
+
+def countPlanes(left, column, right):
+	'''
+	Returns the number of walls around each tile of column, as
+	four ints holding the 1s, 2s, 4s and 8s digits of the count.
+	'''
+	ones1, twos1 = _fullAdd(left << 1, left, left >> 1)
+	ones2, twos2 = _fullAdd(right << 1, right, right >> 1)
+	north = column << 1
+	south = column >> 1
+	ones3 = north ^ south
+	twos3 = north & south
+
+	ones, twos4 = _fullAdd(ones1, ones2, ones3)
+	twos, fours1 = _fullAdd(twos1, twos2, twos3)
+	fours2 = twos & twos4
+	twos ^= twos4
+	fours = fours1 ^ fours2
+	eights = fours1 & fours2
+	return ones, twos, fours, eights
+
+def countPlanes4(left, column, right):
+	# the number of walls to the north, south, east and west of each tile, as countPlanes
+	ones1, twos1 = _fullAdd(column << 1, column >> 1, left)
+	ones = ones1 ^ right
+	carry = ones1 & right
+	return ones, twos1 ^ carry, twos1 & carry, 0
+
+def compareCount(planes, k):
+	# returns masks of the tiles whose count is greater than k, and less than k
+	greater = 0
+	less = 0
+	equal = -1 # every bit set
+	for i in (3, 2, 1, 0):
+		digit = planes[i]
+		if (k >> i) & 1:
+			less |= equal & ~digit
+			equal &= digit
+		else:
+			greater |= equal & digit
+			equal &= ~digit
+	return greater, less
+
+def step(board, height, neighbors=4):
+	# returns the next generation of board
+	if len(board) < 3 or height < 3:
+		return list(board)
+	interior = ((1 << height) - 1) & ~1 & ~(1 << (height-1))
+	nextBoard = [board[0]]
+	for x in range(1, len(board)-1):
+		column = board[x]
+		greater, less = compareCount(countPlanes(board[x-1], column, board[x+1]), neighbors)
+		nextBoard.append((column & ~interior) | (((column | greater) & ~less) & interior))
+	nextBoard.append(board[-1])
+	return nextBoard
+
+def smoothStep(board, height, smoothing=1, filling=None):
+	'''
+	Returns board after one synchronous pass of
+	neighborhoodRules.smoothingRule(smoothing, filling): walls
+	with at most smoothing walls around them open up, then floors
+	with at least filling walls around them are filled in.
+	'''
+	if len(board) < 3 or height < 3:
+		return list(board)
+	interior = ((1 << height) - 1) & ~1 & ~(1 << (height-1))
+	nextBoard = [board[0]]
+	for x in range(1, len(board)-1):
+		column = board[x]
+		planes = countPlanes4(board[x-1], column, board[x+1])
+		greater, less = compareCount(planes, smoothing)
+		# walls only stay where there are more than smoothing walls around them
+		smoothed = column & (greater | ~interior)
+		if filling is not None:
+			greater, less = compareCount(planes, filling)
+			smoothed |= ~smoothed & ~less & interior
+		nextBoard.append(smoothed)
+	nextBoard.append(board[-1])
+	return nextBoard
+
+def runAutomata(level, generations, neighbors=4):
+	# returns a new level after generations steps of the automata
+	if not level:
+		return []
+	height = len(level[0])
+	board = toBitboard(level)
+	for i in range(generations):
+		board = step(board, height, neighbors)
+	return fromBitboard(board, height)
+
+def referenceStep(level, neighbors=4):
+	# step, one tile at a time, on an ordinary level
+	width = len(level)
+	height = len(level[0]) if width else 0
+	nextLevel = [list(column) for column in level]
+	for x in range(1, width-1):
+		for y in range(1, height-1):
+			walls = 0
+			for dx in (-1, 0, 1):
+				for dy in (-1, 0, 1):
+					if (dx or dy) and level[x+dx][y+dy] == 1:
+						walls += 1
+			if walls > neighbors:
+				nextLevel[x][y] = 1
+			elif walls < neighbors:
+				nextLevel[x][y] = 0
+	return nextLevel
+
+def referenceSmoothStep(level, smoothing=1, filling=None):
+	# smoothStep, one tile at a time, on an ordinary level
+	table = neighborhoodRules.smoothingRule(smoothing, filling)
+	width = len(level)
+	height = len(level[0]) if width else 0
+	nextLevel = [list(column) for column in level]
+	for x in range(1, width-1):
+		for y in range(1, height-1):
+			nextLevel[x][y] = table[neighborhoodRules.neighborhoodMask(level, x, y)]
+	return nextLevel
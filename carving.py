@@ -0,0 +1,77 @@
+'''
+==================
+Carving Primitives
+==================
+
+Shared helpers for writing rooms and tunnels into a level.
+
+Levels are stored the same way as everywhere else in this
+project: a list of columns, so that level[x][y] is the tile
+at (x,y). Each column is one contiguous python list, which
+means that any run of tiles that shares an x coordinate can
+be written with a single slice assignment instead of one
+interpreter step per tile.
+
+level values of 1 are walls
+level values of 0 are floors
+'''
+
+def carveRect(level, x1, y1, x2, y2, value=0):
+	# set all tiles with x1 <= x < x2 and y1 <= y < y2 to value
+	if x2 <= x1 or y2 <= y1:
+		return
+	run = [value]*(y2-y1)
+	for x in range(x1,x2):
+		level[x][y1:y2] = run
+
+def carveRoom(level, room, value=0):
+	# set all tiles within a Rect, excluding its outer edge, to value
+	carveRect(level, room.x1+1, room.y1+1, room.x2, room.y2, value)
+
+def carveVertical(level, y1, y2, x, value=0):
+	# set a column of tiles from y1 to y2 (inclusive) to value
+	top = min(y1,y2)
+	bottom = max(y1,y2)+1
+	level[x][top:bottom] = [value]*(bottom-top)
+
+def carveHorizontal(level, x1, x2, y, value=0):
+	# set a row of tiles from x1 to x2 (inclusive) to value
+	'''
+	Rows cross every column, so this is the one primitive
+	that still has to touch each column separately.
+	'''
+	for x in range(min(x1,x2),max(x1,x2)+1):
+		level[x][y] = value
+
+def carveLHall(level, x1, y1, x2, y2, horizontalFirst, value=0):
+	# connect (x1,y1) and (x2,y2) with an L shaped hallway
+	if horizontalFirst:
+		carveHorizontal(level, x1, x2, y1, value)
+		carveVertical(level, y1, y2, x2, value)
+	else:
+		carveVertical(level, y1, y2, x1, value)
+		carveHorizontal(level, x1, x2, y2, value)
+
+def carveDiagonal(level, x1, y1, x2, y2, value=0):
+	'''
+	Carve a 45 degree staircase tunnel between (x1,y1) and
+	(x2,y2), two tiles per column so that the tunnel can be
+	walked without moving diagonally. This is the same shape
+	that RoomAddition.carveShortcut used to carve tile by tile.
+	The endpoints must lie on a diagonal.
+	'''
+	left = min(x1,x2)
+	right = max(x1,x2)
+	pair = [value,value]
+	if (x1 < x2) == (y1 < y2):
+		# NW to SE
+		y = min(y1,y2)
+		for x in range(left+1,right+1):
+			level[x][y:y+2] = pair
+			y += 1
+	else:
+		# NE to SW
+		y = max(y1,y2)
+		for x in range(left+1,right+1):
+			level[x][y-1:y+1] = pair
+			y -= 1
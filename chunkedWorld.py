@@ -0,0 +1,196 @@
+'''
+=============
+Chunked World
+=============
+
+An endless world made of fixed size chunks, each one an
+ordinary level from CellularAutomata, DrunkardsWalk or
+CityWalls, generated the first time something looks at it.
+
+	world = ChunkedWorld("CellularAutomata", worldSeed=1234, chunkSize=64)
+	world.tile(-5000, 12000)
+	for (cx, cy), chunk in world.chunksAround(playerX, playerY, radius=1).items():
+		...
+
+Chunk (cx, cy) covers the tiles from (cx*chunkSize, cy*chunkSize)
+to ((cx+1)*chunkSize - 1, (cy+1)*chunkSize - 1), and cx and cy
+can be any int, including negative ones.
+
+Every chunk is generated from its own seed, worked out from the
+world seed and its coordinates, so a chunk comes out the same
+whichever order the chunks are visited in and however often it
+has been evicted and made again.
+
+Neighboring chunks share the tiles along the edge between them.
+Those tiles are worked out from a seed for that edge alone, as
+walls broken by a few openings of floor, and both chunks stamp
+them onto their own edge, so each opening lines up with the
+same opening in the next chunk without either one having to be
+generated first. Before stamping its edges, a chunk opens the
+tile just inside every opening and runs
+postProcessing.repairConnectivity, so every floor region of the
+chunk and every opening is joined up. Tunnels never touch the
+edges, so walking through an opening always leads somewhere and
+the world is connected across every seam.
+
+Chunks are kept in an LRU of at most maxChunks, so a player
+walking across the world only ever pays for the chunks around
+them.
+'''
+
+import hashlib
+import random
+from collections import OrderedDict
+
+import dungeonGenerationAlgorithms
+import postProcessing
+
+CHUNK_SIZE = 64
+
+# generators that make sense as one piece of a bigger world
+CHUNK_ALGORITHMS = ("CellularAutomata", "DrunkardsWalk", "CityWalls")
+
+def _hashSeed(text):
+	return int(hashlib.sha256(text.encode("ascii")).hexdigest()[:16], 16)
+
+def chunkSeed(worldSeed, cx, cy):
+	# the seed for the generator of chunk (cx, cy)
+	return _hashSeed("chunk:%d:%d:%d" % (worldSeed, cx, cy))
+
+def edgeStrip(worldSeed, axis, cx, cy, size, doors=2):
+	'''
+	Returns the size tiles along an edge. axis "x" is the west
+	edge of chunk (cx, cy), which is also the east edge of chunk
+	(cx-1, cy), and axis "y" is its north edge. The edge is wall
+	apart from doors openings, each a run of floor up to a
+	quarter of the edge wide, which never reach the corners.
+	'''
+	rand = random.Random(_hashSeed("edge:%d:%s:%d:%d" % (worldSeed, axis, cx, cy)))
+	tiles = [1]*size
+	widest = max(1, size//4)
+	for start in sorted(rand.sample(range(2, size-2), min(doors, size-4))):
+		width = rand.randint(1, widest)
+		tiles[start:min(start+width, size-2)] = [0]*(min(start+width, size-2)-start)
+	return tiles
+
+def generateChunk(cx, cy, worldSeed, algorithm="CellularAutomata", size=CHUNK_SIZE, params=None, doors=2):
+	'''
+	Returns the size x size level for chunk (cx, cy) of the
+	world made from worldSeed. The caller's random state is
+	left as it was.
+	'''
+	if algorithm not in CHUNK_ALGORITHMS:
+		raise ValueError("%r can't generate chunks, use one of %s" % (algorithm, ", ".join(CHUNK_ALGORITHMS)))
+	if size < 8:
+		raise ValueError("chunks must be at least 8 tiles across")
+	seed = chunkSeed(worldSeed, cx, cy)
+	level = dungeonGenerationAlgorithms.generateSeededLevel(algorithm, size, size, seed, params)
+
+	# ==== Edges ====
+	last = size-1
+	west = edgeStrip(worldSeed, "x", cx, cy, size, doors)
+	east = edgeStrip(worldSeed, "x", cx+1, cy, size, doors)
+	north = edgeStrip(worldSeed, "y", cx, cy, size, doors)
+	south = edgeStrip(worldSeed, "y", cx, cy+1, size, doors)
+
+	# wall in the chunk, with floor just inside each opening
+	level[0][:] = [1]*size
+	level[last][:] = [1]*size
+	for i in range(size):
+		level[i][0] = 1
+		level[i][last] = 1
+		if not west[i]:
+			level[1][i] = 0
+		if not east[i]:
+			level[last-1][i] = 0
+		if not north[i]:
+			level[i][1] = 0
+		if not south[i]:
+			level[i][last-1] = 0
+
+	# join everything up without touching the edges, using the chunk's own random numbers
+	outerState = random.getstate()
+	random.seed(seed)
+	try:
+		postProcessing.repairConnectivity(level)
+	finally:
+		random.setstate(outerState)
+
+	level[0][:] = west
+	level[last][:] = east
+	for x in range(size):
+		level[x][0] = north[x]
+		level[x][last] = south[x]
+	return level
+
+class ChunkedWorld(object):
+	def __init__(self, algorithm="CellularAutomata", worldSeed=0, chunkSize=CHUNK_SIZE,
+		params=None, doors=2, maxChunks=64):
+		if algorithm not in CHUNK_ALGORITHMS:
+			raise ValueError("%r can't generate chunks, use one of %s" % (algorithm, ", ".join(CHUNK_ALGORITHMS)))
+		# check params now rather than on the first chunk
+		dungeonGenerationAlgorithms.createGenerator(algorithm, params)
+		self.algorithm = algorithm
+		self.worldSeed = worldSeed
+		self.chunkSize = chunkSize
+		self.params = params
+		self.doors = doors
+		self.maxChunks = maxChunks
+		self._chunks = OrderedDict() # (cx, cy) -> level, least recently used first
+
+		self.hits = 0
+		self.generated = 0
+		self.evictions = 0
+
+	def chunk(self, cx, cy):
+		# returns the level for chunk (cx, cy), generating it if it isn't cached
+		key = (cx, cy)
+		level = self._chunks.pop(key, None)
+		if level is None:
+			level = generateChunk(cx, cy, self.worldSeed, self.algorithm,
+				self.chunkSize, self.params, self.doors)
+			self.generated += 1
+		else:
+			self.hits += 1
+		self._chunks[key] = level
+
+		while len(self._chunks) > self.maxChunks:
+			self._chunks.popitem(last=False)
+			self.evictions += 1
+		return level
+
+	def chunkAt(self, x, y):
+		# the coordinates of the chunk holding tile (x, y)
+		return x//self.chunkSize, y//self.chunkSize
+
+	def tile(self, x, y):
+		cx, cy = self.chunkAt(x, y)
+		return self.chunk(cx, cy)[x - cx*self.chunkSize][y - cy*self.chunkSize]
+
+	def chunksAround(self, x, y, radius=1):
+		'''
+		Returns an OrderedDict of (cx, cy) -> level for every chunk
+		within radius chunks of the one holding tile (x, y).
+		'''
+		centerX, centerY = self.chunkAt(x, y)
+		chunks = OrderedDict()
+		for cy in range(centerY-radius, centerY+radius+1):
+			for cx in range(centerX-radius, centerX+radius+1):
+				chunks[(cx, cy)] = self.chunk(cx, cy)
+		return chunks
+
+	def __contains__(self, key):
+		# whether chunk key = (cx, cy) is cached
+		return key in self._chunks
+
+	def __len__(self):
+		return len(self._chunks)
+
+	def stats(self):
+		return OrderedDict([
+			("chunks", len(self._chunks)),
+			("maxChunks", self.maxChunks),
+			("hits", self.hits),
+			("generated", self.generated),
+			("evictions", self.evictions),
+			])
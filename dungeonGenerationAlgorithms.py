@@ -17,9 +17,27 @@ projects. My success in that reguard is up for debate.
 '''
 
 import libtcodpy as libtcod
+import bitboardAutomata
+import carving
+import hashlifeAutomata
+import levelMetrics
+import neighborhoodRules
+import postProcessing
 import random
+import time
 from math import sqrt
-from collections import OrderedDict
+from collections import OrderedDict, deque
+
+try:  #import NumPy if available
+	import numpy
+	numpyAvailable = True
+except ImportError:
+	numpyAvailable = False
+
+try:
+	xrange
+except NameError: # Python 3
+	xrange = range
 
 SCREEN_WIDTH = 80
 SCREEN_HEIGHT = 60
@@ -276,35 +294,42 @@ class TunnelingAlgorithm:
 	'''
 	def __init__(self):
 		self.level = []
+		self.repairConnectivity = False # join separate floor regions after generating
+		self.pipeline = None # a postProcessing.Pipeline to run on every level
 		self.ROOM_MAX_SIZE = 15
 		self.ROOM_MIN_SIZE = 6
 		self.MAX_ROOMS = 30
 		# TODO: raise an error if any necessary classes are missing
 
-	def generateLevel(self, mapWidth, mapHeight):
+	def generateLevel(self, mapWidth, mapHeight, deadline=None):
+		runSteps(self.generateLevelSteps(mapWidth, mapHeight, deadline))
+		return self.level
+
+	def generateLevelSteps(self, mapWidth, mapHeight, deadline=None):
+		# generateLevel, yielding after each bounded unit of work
+		self.deadline = deadline # stop optional phases at this time.time()
+		self.truncatedPhases = []
 		# Creates an empty 2D array or clears existing array
 		self.level = [[1
 			for y in range(mapHeight)]
 				for x in range(mapWidth)]
 
-		rooms = []
+		rooms = RectIndex(self.ROOM_MAX_SIZE)
 		num_rooms = 0
 
 		for r in range(self.MAX_ROOMS):
+			if num_rooms and deadlinePassed(self, "buildRooms"):
+				break
 			# random width and height
 			w = random.randint(self.ROOM_MIN_SIZE,self.ROOM_MAX_SIZE)
 			h = random.randint(self.ROOM_MIN_SIZE,self.ROOM_MAX_SIZE)
 			# random position within map boundries
-			x = random.randint(0, MAP_WIDTH - w -1)
-			y = random.randint(0, MAP_HEIGHT - h -1)
+			x = random.randint(0, mapWidth - w -1)
+			y = random.randint(0, mapHeight - h -1)
 
 			new_room = Rect(x, y, w, h)
 			# check for overlap with previous rooms
-			failed = False
-			for other_room in rooms:
-				if new_room.intersect(other_room):
-					failed = True
-					break
+			failed = rooms.intersectsAny(new_room)
 
 			if not failed:
 				self.createRoom(new_room)
@@ -315,116 +340,132 @@ class TunnelingAlgorithm:
 					# connect to the previous room
 
 					#center coordinates of the previous room
-					(prev_x, prev_y) = rooms[num_rooms-1].center()
+					(prev_x, prev_y) = rooms.rooms[num_rooms-1].center()
 
 					# 50% chance that a tunnel will start horizontally
-					if random.randint(0,1) == 1:
-						self.createHorTunnel(prev_x, new_x, prev_y)
-						self.createVirTunnel(prev_y, new_y, new_x)
+					carving.carveLHall(self.level, prev_x, prev_y, new_x, new_y,
+						random.randint(0,1) == 1)
 
-					else: # else it starts virtically
-						self.createVirTunnel(prev_y, new_y, prev_x)
-						self.createHorTunnel(prev_x, new_x, new_y)
-
-				# append the new room to the list
-				rooms.append(new_room)
+				# add the new room to the index
+				rooms.add(new_room)
 				num_rooms += 1
 
-
-
-		return self.level
+			yield "buildRooms"
+		for step in postProcessSteps(self):
+			yield step
 
 	def createRoom(self, room):
 		# set all tiles within a rectangle to 0
-		for x in range(room.x1 + 1, room.x2):
-			for y in range(room.y1+1, room.y2):
-				self.level[x][y] = 0
+		carving.carveRoom(self.level, room)
 
 	def createHorTunnel(self, x1, x2, y):
-		for x in range(min(x1,x2),max(x1,x2)+1):
-			self.level[x][y] = 0
+		carving.carveHorizontal(self.level, x1, x2, y)
 
 	def createVirTunnel(self, y1, y2, x):
-		for y in range(min(y1,y2),max(y1,y2)+1):
-			self.level[x][y] = 0
+		carving.carveVertical(self.level, y1, y2, x)
 
 # ==== BSP Tree ====
 class BSPTree:
 	def __init__(self):
 		self.level = []
+		self.repairConnectivity = False # join separate floor regions after generating
+		self.pipeline = None # a postProcessing.Pipeline to run on every level
 		self.room = None
 		self.MAX_LEAF_SIZE = 24
 		self.ROOM_MAX_SIZE = 15
 		self.ROOM_MIN_SIZE = 6
 
-	def generateLevel(self, mapWidth, mapHeight):
+	def generateLevel(self, mapWidth, mapHeight, deadline=None):
+		runSteps(self.generateLevelSteps(mapWidth, mapHeight, deadline))
+		return self.level
+
+	def generateLevelSteps(self, mapWidth, mapHeight, deadline=None):
+		# generateLevel, yielding after each bounded unit of work
+		self.deadline = deadline # stop optional phases at this time.time()
+		self.truncatedPhases = []
 		# Creates an empty 2D array or clears existing array
 		self.level = [[1
 			for y in range(mapHeight)]
 				for x in range(mapWidth)]
 
-		self._leafs = []
+		bspBuilder = BSPBuilder(self.MAX_LEAF_SIZE)
+		for step in bspBuilder.buildTreeSteps(mapWidth,mapHeight,deadline):
+			yield step
+		rootLeaf = bspBuilder.rootLeaf
+		self._leafs = bspBuilder.leafs
+		if bspBuilder.truncated:
+			self.truncatedPhases.append("splitLeafs")
 
-		rootLeaf = Leaf(0,0,mapWidth,mapHeight)
-		self._leafs.append(rootLeaf)
-
-		splitSuccessfully = True
-		# loop through all leaves until they can no longer split successfully
-		while (splitSuccessfully):
-			splitSuccessfully = False
-			for l in self._leafs:
-				if (l.child_1 == None) and (l.child_2 == None):
-					if ((l.width > self.MAX_LEAF_SIZE) or 
-					(l.height > self.MAX_LEAF_SIZE) or
-					(random.random() > 0.8)):
-						if (l.splitLeaf()): #try to split the leaf
-							self._leafs.append(l.child_1)
-							self._leafs.append(l.child_2)
-							splitSuccessfully = True
-
-		rootLeaf.createRooms(self)
+		for step in bspBuilder.createRoomsSteps(rootLeaf, self.createRoom, self.createHall,
+			self.ROOM_MIN_SIZE, self.ROOM_MAX_SIZE):
+			yield step
 
-		return self.level
+		for step in postProcessSteps(self):
+			yield step
 
 	def createRoom(self, room):
 		# set all tiles within a rectangle to 0
-		for x in range(room.x1 + 1, room.x2):
-			for y in range(room.y1+1, room.y2):
-				self.level[x][y] = 0
+		carving.carveRoom(self.level, room)
 
 	def createHall(self, room1, room2):
 		# connect two rooms by hallways
 		x1, y1 = room1.center()
 		x2, y2 = room2.center()
 		# 50% chance that a tunnel will start horizontally
-		if random.randint(0,1) == 1:
-			self.createHorTunnel(x1, x2, y1)
-			self.createVirTunnel(y1, y2, x2)
-
-		else: # else it starts virtically
-			self.createVirTunnel(y1, y2, x1)
-			self.createHorTunnel(x1, x2, y2)
+		carving.carveLHall(self.level, x1, y1, x2, y2,
+			random.randint(0,1) == 1)
 
 	def createHorTunnel(self, x1, x2, y):
-		for x in range(min(x1,x2),max(x1,x2)+1):
-			self.level[x][y] = 0
+		carving.carveHorizontal(self.level, x1, x2, y)
 
 	def createVirTunnel(self, y1, y2, x):
-		for y in range(min(y1,y2),max(y1,y2)+1):
-			self.level[x][y] = 0
+		carving.carveVertical(self.level, y1, y2, x)
 
 # ==== Drunkards Walk ====
 class DrunkardsWalk:
 	def __init__(self):
 		self.level = []
+		self.repairConnectivity = False # join separate floor regions after generating
+		self.pipeline = None # a postProcessing.Pipeline to run on every level
 		self._percentGoal = .4
 		self.walkIterations = 25000 # cut off in case _percentGoal in never reached
 		self.weightedTowardCenter = 0.15
 		self.weightedTowardPreviousDirection = 0.7
 
-	def generateLevel(self, mapWidth, mapHeight):
+		self.engine = "classic" # "classic", "multiWalker" or "frontier"
+		# used by the multiWalker engine
+		self.walkers = 16
+		self.sharedFillGoal = True # False gives each walker an equal share of the goal
+		self.batchSize = 1024 # number of steps worth of random numbers to draw at once
+		# used by the frontier engine
+		self.maxStepsOnFloor = 40 # steps without carving before jumping to the frontier
+
+	def generateLevel(self, mapWidth, mapHeight, deadline=None):
+		runSteps(self.generateLevelSteps(mapWidth, mapHeight, deadline))
+		return self.level
+
+	def generateLevelSteps(self, mapWidth, mapHeight, deadline=None):
+		# generateLevel, yielding after each bounded unit of work
+		self.deadline = deadline # stop optional phases at this time.time()
+		self.truncatedPhases = []
 		# Creates an empty 2D array or clears existing array
 		self.walkIterations = max(self.walkIterations, (mapWidth*mapHeight*10))
+		self.filledGoal = mapWidth*mapHeight*self._percentGoal
+
+		if (self.engine == "multiWalker"):
+			steps = self.walkMultipleSteps(mapWidth, mapHeight)
+		elif (self.engine == "frontier"):
+			steps = self.walkFrontierSteps(mapWidth, mapHeight)
+		else:
+			steps = self.walkClassicSteps(mapWidth, mapHeight)
+		for step in steps:
+			yield step
+
+		for step in postProcessSteps(self):
+			yield step
+
+	def walkClassicSteps(self, mapWidth, mapHeight):
+		# the original single drunkard
 		self.level = [[1
 			for y in range(mapHeight)]
 				for x in range(mapWidth)]
@@ -434,14 +475,15 @@ class DrunkardsWalk:
 
 		self.drunkardX = random.randint(2,mapWidth-2)
 		self.drunkardY = random.randint(2,mapHeight-2)
-		self.filledGoal = mapWidth*mapHeight*self._percentGoal
 
 		for i in xrange(self.walkIterations):
 			self.walk(mapWidth, mapHeight)
 			if (self._filled >= self.filledGoal):
 				break
-
-		return self.level
+			if (i & 1023 == 0):
+				if deadlinePassed(self, "walk"):
+					break
+				yield "walk"
 
 	def walk(self,mapWidth, mapHeight):
 		# ==== Choose Direction ====
@@ -507,6 +549,365 @@ class DrunkardsWalk:
 				self._filled += 1
 			self._previousDirection = direction
 
+	def getTransitionTable(self):
+		'''
+		Precompute the direction weights used by walk(). The table
+		is indexed by [previousDirection][xZone][yZone] and holds
+		the cumulative probabilities of north, south and east, so
+		a random number below the first value means north, and a
+		random number above the last means west.
+		previousDirection is 0-3 for north, south, east, west,
+		or 4 if there is no previous direction. Zones are 0 near
+		the low edge of the map, 2 near the high edge, else 1.
+		'''
+		table = []
+		for previousDirection in range(5):
+			xZones = []
+			for xZone in range(3):
+				yZones = []
+				for yZone in range(3):
+					weights = [1.0, 1.0, 1.0, 1.0] # north, south, east, west
+
+					# weight the random walk against edges
+					if xZone == 0:
+						weights[2] += self.weightedTowardCenter
+					elif xZone == 2:
+						weights[3] += self.weightedTowardCenter
+					if yZone == 0:
+						weights[1] += self.weightedTowardCenter
+					elif yZone == 2:
+						weights[0] += self.weightedTowardCenter
+
+					# weight the random walk in favor of the previous direction
+					if previousDirection < 4:
+						weights[previousDirection] += self.weightedTowardPreviousDirection
+
+					total = sum(weights)
+					cumulative = []
+					runningTotal = 0.0
+					for weight in weights[:3]:
+						runningTotal += weight/total
+						cumulative.append(runningTotal)
+					yZones.append(cumulative)
+				xZones.append(yZones)
+			table.append(xZones)
+		return table
+
+	def walkMultiple(self, mapWidth, mapHeight):
+		runSteps(self.walkMultipleSteps(mapWidth, mapHeight))
+
+	def walkMultipleSteps(self, mapWidth, mapHeight):
+		'''
+		Advance self.walkers drunkards in lockstep. Every walker
+		follows the same rules as walk(), but the direction weights
+		come from getTransitionTable() and, when NumPy is available,
+		all walkers are moved with a handful of array operations
+		per step using one batch of random numbers.
+		walkIterations is the total number of steps, shared
+		between the walkers.
+		Every walker starts on the same tile, so the cave is always
+		one connected region. With many walkers spreading out from
+		one point the cave does come out more open than the
+		classic engine's, with more floor tiles that have 4 open
+		neighbors, so cavesMatch() fails for this engine. Lower
+		self.walkers for caves closer to the classic ones.
+		'''
+		walkers = max(1,self.walkers)
+		steps = int(self.walkIterations/walkers)+1
+		if self.sharedFillGoal:
+			quota = self.filledGoal
+		else:
+			quota = self.filledGoal/walkers
+
+		if numpyAvailable:
+			walk = self._walkMultipleNumpy(mapWidth, mapHeight, walkers, steps, quota)
+		else:
+			walk = self._walkMultiplePython(mapWidth, mapHeight, walkers, steps, quota)
+		for step in walk:
+			yield step
+
+	def _walkMultipleNumpy(self, mapWidth, mapHeight, walkers, steps, quota):
+		rng = numpy.random.RandomState(random.getrandbits(32))
+		table = numpy.array(self.getTransitionTable())
+		dx = numpy.array([0, 0, 1, -1])
+		dy = numpy.array([-1, 1, 0, 0])
+
+		grid = numpy.ones((mapWidth,mapHeight), dtype=numpy.int8)
+		tiles = grid.reshape(-1) # tile (x,y) is tiles[x*mapHeight+y]
+
+		drunkardX = numpy.full(walkers, random.randint(2,mapWidth-2), dtype=numpy.intp)
+		drunkardY = numpy.full(walkers, random.randint(2,mapHeight-2), dtype=numpy.intp)
+		previousDirection = numpy.full(walkers, 4, dtype=numpy.intp)
+		filled = numpy.zeros(walkers, dtype=numpy.int64)
+		active = numpy.ones(walkers, dtype=bool)
+		totalFilled = 0
+
+		step = 0
+		done = False
+		while step < steps and not done:
+			if deadlinePassed(self, "walk"):
+				break
+			yield "walk"
+			choices = rng.random_sample((min(self.batchSize, steps-step), walkers))
+			for choice in choices:
+				step += 1
+				# ==== Choose Direction ====
+				xZone = (drunkardX >= mapWidth*0.25).astype(numpy.intp) + (drunkardX > mapWidth*0.75)
+				yZone = (drunkardY >= mapHeight*0.25).astype(numpy.intp) + (drunkardY > mapHeight*0.75)
+				thresholds = table[previousDirection, xZone, yZone]
+				direction = (choice[:,None] >= thresholds).sum(axis=1)
+
+				# ==== Walk ====
+				newX = drunkardX + dx[direction]
+				newY = drunkardY + dy[direction]
+				moved = (active & (0 < newX) & (newX < mapWidth-1) &
+					(0 < newY) & (newY < mapHeight-1))
+				drunkardX = numpy.where(moved, newX, drunkardX)
+				drunkardY = numpy.where(moved, newY, drunkardY)
+				previousDirection = numpy.where(moved, direction, previousDirection)
+
+				movedWalkers = numpy.flatnonzero(moved)
+				positions = drunkardX[movedWalkers]*mapHeight + drunkardY[movedWalkers]
+				isWall = tiles[positions] == 1
+				if isWall.any():
+					# two walkers can step onto the same wall, only count it once
+					positions, first = numpy.unique(positions[isWall], return_index=True)
+					tiles[positions] = 0
+					filled[movedWalkers[isWall][first]] += 1
+					totalFilled += len(positions)
+
+				if self.sharedFillGoal:
+					done = totalFilled >= quota
+				else:
+					active &= filled < quota
+					done = not active.any()
+				if done:
+					break
+
+		self._filled = totalFilled
+		self.level = grid.tolist()
+
+	def _walkMultiplePython(self, mapWidth, mapHeight, walkers, steps, quota):
+		table = self.getTransitionTable()
+		dx = [0, 0, 1, -1]
+		dy = [-1, 1, 0, 0]
+		lowX, highX = mapWidth*0.25, mapWidth*0.75
+		lowY, highY = mapHeight*0.25, mapHeight*0.75
+
+		self.level = [[1
+			for y in range(mapHeight)]
+				for x in range(mapWidth)]
+		level = self.level
+
+		startX = random.randint(2,mapWidth-2)
+		startY = random.randint(2,mapHeight-2)
+		drunkards = [[startX, startY, 4, 0]
+			for i in range(walkers)] # x, y, previousDirection, filled
+		totalFilled = 0
+
+		for i in xrange(steps):
+			done = True
+			for drunkard in drunkards:
+				x, y, previousDirection, filled = drunkard
+				if filled >= quota and not self.sharedFillGoal:
+					continue
+				done = False
+
+				# ==== Choose Direction ====
+				xZone = 0 if x < lowX else (2 if x > highX else 1)
+				yZone = 0 if y < lowY else (2 if y > highY else 1)
+				north, south, east = table[previousDirection][xZone][yZone]
+				choice = random.random()
+				if choice < north: direction = 0
+				elif choice < south: direction = 1
+				elif choice < east: direction = 2
+				else: direction = 3
+
+				# ==== Walk ====
+				x += dx[direction]
+				y += dy[direction]
+				if (0 < x < mapWidth-1) and (0 < y < mapHeight-1):
+					if level[x][y] == 1:
+						level[x][y] = 0
+						filled += 1
+						totalFilled += 1
+					drunkard[0:4] = [x, y, direction, filled]
+
+			if done or (self.sharedFillGoal and totalFilled >= quota):
+				break
+			if (i & 1023 == 0):
+				if deadlinePassed(self, "walk"):
+					break
+				yield "walk"
+
+		self._filled = totalFilled
+
+	def walkFrontier(self, mapWidth, mapHeight):
+		runSteps(self.walkFrontierSteps(mapWidth, mapHeight))
+
+	def walkFrontierSteps(self, mapWidth, mapHeight):
+		'''
+		Once the cave gets big, the drunkard spends most of its
+		steps wandering over floor it has already carved. This
+		walk keeps a list of floor tiles that still touch a wall
+		that can be carved (the frontier), and when the drunkard
+		goes maxStepsOnFloor steps without carving anything, it
+		is moved to a random frontier tile and keeps walking from
+		there. Since every jump lands next to uncarved rock, the
+		number of steps needed grows with the number of tiles
+		carved instead of with the area of the map.
+		'''
+		table = self.getTransitionTable()
+		dx = [0, 0, 1, -1]
+		dy = [-1, 1, 0, 0]
+		lowX, highX = mapWidth*0.25, mapWidth*0.75
+		lowY, highY = mapHeight*0.25, mapHeight*0.75
+
+		self.level = [[1
+			for y in range(mapHeight)]
+				for x in range(mapWidth)]
+		level = self.level
+
+		self._filled = 0
+		self.teleports = 0
+		frontier = []
+		stepsOnFloor = 0
+		previousDirection = 4
+
+		x = random.randint(2,mapWidth-2)
+		y = random.randint(2,mapHeight-2)
+		# every step either carves or counts toward the next jump
+		maxSteps = min(self.walkIterations,
+			int(self.filledGoal*(self.maxStepsOnFloor+1))+1)
+
+		for i in xrange(maxSteps):
+			if (i & 1023 == 0):
+				if deadlinePassed(self, "walk"):
+					break
+				yield "walk"
+			if stepsOnFloor >= self.maxStepsOnFloor:
+				jump = self._popFrontierTile(frontier,mapWidth,mapHeight)
+				if jump:
+					x, y = jump
+					self.teleports += 1
+				stepsOnFloor = 0
+
+			# ==== Choose Direction ====
+			xZone = 0 if x < lowX else (2 if x > highX else 1)
+			yZone = 0 if y < lowY else (2 if y > highY else 1)
+			north, south, east = table[previousDirection][xZone][yZone]
+			choice = random.random()
+			if choice < north: direction = 0
+			elif choice < south: direction = 1
+			elif choice < east: direction = 2
+			else: direction = 3
+
+			# ==== Walk ====
+			newX = x + dx[direction]
+			newY = y + dy[direction]
+			stepsOnFloor += 1
+			if (0 < newX < mapWidth-1) and (0 < newY < mapHeight-1):
+				x = newX
+				y = newY
+				previousDirection = direction
+				if level[x][y] == 1:
+					level[x][y] = 0
+					frontier.append((x,y))
+					self._filled += 1
+					stepsOnFloor = 0
+					if (self._filled >= self.filledGoal):
+						break
+
+	def _popFrontierTile(self, frontier, mapWidth, mapHeight):
+		'''
+		Returns a random tile from frontier that still touches a
+		carvable wall. Tiles that no longer do are dropped from
+		the list as they are found, so each tile is only ever
+		discarded once.
+		'''
+		level = self.level
+		while frontier:
+			i = random.randrange(len(frontier))
+			x, y = frontier[i]
+			if ((x > 1 and level[x-1][y] == 1) or
+				(x < mapWidth-2 and level[x+1][y] == 1) or
+				(y > 1 and level[x][y-1] == 1) or
+				(y < mapHeight-2 and level[x][y+1] == 1)):
+				return (x,y)
+			frontier[i] = frontier[-1]
+			frontier.pop()
+		return None
+
+	def getCaveStatistics(self, level):
+		'''
+		Describe the texture of a cave by the share of floor
+		tiles that have 1, 2, 3 or 4 open neighbors. Narrow
+		winding tunnels have mostly 1-2, wide open caverns
+		have mostly 3-4.
+		'''
+		mapWidth = len(level)
+		mapHeight = len(level[0])
+		openNeighbors = [0,0,0,0,0]
+		floor = 0
+		for x in xrange(1,mapWidth-1):
+			for y in xrange(1,mapHeight-1):
+				if level[x][y] == 0:
+					floor += 1
+					openNeighbors[(level[x-1][y] == 0) + (level[x+1][y] == 0) +
+						(level[x][y-1] == 0) + (level[x][y+1] == 0)] += 1
+		return [n/float(max(1,floor)) for n in openNeighbors]
+
+	def sampleCaveStatistics(self, mapWidth, mapHeight, engine, samples):
+		# getCaveStatistics() of samples levels made with engine
+		previousEngine = self.engine
+		self.engine = engine
+		try:
+			return [self.getCaveStatistics(self.generateLevel(mapWidth,mapHeight))
+				for i in xrange(samples)]
+		finally:
+			self.engine = previousEngine
+
+	def compareCaveCharacter(self, mapWidth, mapHeight, engine="frontier", samples=10):
+		'''
+		Generate samples levels with the classic engine and with
+		engine, and return the largest difference between their
+		average getCaveStatistics(). Differences of a few percent
+		are the same kind of cave, larger ones mean the engine
+		has changed how the caves look.
+		'''
+		averages = []
+		for testEngine in ["classic", engine]:
+			statistics = self.sampleCaveStatistics(mapWidth, mapHeight, testEngine, samples)
+			averages.append([sum(column)/samples for column in zip(*statistics)])
+		return max(abs(a-b) for a,b in zip(averages[0],averages[1]))
+
+	def cavesMatch(self, mapWidth, mapHeight, engine="frontier", samples=20, tolerance=4.0):
+		'''
+		Checks that engine makes the same kind of cave as the
+		classic engine. For each share in getCaveStatistics(), the
+		difference between the two averages must be within
+		tolerance standard errors (a two sample z test), so that
+		the check gets stricter as samples grows instead of
+		relying on a fixed percentage. Returns True if every share
+		passes.
+		'''
+		results = []
+		for testEngine in ["classic", engine]:
+			statistics = self.sampleCaveStatistics(mapWidth, mapHeight, testEngine, samples)
+			columns = []
+			for column in zip(*statistics):
+				mean = sum(column)/samples
+				variance = sum((value-mean)**2 for value in column)/max(1,samples-1)
+				columns.append((mean, variance))
+			results.append(columns)
+
+		for (meanA, varianceA), (meanB, varianceB) in zip(results[0], results[1]):
+			standardError = sqrt((varianceA + varianceB)/samples)
+			# the small floor keeps shares that never vary (always 0) from failing on rounding
+			if abs(meanA - meanB) > tolerance*standardError + 1e-9:
+				return False
+		return True
+
 # ==== Cellular Automata ====
 class CellularAutomata:
 	'''
@@ -517,35 +918,101 @@ class CellularAutomata:
 	'''
 	def __init__(self):
 		self.level = []
+		self.repairConnectivity = False # join separate floor regions after generating
+		self.pipeline = None # a postProcessing.Pipeline to run on every level
 
 		self.iterations = 30000
 		self.neighbors = 4 # number of neighboring walls for this cell to become a wall
 		self.wallProbability = 0.50 # the initial probability of a cell becoming a wall, recommended to be between .35 and .55
 
+		self.engine = "classic" # "classic" updates random tiles, "bitboard", "parallel" and "hashlife" step every tile at once (hashlife is slower than bitboard for every map size)
+		self.generations = 5 # steps taken by the bitboard, parallel and hashlife engines
+		self.processes = None # used by the parallel engine, defaults to one per core
+
 		self.ROOM_MIN_SIZE = 16 # size in total number of cells, not dimensions
 		self.ROOM_MAX_SIZE = 500 # size in total number of cells, not dimensions
 
 		self.smoothEdges = True
 		self.smoothing =  1
 
-	def generateLevel(self, mapWidth, mapHeight):
+		self.budget = GenerationBudget()
+
+	def generateLevel(self, mapWidth, mapHeight, deadline=None):
+		runSteps(self.generateLevelSteps(mapWidth, mapHeight, deadline))
+		return self.level
+
+	def generateLevelSteps(self, mapWidth, mapHeight, deadline=None):
+		# generateLevel, yielding after each bounded unit of work
+		self.deadline = deadline # stop optional phases at this time.time()
+		self.truncatedPhases = []
 		# Creates an empty 2D array or clears existing array
+		self.budget.start(self)
 		self.caves = []
 
+		if (self.engine == "parallel"):
+			for step in self.generateParallelSteps(mapWidth,mapHeight):
+				yield step
+			for step in postProcessSteps(self):
+				yield step
+			return
+
 		self.level = [[1
 			for y in range(mapHeight)]
 				for x in range(mapWidth)]
 
 		self.randomFillMap(mapWidth,mapHeight)
-		
-		self.createCaves(mapWidth,mapHeight)
+		yield "randomFillMap"
+
+		for step in self.createCavesSteps(mapWidth,mapHeight):
+			yield step
 
 		self.getCaves(mapWidth,mapHeight)
+		yield "getCaves"
 
-		self.connectCaves(mapWidth,mapHeight)
+		for step in self.connectCavesSteps(mapWidth,mapHeight):
+			yield step
 
-		self.cleanUpMap(mapWidth,mapHeight)
-		return self.level
+		for step in self.cleanUpMapSteps(mapWidth,mapHeight):
+			yield step
+		for step in postProcessSteps(self):
+			yield step
+
+	def generateParallelSteps(self, mapWidth, mapHeight):
+		'''
+		generateLevel for the parallel engine, which is only needed
+		for huge maps and needs Python 3. Every phase that looks at
+		the whole map runs in strips, one process each, on one
+		shared copy of the map (see parallelAutomata): the random
+		fill, the automata, the smoothing, labeling the caves and
+		the search for the gaps between them. Only the tunnels are
+		carved in this process. The map is filled from its own
+		seed, taken from the random module, so levels depend on
+		random.seed but not on the number of processes. The
+		smoothing passes are synchronous, so they aren't quite the
+		same as cleanUpMap's.
+		'''
+		import parallelAutomata
+		world = parallelAutomata.ParallelAutomata(mapWidth, mapHeight, self.processes)
+		try:
+			world.randomFill(random.getrandbits(32), self.wallProbability)
+			yield "randomFillMap"
+			world.run(self.generations, self.neighbors)
+			yield "createCaves"
+			for step in self.cleanUpWorldSteps(world):
+				yield step
+
+			# carve straight into the shared map
+			self.level = world.columns()
+			self.getCavesFromRegions(world.labelRegions())
+			yield "getCaves"
+			postProcessing.connectGaps(self.level, len(self.caves), world.regionGaps(self.caves))
+			yield "connectCaves"
+
+			for step in self.cleanUpWorldSteps(world):
+				yield step
+			self.level = world.toLevel()
+		finally:
+			world.close()
 
 	def randomFillMap(self,mapWidth,mapHeight):
 		for y in range (1,mapHeight-1):
@@ -555,30 +1022,77 @@ class CellularAutomata:
 					self.level[x][y] = 0
 
 	def createCaves(self,mapWidth,mapHeight):
+		runSteps(self.createCavesSteps(mapWidth,mapHeight))
+
+	def createCavesSteps(self,mapWidth,mapHeight):
+		# yields after every 1024 iterations
 		# ==== Create distinct caves ====
-		for i in xrange (0,self.iterations):
-			# Pick a random point with a buffer around the edges of the map
-			tileX = random.randint(1,mapWidth-2) #(2,mapWidth-3)
-			tileY = random.randint(1,mapHeight-2) #(2,mapHeight-3)
-
-			# if the cell's neighboring walls > self.neighbors, set it to 1
-			if self.getAdjacentWalls(tileX,tileY) > self.neighbors:
-				self.level[tileX][tileY] = 1
-			# or set it to 0
-			elif self.getAdjacentWalls(tileX,tileY) < self.neighbors:
-				self.level[tileX][tileY] = 0
+		if (self.engine == "bitboard"):
+			board = bitboardAutomata.toBitboard(self.level)
+			for i in xrange(self.generations):
+				board = bitboardAutomata.step(board, mapHeight, self.neighbors)
+				yield "createCaves"
+			self.level = bitboardAutomata.fromBitboard(board, mapHeight)
+		elif (self.engine == "parallel"):
+			# only needed for huge maps, and needs Python 3
+			import parallelAutomata
+			world = parallelAutomata.ParallelAutomata.fromLevel(self.level, self.processes)
+			try:
+				world.run(self.generations, self.neighbors)
+				yield "createCaves"
+				for step in self.cleanUpWorldSteps(world):
+					yield step
+				self.level = world.toLevel()
+			finally:
+				world.close()
+			return
+		elif (self.engine == "hashlife"):
+			automata = hashlifeAutomata.HashlifeAutomata(self.level,
+				neighborhoodRules.automataRule(self.neighbors))
+			for i in xrange(self.generations):
+				automata.step()
+				yield "createCaves"
+			self.level = automata.toLevel()
+			self.hashlifeStats = automata.stats()
+		else:
+			for i in xrange (0,self.iterations):
+				if (i & 1023 == 1023):
+					yield "createCaves"
+				# Pick a random point with a buffer around the edges of the map
+				tileX = random.randint(1,mapWidth-2) #(2,mapWidth-3)
+				tileY = random.randint(1,mapHeight-2) #(2,mapHeight-3)
+
+				# if the cell's neighboring walls > self.neighbors, set it to 1
+				if self.getAdjacentWalls(tileX,tileY) > self.neighbors:
+					self.level[tileX][tileY] = 1
+				# or set it to 0
+				elif self.getAdjacentWalls(tileX,tileY) < self.neighbors:
+					self.level[tileX][tileY] = 0
 
 		# ==== Clean Up Map ====
-		self.cleanUpMap(mapWidth,mapHeight)
+		for step in self.cleanUpMapSteps(mapWidth,mapHeight):
+			yield step
 
 	def cleanUpMap(self,mapWidth,mapHeight):
+		runSteps(self.cleanUpMapSteps(mapWidth,mapHeight))
+
+	def cleanUpMapSteps(self,mapWidth,mapHeight):
+		# yields after each smoothing pass
 		if (self.smoothEdges):
 			for i in xrange (0,5):
+				if deadlinePassed(self, "cleanUpMap"):
+					break
 				# Look at each cell individually and check for smoothness
-				for x in range(1,mapWidth-1):
-					for y in range (1,mapHeight-1):
-						if (self.level[x][y] == 1) and (self.getAdjacentWallsSimple(x,y) <= self.smoothing):
-							self.level[x][y] = 0
+				neighborhoodRules.sweep(self.level, neighborhoodRules.smoothingRule(self.smoothing),
+					1,1,mapWidth-1,mapHeight-1)
+				yield "cleanUpMap"
+
+	def cleanUpWorldSteps(self, world):
+		# cleanUpMapSteps for a parallelAutomata.ParallelAutomata, smoothing in strips
+		if (self.smoothEdges):
+			if not deadlinePassed(self, "cleanUpMap"):
+				world.smooth(5, self.smoothing)
+				yield "cleanUpMap"
 
 	def createTunnel(self,point1,point2,currentCave,mapWidth,mapHeight):
 		# run a heavily weighted random Walk 
@@ -586,6 +1100,7 @@ class CellularAutomata:
 		drunkardX = point2[0]
 		drunkardY = point2[1]
 		while (drunkardX,drunkardY) not in currentCave:
+			self.budget.tick("createTunnel")
 			# ==== Choose Direction ====
 			north = 1.0
 			south = 1.0
@@ -635,28 +1150,10 @@ class CellularAutomata:
 					self.level[drunkardX][drunkardY] = 0
 
 	def getAdjacentWallsSimple(self, x, y): # finds the walls in four directions
-		wallCounter = 0
-		#print("(",x,",",y,") = ",self.level[x][y])
-		if (self.level[x][y-1] == 1): # Check north
-			wallCounter += 1
-		if (self.level[x][y+1] == 1): # Check south
-			wallCounter += 1
-		if (self.level[x-1][y] == 1): # Check west
-			wallCounter += 1
-		if (self.level[x+1][y] == 1): # Check east
-			wallCounter += 1
-
-		return wallCounter
+		return neighborhoodRules.WALLS4[neighborhoodRules.neighborhoodMask(self.level,x,y)]
 
 	def getAdjacentWalls(self, tileX, tileY): # finds the walls in 8 directions
-		pass
-		wallCounter = 0
-		for x in range (tileX-1, tileX+2):
-			for y in range (tileY-1, tileY+2):
-				if (self.level[x][y] == 1):
-					if (x != tileX) or (y != tileY): # exclude (tileX,tileY)
-						wallCounter += 1
-		return wallCounter
+		return neighborhoodRules.WALLS8[neighborhoodRules.neighborhoodMask(self.level,tileX,tileY)]
 
 	def getCaves(self, mapWidth, mapHeight):
 		# locate all the caves within self.level and stor them in self.caves
@@ -681,6 +1178,20 @@ class CellularAutomata:
 				if self.level[x][y] == 2:
 					print("(",x,",",y,")")
 
+	def getCavesFromRegions(self, regions):
+		'''
+		getCaves for regions that are already labeled, as lists of
+		(x, top, bottom) runs. Fills in the regions that are too
+		small, and keeps the rest, as runs, in self.caves.
+		'''
+		self.caves = []
+		for region in regions:
+			if levelMetrics.regionSize(region) >= self.ROOM_MIN_SIZE:
+				self.caves.append(region)
+			else:
+				for x, top, bottom in region:
+					carving.carveVertical(self.level, top, bottom-1, x, 1)
+
 	def floodFill(self,x,y):
 		'''
 		flood fill the separate regions of the level, discard
@@ -716,6 +1227,10 @@ class CellularAutomata:
 			self.caves.append(cave)
 
 	def connectCaves(self, mapWidth, mapHeight):
+		runSteps(self.connectCavesSteps(mapWidth, mapHeight))
+
+	def connectCavesSteps(self, mapWidth, mapHeight):
+		# yields after each cave
 		# Find the closest cave to the current cave
 		for currentCave in self.caves:
 			for point1 in currentCave: break # get an element from cave1
@@ -727,12 +1242,13 @@ class CellularAutomata:
 					for nextPoint in nextCave: break # get an element from cave1
 					# compare distance of point1 to old and new point2
 					newDistance = self.distanceFormula(point1,nextPoint)
-					if (newDistance < distance) or distance == None:
+					if distance == None or (newDistance < distance):
 						point2 = nextPoint
 						distance = newDistance
 
 			if point2: # if all tunnels are connected, point2 == None
 				self.createTunnel(point1,point2,currentCave,mapWidth,mapHeight)
+			yield "connectCaves"
 
 	def distanceFormula(self,point1,point2):
 		d = sqrt( (point2[0]-point1[0])**2 + (point2[1]-point1[1])**2)
@@ -786,6 +1302,8 @@ class RoomAddition:
 	'''
 	def __init__(self):
 		self.level = []
+		self.repairConnectivity = False # join separate floor regions after generating
+		self.pipeline = None # a postProcessing.Pipeline to run on every level
 
 		self.ROOM_MAX_SIZE = 18 # max height and width for cellular automata rooms
 		self.ROOM_MIN_SIZE = 16 # min size in number of floor tiles, not height and width
@@ -802,10 +1320,14 @@ class RoomAddition:
 
 		self.wallProbability = 0.45
 		self.neighbors = 4
+		self.automataEngine = "classic" # "bitboard" steps every tile of a room at once
 
 		self.squareRoomChance = 0.2
 		self.crossRoomChance = 0.15
 
+		self.roomSynthesisAttempts = 20 # cellular automata rooms to try before using a square room
+		self.roomSynthesisStats = {"attempts":0, "retries":0, "fallbacks":0}
+
 		self.buildRoomAttempts = 500
 		self.placeRoomAttempts = 20
 		self.maxTunnelLength = 12
@@ -815,8 +1337,19 @@ class RoomAddition:
 		self.shortcutLength = 5
 		self.minPathfindingDistance = 50
 
-	def generateLevel(self,mapWidth,mapHeight):
+		self.budget = GenerationBudget()
+
+	def generateLevel(self,mapWidth,mapHeight,deadline=None):
+		runSteps(self.generateLevelSteps(mapWidth,mapHeight,deadline))
+		return self.level
+
+	def generateLevelSteps(self,mapWidth,mapHeight,deadline=None):
+		# generateLevel, yielding after each bounded unit of work
+		self.deadline = deadline # stop optional phases at this time.time()
+		self.truncatedPhases = []
+		self.budget.start(self)
 		self.rooms = []
+		self.roomSynthesisStats = {"attempts":0, "retries":0, "fallbacks":0}
 
 		self.level = [[1
 			for y in range(mapHeight)]
@@ -825,12 +1358,15 @@ class RoomAddition:
 		# generate the first room
 		room = self.generateRoom()
 		roomWidth,roomHeight = self.getRoomDimensions(room)
-		roomX = (mapWidth/2 - roomWidth/2)-1
-		roomY = (mapHeight/2 - roomHeight/2)-1
+		roomX = (mapWidth//2 - roomWidth//2)-1
+		roomY = (mapHeight//2 - roomHeight//2)-1
 		self.addRoom(roomX,roomY,room)
-		
+		yield "buildRooms"
+
 		# generate other rooms
 		for i in range(self.buildRoomAttempts):
+			if deadlinePassed(self, "buildRooms"):
+				break
 			room = self.generateRoom()
 			# try to position the room, get roomX and roomY
 			roomX,roomY,wallTile,direction, tunnelLength = self.placeRoom(room,mapWidth,mapHeight)
@@ -839,11 +1375,13 @@ class RoomAddition:
 				self.addTunnel(wallTile,direction,tunnelLength)
 				if len(self.rooms) >= self.MAX_NUM_ROOMS:
 					break
+			yield "buildRooms"
 
 		if self.includeShortcuts == True:
-			self.addShortcuts(mapWidth,mapHeight)
-
-		return self.level
+			for step in self.addShortcutsSteps(mapWidth,mapHeight):
+				yield step
+		for step in postProcessSteps(self):
+			yield step
 
 	def generateRoom(self):
 		# select a room type to generate
@@ -869,26 +1407,26 @@ class RoomAddition:
 		return room
 
 	def generateRoomCross(self):
-		roomHorWidth = (random.randint(self.CROSS_ROOM_MIN_SIZE+2,self.CROSS_ROOM_MAX_SIZE))/2*2
+		roomHorWidth = (random.randint(self.CROSS_ROOM_MIN_SIZE+2,self.CROSS_ROOM_MAX_SIZE))//2*2
 
-		roomVirHeight = (random.randint(self.CROSS_ROOM_MIN_SIZE+2,self.CROSS_ROOM_MAX_SIZE))/2*2
+		roomVirHeight = (random.randint(self.CROSS_ROOM_MIN_SIZE+2,self.CROSS_ROOM_MAX_SIZE))//2*2
 
-		roomHorHeight = (random.randint(self.CROSS_ROOM_MIN_SIZE,roomVirHeight-2))/2*2
+		roomHorHeight = (random.randint(self.CROSS_ROOM_MIN_SIZE,roomVirHeight-2))//2*2
 
-		roomVirWidth = (random.randint(self.CROSS_ROOM_MIN_SIZE,roomHorWidth-2))/2*2
+		roomVirWidth = (random.randint(self.CROSS_ROOM_MIN_SIZE,roomHorWidth-2))//2*2
 
 		room = [[1
 			for y in xrange(roomVirHeight)]
 				for x in xrange(roomHorWidth)]
 
 		# Fill in horizontal space
-		virOffset = roomVirHeight/2 - roomHorHeight/2
+		virOffset = roomVirHeight//2 - roomHorHeight//2
 		for y in xrange(virOffset,roomHorHeight+virOffset):
 			for x in xrange(0,roomHorWidth):
 				room[x][y] = 0
 
 		# Fill in virtical space
-		horOffset = roomHorWidth/2 - roomVirWidth/2
+		horOffset = roomHorWidth//2 - roomVirWidth//2
 		for y in xrange(0,roomVirHeight):
 			for x in xrange(horOffset,roomVirWidth+horOffset):
 				room[x][y] = 0
@@ -910,74 +1448,52 @@ class RoomAddition:
 		return room
 
 	def generateRoomCellularAutomata(self):
-		while True:
-			# if a room is too small, generate another
-			room = [[1
-				for y in range(self.ROOM_MAX_SIZE)]
-					for x in range(self.ROOM_MAX_SIZE)]
-
-			# random fill map
-			for y in range (2,self.ROOM_MAX_SIZE-2):
-				for x in range (2,self.ROOM_MAX_SIZE-2):
-					if random.random() >= self.wallProbability:
-						room[x][y] = 0
-
-			# create distinctive regions
-			for i in range(4):
-				for y in range (1,self.ROOM_MAX_SIZE-1):
-					for x in range (1,self.ROOM_MAX_SIZE-1):
-
-						# if the cell's neighboring walls > self.neighbors, set it to 1
-						if self.getAdjacentWalls(x,y,room) > self.neighbors:
-							room[x][y] = 1
-						# otherwise, set it to 0
-						elif self.getAdjacentWalls(x,y,room) < self.neighbors:
-							room[x][y] = 0
-
-			# floodfill to remove small caverns
-			room = self.floodFill(room)
-
-			# start over if the room is completely filled in
-			roomWidth,roomHeight = self.getRoomDimensions(room)
-			for x in range (roomWidth):
-				for y in range (roomHeight):
-					if room[x][y] == 0:
-						return room
+		return self.generateRoomAutomata(self.ROOM_MAX_SIZE)
 
 	def generateRoomCavern(self):
-		while True:
-			# if a room is too small, generate another
+		return self.generateRoomAutomata(self.CAVERN_MAX_SIZE)
+
+	def generateRoomAutomata(self, size):
+		'''
+		Grow a cave shaped room with a cellular automata. If the
+		room comes out with no region of at least ROOM_MIN_SIZE,
+		try again, up to roomSynthesisAttempts times, then settle
+		for a square room so that generation time stays bounded.
+		'''
+		for attempt in xrange(self.roomSynthesisAttempts):
+			self.budget.tick("generateRoomAutomata", size*size)
+			self.roomSynthesisStats["attempts"] += 1
 			room = [[1
-				for y in range(self.CAVERN_MAX_SIZE)]
-					for x in range(self.CAVERN_MAX_SIZE)]
+				for y in range(size)]
+					for x in range(size)]
 
 			# random fill map
-			for y in range (2,self.CAVERN_MAX_SIZE-2):
-				for x in range (2,self.CAVERN_MAX_SIZE-2):
+			for y in range (2,size-2):
+				for x in range (2,size-2):
 					if random.random() >= self.wallProbability:
 						room[x][y] = 0
 
 			# create distinctive regions
-			for i in range(4):
-				for y in range (1,self.CAVERN_MAX_SIZE-1):
-					for x in range (1,self.CAVERN_MAX_SIZE-1):
-
-						# if the cell's neighboring walls > self.neighbors, set it to 1
-						if self.getAdjacentWalls(x,y,room) > self.neighbors:
-							room[x][y] = 1
-						# otherwise, set it to 0
-						elif self.getAdjacentWalls(x,y,room) < self.neighbors:
-							room[x][y] = 0
+			if (self.automataEngine == "bitboard"):
+				room = bitboardAutomata.runAutomata(room, 4, self.neighbors)
+			else:
+				for i in range(4):
+					# if the cell's neighboring walls > self.neighbors, set it to 1
+					# if they are < self.neighbors, set it to 0
+					neighborhoodRules.sweepRows(room, neighborhoodRules.automataRule(self.neighbors),
+						1,1,size-1,size-1)
 
 			# floodfill to remove small caverns
-			room = self.floodFill(room)
+			room, floorTiles = self.floodFill(room)
+
+			if floorTiles > 0:
+				return room
 
-			# start over if the room is completely filled in
-			roomWidth,roomHeight = self.getRoomDimensions(room)
-			for x in range (roomWidth):
-				for y in range (roomHeight):
-					if room[x][y] == 0:
-						return room
+			# the room is completely filled in, start over
+			self.roomSynthesisStats["retries"] += 1
+
+		self.roomSynthesisStats["fallbacks"] += 1
+		return self.generateRoomSquare()
 
 	def floodFill(self,room):
 		'''
@@ -1022,7 +1538,7 @@ class RoomAddition:
 		for tile in largestRegion:
 			room[tile[0]][tile[1]] = 0
 
-		return room
+		return room, len(largestRegion)
 
 	def placeRoom(self,room, mapWidth, mapHeight): #(self,room,direction,)
 		roomX = None
@@ -1043,6 +1559,7 @@ class RoomAddition:
 				chosen direction and has a floor in the 
 				opposite direction.
 				'''
+				self.budget.tick("placeRoom")
 				#direction == tuple(dx,dy)
 				tileX = random.randint(1,mapWidth-2)
 				tileY = random.randint(1,mapHeight-2)
@@ -1059,6 +1576,7 @@ class RoomAddition:
 			random floor tile instead of the top left floor tile
 			'''
 			while not startRoomX and not startRoomY:
+				self.budget.tick("placeRoom")
 				x = random.randint(0,roomWidth-1)
 				y =  random.randint(0,roomHeight-1)
 				if room[x][y] == 0:
@@ -1106,15 +1624,17 @@ class RoomAddition:
 		startX = wallTile[0] + direction[0]*tunnelLength
 		startY = wallTile[1] + direction[1]*tunnelLength
 		#self.level[startX][startY] = 1
-		
-		for i in range(self.maxTunnelLength):
-			x = startX - direction[0]*i
-			y = startY - direction[1]*i
-			self.level[x][y] = 0
-			# If you want doors, this is where the code should go
-			if ((x+direction[0]) == wallTile[0] and 
-				(y+direction[1]) == wallTile[1]):
-				break
+
+		# the tunnel runs back to the tile just past wallTile,
+		# but is never longer than maxTunnelLength
+		length = min(tunnelLength+2, self.maxTunnelLength)
+		endX = startX - direction[0]*(length-1)
+		endY = startY - direction[1]*(length-1)
+		# If you want doors, this is where the code should go
+		if direction[0] == 0:
+			carving.carveVertical(self.level, startY, endY, startX)
+		else:
+			carving.carveHorizontal(self.level, startX, endX, startY)
 		
 	def getRoomDimensions(self,room):
 		if room:
@@ -1127,13 +1647,7 @@ class RoomAddition:
 			return roomWidth, roomHeight
 
 	def getAdjacentWalls(self, tileX, tileY, room): # finds the walls in 8 directions
-		wallCounter = 0
-		for x in range (tileX-1, tileX+2):
-			for y in range (tileY-1, tileY+2):
-				if (room[x][y] == 1):
-					if (x != tileX) or (y != tileY): # exclude (tileX,tileY)
-						wallCounter += 1
-		return wallCounter
+		return neighborhoodRules.WALLS8[neighborhoodRules.neighborhoodMask(room,tileX,tileY)]
 
 	def getDirection(self):
 		# direction = (dx,dy)
@@ -1188,6 +1702,10 @@ class RoomAddition:
 		return True
 
 	def addShortcuts(self,mapWidth,mapHeight):
+		runSteps(self.addShortcutsSteps(mapWidth,mapHeight))
+
+	def addShortcutsSteps(self,mapWidth,mapHeight):
+		# yields after each shortcut attempt
 		'''
 		I use libtcodpy's built in pathfinding here, since I'm
 		already using libtcodpy for the iu. At the moment, 
@@ -1202,10 +1720,14 @@ class RoomAddition:
 		#initialize the libtcodpy map
 		libtcodMap = libtcod.map_new(mapWidth,mapHeight)
 		self.recomputePathMap(mapWidth,mapHeight,libtcodMap)
+		pathMap = None
 
 		for i in xrange(self.shortcutAttempts):
+			if deadlinePassed(self, "addShortcuts"):
+				break
 			# check i times for places where shortcuts can be made
 			while True:
+				self.budget.tick("addShortcuts")
 				#Pick a random floor tile
 				floorX = random.randint(self.shortcutLength+1,(mapWidth-self.shortcutLength-1))
 				floorY = random.randint(self.shortcutLength+1,(mapHeight-self.shortcutLength-1))
@@ -1233,10 +1755,11 @@ class RoomAddition:
 								# make shortcut
 								self.carveShortcut(floorX,floorY,newX,newY)
 								self.recomputePathMap(mapWidth,mapHeight,libtcodMap)
-
+			yield "addShortcuts"
 
 		# destroy the path object
-		libtcod.path_delete(pathMap)
+		if pathMap:
+			libtcod.path_delete(pathMap)
 
 	def recomputePathMap(self,mapWidth,mapHeight,libtcodMap):
 		for x in xrange(mapWidth):
@@ -1249,33 +1772,15 @@ class RoomAddition:
 	def carveShortcut(self,x1,y1,x2,y2):
 		if x1-x2 == 0:
 			# Carve virtical tunnel
-			for y in xrange(min(y1,y2),max(y1,y2)+1):
-				self.level[x1][y] = 0
+			carving.carveVertical(self.level, y1, y2, x1)
 
 		elif y1-y2 == 0:
 			# Carve Horizontal tunnel
-			for x in xrange(min(x1,x2),max(x1,x2)+1):
-				self.level[x][y1] = 0
-
-		elif (y1-y2)/(x1-x2) == 1:
-			# Carve NW to SE Tunnel
-			x = min(x1,x2)
-			y = min(y1,y2)
-			while x != max(x1,x2):
-				x+=1
-				self.level[x][y] = 0
-				y+=1
-				self.level[x][y] = 0
-
-		elif (y1-y2)/(x1-x2) == -1:
-			# Carve NE to SW Tunnel
-			x = min(x1,x2)
-			y = max(y1,y2)
-			while x != max(x1,x2):
-				x += 1
-				self.level[x][y] = 0
-				y -= 1
-				self.level[x][y] = 0
+			carving.carveHorizontal(self.level, x1, x2, y1)
+
+		elif abs(y1-y2) == abs(x1-x2):
+			# Carve NW to SE or NE to SW Tunnel
+			carving.carveDiagonal(self.level, x1, y1, x2, y2)
 
 	def checkRoomExists(self,room):
 		roomWidth, roomHeight = self.getRoomDimensions(room)
@@ -1298,52 +1803,50 @@ class CityWalls:
 	'''
 	def __init__(self):
 		self.level = []
+		self.repairConnectivity = False # join separate floor regions after generating
+		self.pipeline = None # a postProcessing.Pipeline to run on every level
 		self.room = None
 		self.MAX_LEAF_SIZE = 30
 		self.ROOM_MAX_SIZE = 16
 		self.ROOM_MIN_SIZE = 8
 
-	def generateLevel(self, mapWidth, mapHeight):
+	def generateLevel(self, mapWidth, mapHeight, deadline=None):
+		runSteps(self.generateLevelSteps(mapWidth, mapHeight, deadline))
+		return self.level
+
+	def generateLevelSteps(self, mapWidth, mapHeight, deadline=None):
+		# generateLevel, yielding after each bounded unit of work
+		self.deadline = deadline # stop optional phases at this time.time()
+		self.truncatedPhases = []
 		# Creates an empty 2D array or clears existing array
 		self.level = [[0
 			for y in range(mapHeight)]
 				for x in range(mapWidth)]
 
-		self._leafs = []
 		self.rooms = []
-
-		rootLeaf = Leaf(0,0,mapWidth,mapHeight)
-		self._leafs.append(rootLeaf)
-
-		splitSuccessfully = True
-		# loop through all leaves until they can no longer split successfully
-		while (splitSuccessfully):
-			splitSuccessfully = False
-			for l in self._leafs:
-				if (l.child_1 == None) and (l.child_2 == None):
-					if ((l.width > self.MAX_LEAF_SIZE) or 
-					(l.height > self.MAX_LEAF_SIZE) or
-					(random.random() > 0.8)):
-						if (l.splitLeaf()): #try to split the leaf
-							self._leafs.append(l.child_1)
-							self._leafs.append(l.child_2)
-							splitSuccessfully = True
-
-		rootLeaf.createRooms(self)
+		self._roomSet = set()
+
+		bspBuilder = BSPBuilder(self.MAX_LEAF_SIZE)
+		for step in bspBuilder.buildTreeSteps(mapWidth,mapHeight,deadline):
+			yield step
+		rootLeaf = bspBuilder.rootLeaf
+		self._leafs = bspBuilder.leafs
+		if bspBuilder.truncated:
+			self.truncatedPhases.append("splitLeafs")
+
+		for step in bspBuilder.createRoomsSteps(rootLeaf, self.createRoom, self.createHall,
+			self.ROOM_MIN_SIZE, self.ROOM_MAX_SIZE):
+			yield step
 		self.createDoors()
-
-		return self.level
+		for step in postProcessSteps(self):
+			yield step
 
 	def createRoom(self, room):
 		# Build Walls
 		# set all tiles within a rectangle to 1
-		for x in range(room.x1 + 1, room.x2):
-			for y in range(room.y1+1, room.y2):
-				self.level[x][y] = 1
+		carving.carveRoom(self.level, room, 1)
 		# Build Interior
-		for x in range(room.x1+2,room.x2-1):
-			for y in range(room.y1+2,room.y2-1):
-				self.level[x][y] = 0
+		carving.carveRect(self.level, room.x1+2, room.y1+2, room.x2-1, room.y2-1)
 
 	def createDoors(self):
 		for room in self.rooms:
@@ -1371,7 +1874,8 @@ class CityWalls:
 		# used by other dungeon Generators, it was simpler to 
 		# repurpose the createHall method that to alter the leaf class.
 		for room in [room1, room2]:
-			if room not in self.rooms:
+			if room not in self._roomSet:
+				self._roomSet.add(room)
 				self.rooms.append(room)
 
 # ==== Maze With Rooms ====
@@ -1383,6 +1887,8 @@ class MazeWithRooms:
 	'''
 	def __init__(self):
 		self.level = []
+		self.repairConnectivity = False # join separate floor regions after generating
+		self.pipeline = None # a postProcessing.Pipeline to run on every level
 
 		self.ROOM_MAX_SIZE = 13
 		self.ROOM_MIN_SIZE = 6
@@ -1393,7 +1899,17 @@ class MazeWithRooms:
 		self.windingPercent = 0.1
 		self.allowDeadEnds = False
 
-	def generateLevel(self,mapWidth,mapHeight):
+		self.budget = GenerationBudget()
+
+	def generateLevel(self,mapWidth,mapHeight,deadline=None):
+		runSteps(self.generateLevelSteps(mapWidth,mapHeight,deadline))
+		return self.level
+
+	def generateLevelSteps(self,mapWidth,mapHeight,deadline=None):
+		# generateLevel, yielding after each bounded unit of work
+		self.deadline = deadline # stop optional phases at this time.time()
+		self.truncatedPhases = []
+		self.budget.start(self)
 		# The level dimensions must be odd
 		self.level = [[1
 			for y in range(mapHeight)]
@@ -1407,7 +1923,8 @@ class MazeWithRooms:
 
 		self._currentRegion = -1 # the index of the current region in _regions
 
-		self.addRooms(mapWidth,mapHeight)#?
+		for step in self.addRoomsSteps(mapWidth,mapHeight):#?
+			yield step
 
 		# Fill in the empty space around the rooms with mazes
 		for y in range (1,mapHeight,2):
@@ -1415,16 +1932,23 @@ class MazeWithRooms:
 				if self.level[x][y] != 1:
 					continue
 				start = (x,y)
-				self.growMaze(start,mapWidth,mapHeight)
+				for step in self.growMazeSteps(start,mapWidth,mapHeight):
+					yield step
 
-		self.connectRegions(mapWidth,mapHeight)
+		for step in self.connectRegionsSteps(mapWidth,mapHeight):
+			yield step
 
 		if not self.allowDeadEnds: 
-			self.removeDeadEnds(mapWidth,mapHeight)
-
-		return self.level
+			for step in self.removeDeadEndsSteps(mapWidth,mapHeight):
+				yield step
+		for step in postProcessSteps(self):
+			yield step
 
 	def growMaze(self,start,mapWidth,mapHeight):
+		runSteps(self.growMazeSteps(start,mapWidth,mapHeight))
+
+	def growMazeSteps(self,start,mapWidth,mapHeight):
+		# yields after each cell
 		north = (0,-1)
 		south = (0,1)
 		east = (1,0)
@@ -1478,10 +2002,17 @@ class MazeWithRooms:
 				# No adjacent uncarved cells
 				cells.pop()
 				lastDirection = None
+			yield "growMaze"
 
 	def addRooms(self,mapWidth,mapHeight):
-		rooms = []
+		runSteps(self.addRoomsSteps(mapWidth,mapHeight))
+
+	def addRoomsSteps(self,mapWidth,mapHeight):
+		# yields after each room attempt
+		rooms = RectIndex(self.ROOM_MAX_SIZE)
 		for i in range(self.buildRoomAttempts):
+			if deadlinePassed(self, "buildRooms"):
+				break
 
 			'''
 			Pick a random room size and ensure that rooms have odd 
@@ -1489,24 +2020,25 @@ class MazeWithRooms:
 			'''
 			roomWidth = random.randint(int(self.ROOM_MIN_SIZE/2),int(self.ROOM_MAX_SIZE/2))*2+1
 			roomHeight = random.randint(int(self.ROOM_MIN_SIZE/2),int(self.ROOM_MAX_SIZE/2))*2+1
-			x = (random.randint(0,mapWidth-roomWidth-1)/2)*2+1
-			y = (random.randint(0,mapHeight-roomHeight-1)/2)*2+1
+			x = (random.randint(0,mapWidth-roomWidth-1)//2)*2+1
+			y = (random.randint(0,mapHeight-roomHeight-1)//2)*2+1
 
 			room = Rect(x,y,roomWidth,roomHeight)
 			# check for overlap with previous rooms
-			failed = False
-			for otherRoom in rooms:
-				if room.intersect(otherRoom):
-					failed = True
-					break
+			failed = rooms.intersectsAny(room)
 
 			if not failed:
-				rooms.append(room)
+				rooms.add(room)
 
 				self.startRegion()
 				self.createRoom(room)
+			yield "buildRooms"
 
 	def connectRegions(self,mapWidth,mapHeight):
+		runSteps(self.connectRegionsSteps(mapWidth,mapHeight))
+
+	def connectRegionsSteps(self,mapWidth,mapHeight):
+		# yields after each connection
 		# Find all of the tiles that can connect two regions
 		north = (0,-1)
 		south = (0,1)
@@ -1517,23 +2049,23 @@ class MazeWithRooms:
 			for y in xrange(mapHeight)]
 				for x in xrange(mapWidth)]
 
-		for x in xrange(1,mapWidth-1):
-			for y in xrange(1,mapHeight-1):
-				if self.level[x][y] != 1: continue
+		# only walls with floor on two or more sides can touch two regions
+		for x,y in neighborhoodRules.findTiles(self.level, neighborhoodRules.CONNECTOR_CANDIDATES,
+			1,1,mapWidth-1,mapHeight-1):
 
-				# count the number of different regions the wall tile is touching
-				regions = set()
-				for direction in [north,south,east,west]:
-					newX = x + direction[0]
-					newY = y + direction[1]
-					region = self._regions[newX][newY]
-					if region != None: 
-						regions.add(region)
+			# count the number of different regions the wall tile is touching
+			regions = set()
+			for direction in [north,south,east,west]:
+				newX = x + direction[0]
+				newY = y + direction[1]
+				region = self._regions[newX][newY]
+				if region != None: 
+					regions.add(region)
 
-				if (len(regions) < 2): continue
+			if (len(regions) < 2): continue
 
-				# The wall tile touches at least two regions
-				connectorRegions[x][y] = regions
+			# The wall tile touches at least two regions
+			connectorRegions[x][y] = regions
 
 		# make a list of all of the connectors
 		connectors = set()
@@ -1552,6 +2084,7 @@ class MazeWithRooms:
 
 		# connect the regions
 		while len(openRegions) > 1:
+			self.budget.tick("connectRegions")
 			# get random connector
 			#connector = connectors.pop()
 			for connector in connectors: break
@@ -1613,39 +2146,32 @@ class MazeWithRooms:
 					toBeRemoved.add(pos)
 
 			connectors.difference_update(toBeRemoved)
+			yield "connectRegions"
 
 	def createRoom(self, room):
 		# set all tiles within a rectangle to 0
-		for x in range(room.x1, room.x2):
-			for y in range(room.y1, room.y2):
-				self.carve(x,y)
+		carving.carveRect(self.level, room.x1, room.y1, room.x2, room.y2)
+		carving.carveRect(self._regions, room.x1, room.y1, room.x2, room.y2,
+			self._currentRegion)
 
 	def addJunction(self,pos):
 		self.level[pos[0]][pos[1]] = 0
 
 	def removeDeadEnds(self,mapWidth,mapHeight):
-		done = False
+		runSteps(self.removeDeadEndsSteps(mapWidth,mapHeight))
 
-		north = (0,-1)
-		south = (0,1)
-		east = (1,0)
-		west = (-1,0)
+	def removeDeadEndsSteps(self,mapWidth,mapHeight):
+		# yields after each pass
+		done = False
 
 		while not done:
-			done = True
-
-			for y in xrange(1,mapHeight):
-				for x in xrange(1,mapWidth):
-					if self.level[x][y] == 0:
-						
-						exits = 0
-						for direction in [north,south,east,west]:
-							if self.level[x+direction[0]][y+direction[1]] == 0:
-								exits += 1
-						if exits > 1: continue
-
-						done = False
-						self.level[x][y] = 1
+			if deadlinePassed(self, "removeDeadEnds"):
+				break
+			# fill in every floor tile with one exit or fewer
+			changed = neighborhoodRules.sweepRows(self.level, neighborhoodRules.FILL_DEAD_ENDS,
+				1,1,mapWidth-1,mapHeight-1)
+			done = (changed == 0)
+			yield "removeDeadEnds"
 
 	def canCarve(self,pos,dir,mapWidth,mapHeight):
 		'''
@@ -1689,6 +2215,8 @@ class MessyBSPTree:
 	'''
 	def __init__(self):
 			self.level = []
+			self.repairConnectivity = False # join separate floor regions after generating
+			self.pipeline = None # a postProcessing.Pipeline to run on every level
 			self.room = None
 			self.MAX_LEAF_SIZE = 24
 			self.ROOM_MAX_SIZE = 15
@@ -1697,43 +2225,43 @@ class MessyBSPTree:
 			self.smoothing = 1
 			self.filling = 3
 
-	def generateLevel(self, mapWidth, mapHeight):
+			self.budget = GenerationBudget()
+
+	def generateLevel(self, mapWidth, mapHeight, deadline=None):
+		runSteps(self.generateLevelSteps(mapWidth, mapHeight, deadline))
+		return self.level
+
+	def generateLevelSteps(self, mapWidth, mapHeight, deadline=None):
+		# generateLevel, yielding after each bounded unit of work
+		self.deadline = deadline # stop optional phases at this time.time()
+		self.truncatedPhases = []
 		# Creates an empty 2D array or clears existing array
+		self.budget.start(self)
 		self.mapWidth = mapWidth
 		self.mapHeight = mapHeight
 		self.level = [[1
 			for y in range(mapHeight)]
 				for x in range(mapWidth)]
 
-		self._leafs = []
-
-		rootLeaf = Leaf(0,0,mapWidth,mapHeight)
-		self._leafs.append(rootLeaf)
-
-		splitSuccessfully = True
-		# loop through all leaves until they can no longer split successfully
-		while (splitSuccessfully):
-			splitSuccessfully = False
-			for l in self._leafs:
-				if (l.child_1 == None) and (l.child_2 == None):
-					if ((l.width > self.MAX_LEAF_SIZE) or 
-					(l.height > self.MAX_LEAF_SIZE) or
-					(random.random() > 0.8)):
-						if (l.splitLeaf()): #try to split the leaf
-							self._leafs.append(l.child_1)
-							self._leafs.append(l.child_2)
-							splitSuccessfully = True
-
-		rootLeaf.createRooms(self)
-		self.cleanUpMap(mapWidth,mapHeight)
-
-		return self.level
+		bspBuilder = BSPBuilder(self.MAX_LEAF_SIZE)
+		for step in bspBuilder.buildTreeSteps(mapWidth,mapHeight,deadline):
+			yield step
+		rootLeaf = bspBuilder.rootLeaf
+		self._leafs = bspBuilder.leafs
+		if bspBuilder.truncated:
+			self.truncatedPhases.append("splitLeafs")
+
+		for step in bspBuilder.createRoomsSteps(rootLeaf, self.createRoom, self.createHall,
+			self.ROOM_MIN_SIZE, self.ROOM_MAX_SIZE):
+			yield step
+		for step in self.cleanUpMapSteps(mapWidth,mapHeight):
+			yield step
+		for step in postProcessSteps(self):
+			yield step
 
 	def createRoom(self, room):
 		# set all tiles within a rectangle to 0
-		for x in range(room.x1 + 1, room.x2):
-			for y in range(room.y1+1, room.y2):
-				self.level[x][y] = 0
+		carving.carveRoom(self.level, room)
 
 	def createHall(self, room1, room2):
 		# run a heavily weighted random Walk 
@@ -1741,6 +2269,7 @@ class MessyBSPTree:
 		drunkardX, drunkardY = room2.center()
 		goalX,goalY = room1.center()
 		while not (room1.x1 <= drunkardX <= room1.x2) or not (room1.y1 < drunkardY < room1.y2): #
+			self.budget.tick("createHall")
 			# ==== Choose Direction ====
 			north = 1.0
 			south = 1.0
@@ -1790,30 +2319,22 @@ class MessyBSPTree:
 					self.level[drunkardX][drunkardY] = 0
 
 	def cleanUpMap(self,mapWidth,mapHeight):
+		runSteps(self.cleanUpMapSteps(mapWidth,mapHeight))
+
+	def cleanUpMapSteps(self,mapWidth,mapHeight):
+		# yields after each smoothing pass
 		if (self.smoothEdges):
 			for i in xrange (3):
+				if deadlinePassed(self, "cleanUpMap"):
+					break
 				# Look at each cell individually and check for smoothness
-				for x in xrange(1,mapWidth-1):
-					for y in xrange (1,mapHeight-1):
-						if (self.level[x][y] == 1) and (self.getAdjacentWallsSimple(x,y) <= self.smoothing):
-							self.level[x][y] = 0
-
-						if (self.level[x][y] == 0) and (self.getAdjacentWallsSimple(x,y) >= self.filling):
-							self.level[x][y] = 1
+				neighborhoodRules.sweep(self.level,
+					neighborhoodRules.smoothingRule(self.smoothing, self.filling),
+					1,1,mapWidth-1,mapHeight-1)
+				yield "cleanUpMap"
 
 	def getAdjacentWallsSimple(self, x, y): # finds the walls in four directions
-		wallCounter = 0
-		#print("(",x,",",y,") = ",self.level[x][y])
-		if (self.level[x][y-1] == 1): # Check north
-			wallCounter += 1
-		if (self.level[x][y+1] == 1): # Check south
-			wallCounter += 1
-		if (self.level[x-1][y] == 1): # Check west
-			wallCounter += 1
-		if (self.level[x+1][y] == 1): # Check east
-			wallCounter += 1
-
-		return wallCounter
+		return neighborhoodRules.WALLS4[neighborhoodRules.neighborhoodMask(self.level,x,y)]
 
 # ==== TinyKeep ====
 '''
@@ -1823,7 +2344,212 @@ http://www.gamasutra.com/blogs/AAdonaac/20150903/252889/Procedural_Dungeon_Gener
 '''
 
 # ==== Helper Classes ====
-class Rect: # used for the tunneling algorithm
+class GenerationTimeout(Exception):
+	'''
+	Raised by generateLevel when a generator uses up its
+	GenerationBudget. The partially generated level is kept
+	in self.level, and self.diagnostics describes where the
+	time went.
+	'''
+	def __init__(self, reason, diagnostics, level):
+		# every argument goes to Exception, so that the timeout can be
+		# pickled back out of a process pool
+		Exception.__init__(self, reason, diagnostics, level)
+		self.reason = reason # "steps" or "time"
+		self.diagnostics = diagnostics
+		self.level = level
+
+	def __str__(self):
+		return "%s ran out of %s in %s after %d steps" % (
+			self.diagnostics["generator"], self.reason, self.diagnostics["phase"], self.diagnostics["steps"])
+
+def runSteps(steps):
+	# run a generator's stepwise method to completion
+	for step in steps:
+		pass
+
+class SteppedGeneration:
+	'''
+	Runs one generator's generateLevelSteps() a few steps at a
+	time, so that level generation can be spread across frames
+	or interleaved with other work.
+	If seed is given, the generation keeps its own random state
+	and swaps it in and out of the random module around each
+	slice of work, so generations that are interleaved with each
+	other still produce the same level as they would alone.
+	Each SteppedGeneration needs its own generator instance.
+	'''
+	def __init__(self, generator, mapWidth, mapHeight, deadline=None, seed=None):
+		self.generator = generator
+		self.mapWidth = mapWidth
+		self.mapHeight = mapHeight
+		self._steps = generator.generateLevelSteps(mapWidth, mapHeight, deadline)
+		self._randomState = None
+		if seed is not None:
+			outerState = random.getstate()
+			random.seed(seed)
+			self._randomState = random.getstate()
+			random.setstate(outerState)
+
+		self.done = False
+		self.phase = None # the phase that the last step belonged to
+		self.stepsTaken = 0
+
+	def runSteps(self, maxSteps=1):
+		# run up to maxSteps units of work, returns True when the level is done
+		return self._run(maxSteps, None)
+
+	def runFor(self, seconds):
+		# run until the level is done or seconds have passed, returns True when done
+		return self._run(None, time.time() + seconds)
+
+	def run(self):
+		# run to completion and return the level
+		self._run(None, None)
+		return self.level
+
+	@property
+	def level(self):
+		return self.generator.level
+
+	def _run(self, maxSteps, endTime):
+		if self.done:
+			return True
+
+		if self._randomState is not None:
+			outerState = random.getstate()
+			random.setstate(self._randomState)
+		try:
+			steps = 0
+			while (maxSteps is None) or (steps < maxSteps):
+				try:
+					self.phase = next(self._steps)
+				except StopIteration:
+					self.done = True
+					break
+				steps += 1
+				if (endTime is not None) and (time.time() >= endTime):
+					break
+			self.stepsTaken += steps
+		finally:
+			if self._randomState is not None:
+				self._randomState = random.getstate()
+				random.setstate(outerState)
+
+		return self.done
+
+class GenerationScheduler:
+	'''
+	Cooperatively runs many SteppedGenerations on one thread,
+	giving each unfinished generation a short slice of time in
+	turn.
+	'''
+	def __init__(self, timeSlice=0.005):
+		self.timeSlice = timeSlice # seconds given to a generation per turn
+		self.pending = deque()
+
+	def add(self, generation):
+		self.pending.append(generation)
+		return generation
+
+	def runOnce(self):
+		'''
+		Give every pending generation one time slice, and return
+		a list of the generations that finished.
+		'''
+		finished = []
+		for i in range(len(self.pending)):
+			generation = self.pending.popleft()
+			if generation.runFor(self.timeSlice):
+				finished.append(generation)
+			else:
+				self.pending.append(generation)
+		return finished
+
+	def run(self):
+		# yield each generation as it finishes, until none are left
+		while self.pending:
+			for generation in self.runOnce():
+				yield generation
+
+def deadlinePassed(generator, phase):
+	'''
+	Returns True once generator.deadline (a time.time() value)
+	has passed, and records phase in generator.truncatedPhases.
+	Generators call this before each unit of optional work,
+	such as another room attempt or smoothing pass, and skip
+	the rest of that phase once it returns True.
+	'''
+	deadline = getattr(generator, "deadline", None)
+	if (deadline is None) or (time.time() < deadline):
+		return False
+	if phase not in generator.truncatedPhases:
+		generator.truncatedPhases.append(phase)
+	return True
+
+def postProcessSteps(generator):
+	# the optional clean up every generator runs once its level is finished
+	if generator.repairConnectivity:
+		postProcessing.repairConnectivity(generator.level)
+		yield "repairConnectivity"
+	if generator.pipeline:
+		for step in generator.pipeline.runSteps(generator.level):
+			yield step
+
+class GenerationBudget:
+	'''
+	A limit on the work that a single call to generateLevel
+	can do. The loops in the generators that keep going until
+	they find something (a wall to build against, a floor
+	tile, the end of a tunnel) call tick() once per try, and
+	tick() raises GenerationTimeout once either maxSteps
+	tries have been made or timeLimit seconds have passed.
+	With the default of None for both, generation is unbounded.
+	'''
+	def __init__(self, maxSteps=None, timeLimit=None, clockInterval=1024):
+		self.maxSteps = maxSteps
+		self.timeLimit = timeLimit
+		self.clockInterval = clockInterval # ticks between checks of the clock
+		self.start(None)
+
+	def start(self, generator):
+		# reset the budget at the start of generateLevel
+		self.generator = generator
+		self.steps = 0
+		self.phaseSteps = {}
+		self.startTime = time.time()
+		self._nextClockCheck = self.clockInterval
+		return self
+
+	def tick(self, phase, steps=1):
+		self.steps += steps
+		self.phaseSteps[phase] = self.phaseSteps.get(phase,0) + steps
+
+		if (self.maxSteps is not None) and (self.steps > self.maxSteps):
+			self.expire("steps", phase)
+
+		if (self.timeLimit is not None) and (self.steps >= self._nextClockCheck):
+			self._nextClockCheck = self.steps + self.clockInterval
+			if time.time() - self.startTime > self.timeLimit:
+				self.expire("time", phase)
+
+	def expire(self, reason, phase):
+		generator = self.generator
+		diagnostics = {
+			"generator": generator.__class__.__name__ if generator else None,
+			"phase": phase,
+			"steps": self.steps,
+			"phaseSteps": dict(self.phaseSteps),
+			"elapsed": time.time() - self.startTime,
+		}
+		if hasattr(generator, "rooms"):
+			diagnostics["rooms"] = len(generator.rooms)
+		level = generator.level if generator else None
+		raise GenerationTimeout(reason, diagnostics, level)
+
+class Rect(object): # used for the tunneling algorithm
+	__slots__ = ('x1','y1','x2','y2')
+
 	def __init__(self, x, y, w, h):
 		self.x1 = x
 		self.y1 = y
@@ -1831,8 +2557,8 @@ class Rect: # used for the tunneling algorithm
 		self.y2 = y+h
 
 	def center(self):
-		centerX = (self.x1 + self.x2)/2
-		centerY = (self.y1 + self.y2)/2
+		centerX = (self.x1 + self.x2)//2
+		centerY = (self.y1 + self.y2)//2
 		return (centerX, centerY)
 
 	def intersect(self, other):
@@ -1840,17 +2566,69 @@ class Rect: # used for the tunneling algorithm
 		return (self.x1 <= other.x2 and self.x2 >= other.x1 and
 			self.y1 <= other.y2 and self.y2 >= other.y1)
 
-class Leaf: # used for the BSP tree algorithm
+class RectIndex: # used to check new rooms for overlap
+	'''
+	A uniform grid over the accepted rooms. Each room is
+	filed under every grid cell that it touches, so checking
+	a new room for overlap only has to look at the rooms
+	that share a cell with it, instead of at every room
+	that has been placed so far.
+	The cell size should be close to the largest room size.
+	'''
+	def __init__(self, cellSize):
+		self.cellSize = max(1,cellSize)
+		self._cells = {}
+		self.rooms = []
+
+	def _cellRange(self, room):
+		cellSize = self.cellSize
+		return (room.x1//cellSize, room.x2//cellSize,
+			room.y1//cellSize, room.y2//cellSize)
+
+	def add(self, room):
+		cx1,cx2,cy1,cy2 = self._cellRange(room)
+		cells = self._cells
+		for cx in range(cx1,cx2+1):
+			for cy in range(cy1,cy2+1):
+				key = (cx,cy)
+				if key in cells:
+					cells[key].append(room)
+				else:
+					cells[key] = [room]
+		self.rooms.append(room)
+
+	def intersectsAny(self, room):
+		# returns true if room intersects with any room in the index
+		cx1,cx2,cy1,cy2 = self._cellRange(room)
+		cells = self._cells
+		for cx in range(cx1,cx2+1):
+			for cy in range(cy1,cy2+1):
+				bucket = cells.get((cx,cy))
+				if bucket:
+					for other in bucket:
+						if room.intersect(other):
+							return True
+		return False
+
+	def __len__(self):
+		return len(self.rooms)
+
+class Leaf(object): # used for the BSP tree algorithm
+	__slots__ = ('x','y','width','height','child_1','child_2','room','hall',
+		'branchRoom')
+
+	MIN_LEAF_SIZE = 10
+
 	def __init__(self, x, y, width, height):
 		self.x = x
 		self.y = y
 		self.width = width
 		self.height = height
-		self.MIN_LEAF_SIZE = 10
 		self.child_1 = None
 		self.child_2 = None
 		self.room = None
 		self.hall = None
+		self.branchRoom = None # the room that stands in for this branch
 
 	def splitLeaf(self):
 		# begin splitting the leaf into two children
@@ -1891,56 +2669,184 @@ class Leaf: # used for the BSP tree algorithm
 		return True
 
 	def createRooms(self, bspTree):
-		if (self.child_1) or (self.child_2):
-			# recursively search for children until you hit the end of the branch
-			if (self.child_1):
-				self.child_1.createRooms(bspTree)
-			if (self.child_2):
-				self.child_2.createRooms(bspTree)
-
-			if (self.child_1 and self.child_2):
-				bspTree.createHall(self.child_1.getRoom(),
-					self.child_2.getRoom())
-
-		else:
-		# Create rooms in the end branches of the bsp tree
-			w = random.randint(bspTree.ROOM_MIN_SIZE, min(bspTree.ROOM_MAX_SIZE,self.width-1))
-			h = random.randint(bspTree.ROOM_MIN_SIZE, min(bspTree.ROOM_MAX_SIZE,self.height-1))
-			x = random.randint(self.x, self.x+(self.width-1)-w)
-			y = random.randint(self.y, self.y+(self.height-1)-h)
-			self.room = Rect(x,y,w,h)
-			bspTree.createRoom(self.room)
+		# create rooms in the end branches and connect the branches with halls
+		BSPBuilder.createRooms(self, bspTree.createRoom, bspTree.createHall,
+			bspTree.ROOM_MIN_SIZE, bspTree.ROOM_MAX_SIZE)
+
+	def createRoom(self, roomMinSize, roomMaxSize):
+		# Create a room in an end branch of the bsp tree
+		w = random.randint(roomMinSize, min(roomMaxSize,self.width-1))
+		h = random.randint(roomMinSize, min(roomMaxSize,self.height-1))
+		x = random.randint(self.x, self.x+(self.width-1)-w)
+		y = random.randint(self.y, self.y+(self.height-1)-h)
+		self.room = Rect(x,y,w,h)
+		return self.room
 
 	def getRoom(self):
 		if (self.room): return self.room
+		if (self.branchRoom): return self.branchRoom
+
+		'''
+		Resolve the branch bottom-up. Each branch picks one of
+		its children's rooms once and keeps it in branchRoom,
+		so asking again, or asking from further up the tree,
+		doesn't walk back down the branch.
+		'''
+		stack = [(self,False)]
+		while stack:
+			leaf, childrenDone = stack.pop()
+			if (leaf.room or leaf.branchRoom or
+				(not leaf.child_1 and not leaf.child_2)):
+				continue
+
+			elif (not childrenDone):
+				stack.append((leaf,True))
+				if (leaf.child_2): stack.append((leaf.child_2,False))
+				if (leaf.child_1): stack.append((leaf.child_1,False))
 
-		else:
-			if (self.child_1):
-				self.room_1 = self.child_1.getRoom()
-			if (self.child_2):
-				self.room_2 = self.child_2.getRoom()
-
-			if (not self.child_1 and not self.child_2):
-				# neither room_1 nor room_2
-				return None
-
-			elif (not self.room_2):
-				# room_1 and !room_2
-				return self.room_1
-
-			elif (not self.room_1):
-				# room_2 and !room_1
-				return self.room_2
-
-			# If both room_1 and room_2 exist, pick one
-			elif (random.random() < 0.5):
-				return self.room_1
 			else:
-				return self.room_2
+				room_1 = leaf.child_1.room or leaf.child_1.branchRoom if leaf.child_1 else None
+				room_2 = leaf.child_2.room or leaf.child_2.branchRoom if leaf.child_2 else None
+				leaf.branchRoom = Leaf._pickRoom(room_1,room_2)
+
+		return self.branchRoom
+
+	@staticmethod
+	def _pickRoom(room_1, room_2):
+		if (not room_2):
+			# room_1 and !room_2
+			return room_1
+
+		elif (not room_1):
+			# room_2 and !room_1
+			return room_2
+
+		# If both room_1 and room_2 exist, pick one
+		elif (random.random() < 0.5):
+			return room_1
+		else:
+			return room_2
+
+class BSPBuilder: # used by BSPTree, CityWalls and MessyBSPTree
+	'''
+	Splits a map into a BSP tree of Leafs, then hands the end
+	branches and the connections between them to the room and
+	hall callbacks of the generator that is using it.
+	Leafs waiting to be split are kept in a queue, so each leaf
+	is looked at exactly once, and the tree is walked with an
+	explicit stack, so very large maps can't hit the recursion
+	limit.
+	'''
+	def __init__(self, maxLeafSize, splitChance=0.2):
+		self.MAX_LEAF_SIZE = maxLeafSize
+		self.splitChance = splitChance # chance to split a leaf that is already small enough
+		self.rootLeaf = None
+		self.leafs = []
+		self.truncated = False
+
+	def buildTree(self, mapWidth, mapHeight, deadline=None):
+		runSteps(self.buildTreeSteps(mapWidth, mapHeight, deadline))
+		return self.rootLeaf
+
+	def buildTreeSteps(self, mapWidth, mapHeight, deadline=None):
+		# if deadline passes, the remaining leafs are left unsplit
+		rootLeaf = Leaf(0,0,mapWidth,mapHeight)
+		self.rootLeaf = rootLeaf
+		self.leafs = [rootLeaf]
+		self.truncated = False
+
+		toBeSplit = deque([rootLeaf])
+		while toBeSplit:
+			if (deadline is not None) and (time.time() >= deadline):
+				self.truncated = True
+				break
+			l = toBeSplit.popleft()
+			if ((l.width > self.MAX_LEAF_SIZE) or 
+			(l.height > self.MAX_LEAF_SIZE) or
+			(random.random() > 1.0 - self.splitChance)):
+				if (l.splitLeaf()): #try to split the leaf
+					self.leafs.append(l.child_1)
+					self.leafs.append(l.child_2)
+					toBeSplit.append(l.child_1)
+					toBeSplit.append(l.child_2)
+			yield "splitLeafs"
+
+	@staticmethod
+	def createRooms(rootLeaf, createRoom, createHall, roomMinSize, roomMaxSize):
+		runSteps(BSPBuilder.createRoomsSteps(rootLeaf, createRoom, createHall,
+			roomMinSize, roomMaxSize))
+
+	@staticmethod
+	def createRoomsSteps(rootLeaf, createRoom, createHall, roomMinSize, roomMaxSize):
+		'''
+		Visit the tree in post-order: rooms are created in the
+		end branches, and once both children of a branch are
+		done, createHall is called with a room from each side.
+		Yields after each room and each hall.
+		'''
+		stack = [(rootLeaf,False)]
+		while stack:
+			leaf, childrenDone = stack.pop()
+			if (not leaf.child_1 and not leaf.child_2):
+				createRoom(leaf.createRoom(roomMinSize, roomMaxSize))
+				yield "createRooms"
+
+			elif (not childrenDone):
+				stack.append((leaf,True))
+				if (leaf.child_2): stack.append((leaf.child_2,False))
+				if (leaf.child_1): stack.append((leaf.child_1,False))
+
+			elif (leaf.child_1 and leaf.child_2):
+				# both children are already resolved, so this is O(1)
+				createHall(leaf.child_1.getRoom(), leaf.child_2.getRoom())
+				leaf.getRoom()
+				yield "createHalls"
 
 class Prefab(Rect):
 	pass
 
+# ==== Seeded Generation ====
+GENERATORS = OrderedDict([
+	("TunnelingAlgorithm", TunnelingAlgorithm),
+	("BSPTree", BSPTree),
+	("DrunkardsWalk", DrunkardsWalk),
+	("CellularAutomata", CellularAutomata),
+	("RoomAddition", RoomAddition),
+	("CityWalls", CityWalls),
+	("MazeWithRooms", MazeWithRooms),
+	("MessyBSPTree", MessyBSPTree),
+	])
+
+def createGenerator(algorithm, params=None):
+	'''
+	Returns a new instance of the generator class named
+	algorithm, with params (a dict of attribute names and
+	values, such as {"MAX_ROOMS": 50}) applied to it.
+	'''
+	if algorithm not in GENERATORS:
+		raise ValueError("unknown algorithm %r" % (algorithm,))
+	generator = GENERATORS[algorithm]()
+	for name, value in sorted((params or {}).items()):
+		if name.startswith("_") or not hasattr(generator, name) or callable(getattr(generator, name)):
+			raise ValueError("%s has no parameter %r" % (algorithm, name))
+		setattr(generator, name, value)
+	return generator
+
+def generateSeededLevel(algorithm, mapWidth, mapHeight, seed, params=None, deadline=None):
+	'''
+	Generate a level with a fresh generator, seeding the random
+	module with seed first, so that the same arguments always
+	give the same level. The caller's random state is restored
+	afterwards.
+	'''
+	generator = createGenerator(algorithm, params)
+	outerState = random.getstate()
+	random.seed(seed)
+	try:
+		return generator.generateLevel(mapWidth, mapHeight, deadline)
+	finally:
+		random.setstate(outerState)
+
 if __name__ == "__main__":
 	ui = UserInterface()
 	ui.mainLoop()
\ No newline at end of file
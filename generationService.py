@@ -0,0 +1,395 @@
+'''
+==================
+Generation Service
+==================
+
+An asyncio front end for the generators in
+dungeonGenerationAlgorithms, so that levels can be served
+straight to a game server.
+
+	service = GenerationService(processes=4)
+	level = await service.generate("BSPTree", 80, 50, seed=1234)
+
+Levels are generated in a pool of worker processes. Requests
+for the same (algorithm, size, seed, params) that arrive while
+an identical request is still being generated share its result
+instead of generating it again. At most maxPending distinct
+levels are generated or queued at once; further requests wait
+for a slot, and once maxWaiting requests are already waiting,
+new ones are refused with ServiceOverloaded. A request that is
+cancelled stops waiting straight away, and the work behind it
+is cancelled too if nobody else is waiting on it and it hasn't
+started yet. Work that has already started keeps its slot until
+the worker finishes it, and requests that arrive after the last
+waiter has gone start a fresh job instead of sharing it.
+
+Pass a levelCache.LevelCache as cache to answer repeated
+requests without going to the worker processes at all.
+
+Running this file starts a small HTTP server, on a TCP port or
+a unix socket, with two endpoints:
+
+	GET /generate?algorithm=BSPTree&width=80&height=50&seed=1&params={"MAX_LEAF_SIZE":20}
+	GET /stats
+
+/generate returns the level as JSON, one string of 0s and 1s
+per column (level[x]), and /stats returns the request counters
+and latency histograms.
+
+Requests are checked before they reach a worker: levels bigger
+than maxTiles tiles are refused, and params can only set
+parameters that hold plain data (numbers, strings, bools and
+None), so a request can't replace a method or start the
+parallel engine inside a worker. Refused requests get a 400.
+
+Requires Python 3.
+'''
+
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import dungeonGenerationAlgorithms
+import levelCache
+
+class ServiceOverloaded(Exception):
+	pass
+
+# the only kinds of value a request can set a parameter to
+PLAIN_DATA = (int, float, bool, str, type(None))
+
+# parameter values the service won't run, since the service's
+# workers already run one level each
+REFUSED_PARAMS = {"engine": ("parallel",)}
+
+def checkRequest(algorithm, width, height, params, maxTiles):
+	'''
+	Raises ValueError if a request asks for something the service
+	won't generate: a map of more than maxTiles tiles, or a
+	parameter that isn't plain data (a number, string, bool or
+	None) on the generator and in the request.
+	'''
+	if width < 1 or height < 1:
+		raise ValueError("width and height must be positive")
+	if width*height > maxTiles:
+		raise ValueError("%dx%d is more than the %d tiles this service will generate" % (
+			width, height, maxTiles))
+	generator = dungeonGenerationAlgorithms.createGenerator(algorithm)
+	for name, value in (params or {}).items():
+		if (not isinstance(value, PLAIN_DATA) or
+			not isinstance(getattr(generator, name, None), PLAIN_DATA) or
+			value in REFUSED_PARAMS.get(name, ())):
+			raise ValueError("%s parameter %r can't be set to %r here" % (algorithm, name, value))
+	# catches unknown and private names
+	dungeonGenerationAlgorithms.createGenerator(algorithm, params)
+
+def requestKey(algorithm, width, height, seed, params=None):
+	# a canonical, hashable description of a level request
+	return json.dumps([algorithm, width, height, seed, params or {}],
+		sort_keys=True, separators=(",",":"))
+
+def _generateInWorker(algorithm, width, height, seed, params):
+	# runs in a worker process
+	return dungeonGenerationAlgorithms.generateSeededLevel(
+		algorithm, width, height, seed, params)
+
+class LatencyHistogram:
+	'''
+	Counts request latencies into fixed buckets, so that it
+	takes the same memory after a billion requests as after one.
+	'''
+	BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+		1.0, 2.0, 5.0, 10.0, float("inf")) # upper bound of each bucket in seconds
+
+	def __init__(self):
+		self.counts = [0]*len(self.BOUNDS)
+		self.count = 0
+		self.total = 0.0
+		self.maximum = 0.0
+
+	def record(self, seconds):
+		for i, bound in enumerate(self.BOUNDS):
+			if seconds <= bound:
+				self.counts[i] += 1
+				break
+		self.count += 1
+		self.total += seconds
+		self.maximum = max(self.maximum, seconds)
+
+	def quantile(self, q):
+		# returns the upper bound of the bucket that holds quantile q
+		if not self.count:
+			return None
+		rank = q*self.count
+		runningTotal = 0
+		for bound, n in zip(self.BOUNDS, self.counts):
+			runningTotal += n
+			if runningTotal >= rank:
+				return min(bound, self.maximum)
+		return self.maximum
+
+	def asDict(self):
+		return {
+			"count": self.count,
+			"mean": self.total/self.count if self.count else None,
+			"max": self.maximum,
+			"p50": self.quantile(0.5),
+			"p99": self.quantile(0.99),
+			"buckets": OrderedDict((str(bound), n)
+				for bound, n in zip(self.BOUNDS, self.counts)),
+		}
+
+class _PendingLevel:
+	# a level that is being generated, and the requests waiting on it
+	def __init__(self, job):
+		self.job = job # the executor's concurrent.futures.Future
+		self.future = asyncio.wrap_future(job)
+		self.waiters = 0
+
+class GenerationService:
+	def __init__(self, processes=None, maxPending=64, maxWaiting=1024, executor=None, cache=None,
+		maxTiles=4096*4096):
+		self.maxPending = maxPending # distinct levels queued or being generated at once
+		self.maxWaiting = maxWaiting # requests waiting for a free slot before refusing more
+		self.maxTiles = maxTiles # the largest width*height a request can ask for
+		self._executor = executor or ProcessPoolExecutor(max_workers=processes)
+		self._ownsExecutor = executor is None
+		self._slots = None
+		self._waiting = 0
+		self._pending = {}
+		self._running = 0 # jobs holding a slot, including ones nobody is waiting on any more
+		self.cache = cache
+		# the cache reads and writes files, so it is only used from this one thread
+		self._cacheExecutor = ThreadPoolExecutor(max_workers=1) if cache is not None else None
+
+		self.counters = {"requests":0, "generated":0, "coalesced":0,
+			"cached":0, "rejected":0, "cancelled":0, "errors":0}
+		self.latency = {} # algorithm -> LatencyHistogram
+
+	async def generate(self, algorithm, width, height, seed, params=None):
+		'''
+		Returns the level for these arguments, generating it in a
+		worker process unless an identical request is already
+		being generated. Raises ValueError for requests that
+		checkRequest refuses.
+		'''
+		startTime = time.time()
+		self.counters["requests"] += 1
+		checkRequest(algorithm, width, height, params, self.maxTiles)
+		key = requestKey(algorithm, width, height, seed, params)
+
+		if self.cache is not None:
+			level = await asyncio.get_running_loop().run_in_executor(self._cacheExecutor,
+				self.cache.get, levelCache.cacheKey(algorithm, width, height, seed, params))
+			if level is not None:
+				self.counters["cached"] += 1
+				self._recordLatency(algorithm, time.time()-startTime)
+				return level
+
+		pending = self._pending.get(key)
+		if pending:
+			self.counters["coalesced"] += 1
+		else:
+			pending = await self._submit(key, algorithm, width, height, seed, params)
+
+		pending.waiters += 1
+		try:
+			level = await asyncio.shield(pending.future)
+		except asyncio.CancelledError:
+			self.counters["cancelled"] += 1
+			pending.waiters -= 1
+			if pending.waiters == 0:
+				# later requests start over rather than share a cancelled level
+				if self._pending.get(key) is pending:
+					del self._pending[key]
+				# only stops jobs that haven't started; the slot is freed when the job is done
+				pending.job.cancel()
+			raise
+		except Exception:
+			self.counters["errors"] += 1
+			raise
+		else:
+			pending.waiters -= 1
+		finally:
+			self._recordLatency(algorithm, time.time()-startTime)
+
+		return level
+
+	async def _submit(self, key, algorithm, width, height, seed, params):
+		if self._slots is None:
+			self._slots = asyncio.Semaphore(self.maxPending)
+
+		# back-pressure: wait for a free slot, or refuse if too many are waiting
+		if self._slots.locked():
+			if self._waiting >= self.maxWaiting:
+				self.counters["rejected"] += 1
+				raise ServiceOverloaded("%d requests are already waiting" % self._waiting)
+			self._waiting += 1
+			try:
+				await self._slots.acquire()
+			finally:
+				self._waiting -= 1
+		else:
+			await self._slots.acquire()
+
+		# an identical request may have been submitted while this one waited
+		pending = self._pending.get(key)
+		if pending:
+			self._slots.release()
+			self.counters["coalesced"] += 1
+			return pending
+
+		loop = asyncio.get_running_loop()
+		try:
+			job = self._executor.submit(_generateInWorker, algorithm, width, height, seed, params)
+		except Exception:
+			self._slots.release()
+			raise
+		pending = _PendingLevel(job)
+		self._pending[key] = pending
+		self._running += 1
+
+		def finished(job):
+			# the slot is held until the worker is really done, even if every waiter gave up
+			if self._pending.get(key) is pending:
+				del self._pending[key]
+			self._running -= 1
+			self._slots.release()
+			if not job.cancelled() and job.exception() is None:
+				self.counters["generated"] += 1
+				if self.cache is not None:
+					self._cacheExecutor.submit(self.cache.put,
+						levelCache.cacheKey(algorithm, width, height, seed, params), job.result())
+		# executor callbacks run on another thread
+		job.add_done_callback(lambda job: loop.call_soon_threadsafe(finished, job))
+
+		return pending
+
+	def _recordLatency(self, algorithm, seconds):
+		if algorithm not in self.latency:
+			self.latency[algorithm] = LatencyHistogram()
+		self.latency[algorithm].record(seconds)
+
+	def stats(self):
+		statistics = dict(self.counters)
+		statistics["pending"] = len(self._pending)
+		statistics["running"] = self._running
+		statistics["waiting"] = self._waiting
+		statistics["latency"] = dict((algorithm, histogram.asDict())
+			for algorithm, histogram in self.latency.items())
+		return statistics
+
+	def close(self):
+		if self._ownsExecutor:
+			self._executor.shutdown(wait=False, cancel_futures=True)
+		if self._cacheExecutor is not None:
+			self._cacheExecutor.shutdown(wait=True)
+
+# ==== HTTP Front End ====
+
+def levelToJson(level):
+	return ["".join(str(tile) for tile in column) for column in level]
+
+class HttpFrontEnd:
+	'''
+	A deliberately small HTTP/1.0 server for GenerationService.
+	One request per connection, GET only.
+	'''
+	def __init__(self, service):
+		self.service = service
+
+	async def serveTcp(self, host="127.0.0.1", port=8000):
+		return await asyncio.start_server(self.handleConnection, host, port)
+
+	async def serveUnix(self, path):
+		return await asyncio.start_unix_server(self.handleConnection, path)
+
+	async def handleConnection(self, reader, writer):
+		try:
+			requestLine = await reader.readline()
+			# skip the headers
+			while True:
+				line = await reader.readline()
+				if not line or line in (b"\r\n", b"\n"):
+					break
+
+			status, body = await self.handleRequest(requestLine.decode("latin-1"))
+			payload = json.dumps(body).encode("utf-8")
+			writer.write(("HTTP/1.0 %s\r\nContent-Type: application/json\r\n"
+				"Content-Length: %d\r\n\r\n" % (status, len(payload))).encode("latin-1"))
+			writer.write(payload)
+			await writer.drain()
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+	async def handleRequest(self, requestLine):
+		parts = requestLine.split()
+		if len(parts) < 2 or parts[0] != "GET":
+			return "405 Method Not Allowed", {"error": "only GET is supported"}
+
+		url = urlsplit(parts[1])
+		if url.path == "/stats":
+			return "200 OK", self.service.stats()
+		if url.path != "/generate":
+			return "404 Not Found", {"error": "unknown path %s" % url.path}
+
+		query = dict((name, values[-1]) for name, values in parse_qs(url.query).items())
+		try:
+			algorithm = query["algorithm"]
+			width = int(query["width"])
+			height = int(query["height"])
+			seed = int(query.get("seed", 0))
+			params = json.loads(query["params"]) if "params" in query else None
+		except (KeyError, ValueError) as e:
+			return "400 Bad Request", {"error": "bad query: %s" % e}
+		if params is not None and not isinstance(params, dict):
+			return "400 Bad Request", {"error": "bad query: params must be a JSON object"}
+
+		try:
+			level = await self.service.generate(algorithm, width, height, seed, params)
+		except ServiceOverloaded as e:
+			return "503 Service Unavailable", {"error": str(e)}
+		except ValueError as e:
+			return "400 Bad Request", {"error": str(e)}
+		except Exception as e:
+			# such as a parameter of the wrong type blowing up inside the generator
+			return "500 Internal Server Error", {"error": "%s: %s" % (type(e).__name__, e)}
+
+		return "200 OK", {"algorithm": algorithm, "width": width,
+			"height": height, "seed": seed, "level": levelToJson(level)}
+
+def main():
+	parser = argparse.ArgumentParser(description="Serve dungeon levels over HTTP.")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8000)
+	parser.add_argument("--unix", help="listen on this unix socket instead of a TCP port")
+	parser.add_argument("--processes", type=int, default=None)
+	parser.add_argument("--max-pending", type=int, default=64)
+	parser.add_argument("--max-tiles", type=int, default=4096*4096,
+		help="refuse levels with more than this many tiles")
+	args = parser.parse_args()
+
+	async def serve():
+		service = GenerationService(processes=args.processes, maxPending=args.max_pending,
+			maxTiles=args.max_tiles)
+		frontEnd = HttpFrontEnd(service)
+		if args.unix:
+			server = await frontEnd.serveUnix(args.unix)
+		else:
+			server = await frontEnd.serveTcp(args.host, args.port)
+		try:
+			async with server:
+				await server.serve_forever()
+		finally:
+			service.close()
+
+	asyncio.run(serve())
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,289 @@
+'''
+=================
+Hashlife Automata
+=================
+
+A cellular automata engine in the style of Hashlife (Gosper,
+1984), which skips over parts of the map that look the same,
+such as solid rock around a few caves or wide open floor.
+
+	automata = HashlifeAutomata(level, neighborhoodRules.automataRule(4))
+	automata.run(5)
+	level = automata.toLevel()
+	automata.stats()["hitRate"]
+
+The map is stored as a quadtree. Every node is a square block of
+2^n x 2^n tiles made from four blocks of half the size, and
+nodes are hash consed: there is only ever one node for any
+given block of tiles, so two parts of the map that look the
+same are literally the same node, however far apart they are.
+
+The result of a node is the middle half of its block one step
+later, which only depends on the block itself. Results are
+memoized in an LRU of at most maxMemo results, so stepping a
+block that has been seen before costs one lookup, and a
+stretch of solid rock of any size costs about one lookup per
+level of the tree. Blocks that are all wall or all floor don't
+even need the LRU.
+
+rule is any neighborhoodRules table, applied to every tile at
+once (a synchronous step). With automataRule(neighbors) the
+levels are exactly the same as bitboardAutomata.step gives.
+smoothingRule tables work too, but as synchronous steps they
+don't give the same levels as the in place sweeps in
+cleanUpMap. As with the other engines, tiles on the edge of the
+map never change.
+
+The map is padded with walls out to a power of two. When the
+node table grows past maxNodes, the nodes that are no longer
+part of the map are dropped and the LRU is cleared.
+
+Memory is bounded by maxBytes, which is split evenly between
+the node table and the LRU using rough per entry sizes
+(NODE_BYTES and MEMO_BYTES, measured on CPython 3). maxMemo and
+maxNodes can be given directly instead. The node table is only
+checked after each step, so it can go over its share by the
+nodes one step makes; the map itself is never dropped, so a map
+with more distinct blocks than maxNodes is collected every step.
+stats() reports the estimated bytes in use.
+
+This is slower than bitboardAutomata for every map the
+generators make: 0.48s against 0.04s for 5 steps of a 1024x1024
+map that is mostly solid, where about 75% of lookups hit, and
+worse still on a random fill, which has few repeats. Use the
+bitboard engine; this one is kept for the hit rate statistics
+and as a check on the other engines.
+'''
+
+from collections import OrderedDict
+
+import neighborhoodRules
+
+class Node(object):
+	# a 2^level x 2^level block of tiles, with population walls
+	__slots__ = ("nw", "ne", "sw", "se", "level", "population")
+
+	def __init__(self, nw, ne, sw, se, level, population):
+		self.nw = nw # the quarter with the lowest x and y
+		self.ne = ne # highest x, lowest y
+		self.sw = sw # lowest x, highest y
+		self.se = se
+		self.level = level
+		self.population = population
+
+FLOOR = Node(None, None, None, None, 0, 0)
+WALL = Node(None, None, None, None, 0, 1)
+
+# rough bytes per node table entry (key tuple and Node) and per LRU entry
+NODE_BYTES = 200
+MEMO_BYTES = 100
+
+class HashlifeAutomata(object):
+	def __init__(self, level, rule, maxBytes=256<<20, maxMemo=None, maxNodes=None):
+		self.rule = rule
+		self.maxMemo = maxMemo if maxMemo is not None else max(1, maxBytes//2//MEMO_BYTES)
+		self.maxNodes = maxNodes if maxNodes is not None else max(1, maxBytes//2//NODE_BYTES)
+		self._nodes = {} # (nw, ne, sw, se) -> Node
+		self._memo = OrderedDict() # Node -> result, least recently used first
+		self._uniform = {0: [FLOOR], 1: [WALL]} # value -> the all floor or all wall node of each level
+
+		self.generation = 0
+		self.hits = 0
+		self.misses = 0
+		self.uniformHits = 0
+		self.evictions = 0
+		self.collections = 0
+
+		self.width = len(level)
+		self.height = len(level[0]) if self.width else 0
+		# the root is twice the size it needs to be, so its result covers the whole map
+		size = 4
+		while size < max(self.width, self.height):
+			size *= 2
+		self._size = 2*size
+		self._offset = size//2
+		# only tiles inside this rectangle change
+		self._interior = (self._offset+1, self._offset+1,
+			self._offset+self.width-1, self._offset+self.height-1)
+		self._original = self._build(level, -self._offset, -self._offset, self._size)
+		self.root = self._original
+
+	# ==== Nodes ====
+	def _join(self, nw, ne, sw, se):
+		key = (nw, ne, sw, se)
+		node = self._nodes.get(key)
+		if node is None:
+			node = Node(nw, ne, sw, se, nw.level+1,
+				nw.population + ne.population + sw.population + se.population)
+			self._nodes[key] = node
+		return node
+
+	def uniform(self, value, level):
+		# the node of the given level that is all value
+		nodes = self._uniform[value]
+		while len(nodes) <= level:
+			last = nodes[-1]
+			nodes.append(self._join(last, last, last, last))
+		return nodes[level]
+
+	def _build(self, level, x0, y0, size):
+		# the node for the size x size block at (x0, y0) of level, with walls off the edge of it
+		if x0 >= self.width or y0 >= self.height or x0+size <= 0 or y0+size <= 0:
+			return self.uniform(1, size.bit_length()-1)
+		if size == 1:
+			return WALL if level[x0][y0] else FLOOR
+		half = size//2
+		return self._join(
+			self._build(level, x0, y0, half), self._build(level, x0+half, y0, half),
+			self._build(level, x0, y0+half, half), self._build(level, x0+half, y0+half, half))
+
+	# ==== Stepping ====
+	def _baseResult(self, node):
+		# the middle 2x2 of a 4x4 node, one step later
+		tiles = [[0]*4 for x in range(4)]
+		for qx, qy, quarter in ((0,0,node.nw), (2,0,node.ne), (0,2,node.sw), (2,2,node.se)):
+			tiles[qx][qy] = quarter.nw.population
+			tiles[qx+1][qy] = quarter.ne.population
+			tiles[qx][qy+1] = quarter.sw.population
+			tiles[qx+1][qy+1] = quarter.se.population
+		def stepTile(x, y):
+			mask = 0
+			for dy in (-1, 0, 1):
+				for dx in (-1, 0, 1):
+					mask |= tiles[x+dx][y+dy] << ((dy+1)*3 + dx+1)
+			return WALL if self.rule[mask] else FLOOR
+		return self._join(stepTile(1,1), stepTile(2,1), stepTile(1,2), stepTile(2,2))
+
+	def _result(self, node):
+		# the middle half of node, one step later
+		if node.population == 0 or node.population == 1 << (2*node.level):
+			self.uniformHits += 1
+			return self.uniform(self.rule[511 if node.population else 0], node.level-1)
+
+		memo = self._memo
+		result = memo.pop(node, None)
+		if result is not None:
+			self.hits += 1
+			memo[node] = result
+			return result
+		self.misses += 1
+
+		if node.level == 2:
+			result = self._baseResult(node)
+		else:
+			join = self._join
+			nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+			# the nine overlapping blocks of half the size, stepped
+			r00 = self._result(nw)
+			r01 = self._result(join(nw.ne, ne.nw, nw.se, ne.sw))
+			r02 = self._result(ne)
+			r10 = self._result(join(nw.sw, nw.se, sw.nw, sw.ne))
+			r11 = self._result(join(nw.se, ne.sw, sw.ne, se.nw))
+			r12 = self._result(join(ne.sw, ne.se, se.nw, se.ne))
+			r20 = self._result(sw)
+			r21 = self._result(join(sw.ne, se.nw, sw.se, se.sw))
+			r22 = self._result(se)
+			result = join(
+				join(r00.se, r01.sw, r10.ne, r11.nw),
+				join(r01.se, r02.sw, r11.ne, r12.nw),
+				join(r10.se, r11.sw, r20.ne, r21.nw),
+				join(r11.se, r12.sw, r21.ne, r22.nw))
+
+		memo[node] = result
+		while len(memo) > self.maxMemo:
+			memo.popitem(last=False)
+			self.evictions += 1
+		return result
+
+	def _restore(self, evolved, original, x0, y0, size):
+		# evolved inside the interior of the map, and original everywhere else
+		if evolved is original:
+			return evolved
+		left, top, right, bottom = self._interior
+		if x0 >= left and y0 >= top and x0+size <= right and y0+size <= bottom:
+			return evolved
+		if x0 >= right or y0 >= bottom or x0+size <= left or y0+size <= top:
+			return original
+		half = size//2
+		return self._join(
+			self._restore(evolved.nw, original.nw, x0, y0, half),
+			self._restore(evolved.ne, original.ne, x0+half, y0, half),
+			self._restore(evolved.sw, original.sw, x0, y0+half, half),
+			self._restore(evolved.se, original.se, x0+half, y0+half, half))
+
+	def step(self):
+		result = self._result(self.root)
+		# put the result back in the middle of a root of the same size
+		wall = self.uniform(1, result.level-1)
+		expanded = self._join(
+			self._join(wall, wall, wall, result.nw), self._join(wall, wall, result.ne, wall),
+			self._join(wall, result.sw, wall, wall), self._join(result.se, wall, wall, wall))
+		self.root = self._restore(expanded, self._original, 0, 0, self._size)
+		self.generation += 1
+		if len(self._nodes) > self.maxNodes:
+			self._collect()
+
+	def run(self, generations):
+		for i in range(generations):
+			self.step()
+		return self
+
+	def _collect(self):
+		# drop every node that isn't part of the current or original map
+		nodes = {}
+		stack = [self.root, self._original] + self._uniform[0][1:] + self._uniform[1][1:]
+		while stack:
+			node = stack.pop()
+			if node.level == 0:
+				continue
+			key = (node.nw, node.ne, node.sw, node.se)
+			if key not in nodes:
+				nodes[key] = node
+				stack.extend(key)
+		self._nodes = nodes
+		self._memo.clear()
+		self.collections += 1
+
+	# ==== Output ====
+	def toLevel(self):
+		level = [[1]*self.height for x in range(self.width)]
+		self._write(level, self.root, -self._offset, -self._offset, self._size)
+		return level
+
+	def _write(self, level, node, x0, y0, size):
+		# copy the part of node at (x0, y0) that lies on the map into level
+		left = max(x0, 0)
+		top = max(y0, 0)
+		right = min(x0+size, self.width)
+		bottom = min(y0+size, self.height)
+		if left >= right or top >= bottom:
+			return
+		if node.population == 0 or node.population == 1 << (2*node.level):
+			run = [1 if node.population else 0]*(bottom-top)
+			for x in range(left, right):
+				level[x][top:bottom] = run
+			return
+		half = size//2
+		self._write(level, node.nw, x0, y0, half)
+		self._write(level, node.ne, x0+half, y0, half)
+		self._write(level, node.sw, x0, y0+half, half)
+		self._write(level, node.se, x0+half, y0+half, half)
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return OrderedDict([
+			("generation", self.generation),
+			("nodes", len(self._nodes)),
+			("memo", len(self._memo)),
+			("bytes", len(self._nodes)*NODE_BYTES + len(self._memo)*MEMO_BYTES),
+			("hits", self.hits),
+			("misses", self.misses),
+			("hitRate", float(self.hits)/lookups if lookups else 0.0),
+			("uniformHits", self.uniformHits),
+			("evictions", self.evictions),
+			("collections", self.collections),
+			])
+
+def runAutomata(level, generations, neighbors=4):
+	# bitboardAutomata.runAutomata, with the hashlife engine
+	return HashlifeAutomata(level, neighborhoodRules.automataRule(neighbors)).run(generations).toLevel()
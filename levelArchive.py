@@ -0,0 +1,228 @@
+'''
+=============
+Level Archive
+=============
+
+A file of pre-generated levels that can be handed out by
+index without loading anything first.
+
+	with ArchiveWriter("bsp.dla", 80, 50, "BSPTree") as writer:
+		for seed in range(1000000):
+			writer.add(generateSeededLevel("BSPTree", 80, 50, seed), seed)
+
+	archive = LevelArchive("bsp.dla")
+	level = archive[123456]
+	level[x][y], level.seed
+
+Every level in an archive has the same size, so every record
+has the same length: the level's tiles, one bit each, packed
+exactly like levelFormat's BITS encoding. Record i therefore
+starts at a fixed offset, and the seeds of all the records are
+kept in an index at the end of the file.
+
+LevelArchive opens the file with mmap, so opening an archive
+takes the same time whatever its size, and any number of
+processes reading the same archive share one copy of it in the
+page cache. archive[i] returns an ArchiveLevel, a read only
+view that reads tiles straight out of the mapped file; call
+toList() on it for an ordinary level that can be modified.
+Levels taken from an archive stay readable after it is closed,
+and the file stays mapped until the last of them is gone.
+
+Requires Python 3.
+'''
+
+import mmap
+import struct
+
+import levelFormat
+
+MAGIC = b"DLVA"
+VERSION = 1
+
+# magic, version, width, height, record length, count, index offset, algorithm length
+_header = struct.Struct(">4sBxxxIIIQQH")
+_seed = struct.Struct(">q")
+
+class LevelArchiveError(ValueError):
+	pass
+
+class ArchiveWriter:
+	'''
+	Writes an archive of width x height levels. The header is
+	finished when the writer is closed, so always close it (or
+	use it as a context manager).
+	'''
+	def __init__(self, path, width, height, algorithm=""):
+		self.width = width
+		self.height = height
+		self.algorithm = algorithm.encode("utf-8")
+		self.recordLength = (width*height + 7)//8
+		self.count = 0
+		self.index = bytearray() # the packed seeds, written out on close
+
+		self.f = open(path, "wb")
+		self.f.write(self._headerBytes(0, 0))
+
+	def _headerBytes(self, count, indexOffset):
+		return _header.pack(MAGIC, VERSION, self.width, self.height,
+			self.recordLength, count, indexOffset, len(self.algorithm)) + self.algorithm
+
+	def add(self, level, seed=0):
+		if len(level) != self.width or (self.width and len(level[0]) != self.height):
+			raise LevelArchiveError("levels in this archive must be %dx%d" % (self.width, self.height))
+		self.addPacked(levelFormat.packBits(levelFormat.tileBytes(level)), seed)
+
+	def addPacked(self, record, seed=0):
+		# add a level that is already bit packed
+		if len(record) != self.recordLength:
+			raise LevelArchiveError("records in this archive are %d bytes long" % self.recordLength)
+		self.f.write(record)
+		self.index += _seed.pack(seed)
+		self.count += 1
+
+	def close(self):
+		if self.f.closed:
+			return
+		indexOffset = self.f.tell()
+		self.f.write(self.index)
+		self.f.seek(0)
+		self.f.write(self._headerBytes(self.count, indexOffset))
+		self.f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+class LevelArchive:
+	def __init__(self, path):
+		with open(path, "rb") as f:
+			try:
+				self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError:
+				# mmap can't map an empty file
+				raise LevelArchiveError("too short to be a level archive")
+		self._view = memoryview(self._map)
+		try:
+			self._readHeader()
+		except LevelArchiveError:
+			self.close()
+			raise
+
+	def _readHeader(self):
+		if len(self._map) < _header.size:
+			raise LevelArchiveError("too short to be a level archive")
+		(magic, version, self.width, self.height, self.recordLength,
+			self.count, self._indexOffset, nameLength) = _header.unpack_from(self._map)
+		if magic != MAGIC:
+			raise LevelArchiveError("not a level archive (bad magic %r)" % (magic,))
+		if version > VERSION:
+			raise LevelArchiveError("level archive version %d is newer than %d" % (version, VERSION))
+
+		self._dataOffset = _header.size + nameLength
+		self.algorithm = bytes(self._map[_header.size:self._dataOffset]).decode("utf-8")
+		if self._indexOffset + self.count*_seed.size > len(self._map):
+			raise LevelArchiveError("archive is truncated")
+
+	def __len__(self):
+		return self.count
+
+	def __getitem__(self, i):
+		if i < 0:
+			i += self.count
+		if not 0 <= i < self.count:
+			raise IndexError("archive index out of range")
+		if self._view is None:
+			raise ValueError("the archive is closed")
+		start = self._dataOffset + i*self.recordLength
+		return ArchiveLevel(self._view[start:start+self.recordLength],
+			self.width, self.height, self.algorithm, self.seed(i))
+
+	def __iter__(self):
+		for i in range(self.count):
+			yield self[i]
+
+	def seed(self, i):
+		return _seed.unpack_from(self._map, self._indexOffset + i*_seed.size)[0]
+
+	def close(self):
+		if self._view is None:
+			return
+		self._view.release()
+		self._view = None
+		try:
+			self._map.close()
+		except BufferError:
+			# levels from archive[i] still hold views of the map, which
+			# stays open until the last of them is garbage collected
+			pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+class ArchiveLevel(object):
+	'''
+	A read only level backed by a record in a LevelArchive. It
+	can be indexed like any other level, level[x][y].
+	'''
+	__slots__ = ("record", "width", "height", "algorithm", "seed")
+
+	def __init__(self, record, width, height, algorithm, seed):
+		self.record = record # memoryview into the archive
+		self.width = width
+		self.height = height
+		self.algorithm = algorithm
+		self.seed = seed
+
+	def tile(self, x, y):
+		bit = x*self.height + y
+		return (self.record[bit >> 3] >> (7 - (bit & 7))) & 1
+
+	def __getitem__(self, x):
+		if x < 0:
+			x += self.width
+		if not 0 <= x < self.width:
+			raise IndexError("level index out of range")
+		return ArchiveColumn(self, x)
+
+	def __len__(self):
+		return self.width
+
+	def __iter__(self):
+		for x in range(self.width):
+			yield ArchiveColumn(self, x)
+
+	def toList(self):
+		# returns the level as an ordinary list of columns
+		flat = levelFormat.unpackBits(self.record, self.width*self.height)
+		return [list(flat[x*self.height:(x+1)*self.height]) for x in range(self.width)]
+
+	def toLevel(self):
+		return levelFormat.Level(self.toList(), self.algorithm, self.seed)
+
+class ArchiveColumn(object):
+	__slots__ = ("level", "x")
+
+	def __init__(self, level, x):
+		self.level = level
+		self.x = x
+
+	def __getitem__(self, y):
+		if y < 0:
+			y += self.level.height
+		if not 0 <= y < self.level.height:
+			raise IndexError("level index out of range")
+		return self.level.tile(self.x, y)
+
+	def __len__(self):
+		return self.level.height
+
+	def __iter__(self):
+		tile = self.level.tile
+		for y in range(self.level.height):
+			yield tile(self.x, y)
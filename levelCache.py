@@ -0,0 +1,223 @@
+'''
+===========
+Level Cache
+===========
+
+Daily seeds, shared seeds and retries mean that the same
+level gets asked for over and over again. LevelCache sits in
+front of the generators and remembers the levels it has
+already made.
+
+	cache = LevelCache(maxBytes=64*1024*1024, directory="levelCache")
+	level = cache.getLevel("CellularAutomata", 80, 50, seed=20240101)
+
+Levels are keyed by a sha256 of the algorithm, its params, the
+map size, the seed and a hash of the source code of
+dungeonGenerationAlgorithms and every module of this project
+that it imports, so editing an algorithm, or any of the helpers
+and rule tables it uses, automatically stops old levels from
+being served. Editing any generator invalidates the levels of
+all of them, which is the price of never serving a stale one.
+
+The memory tier is an LRU that holds levels as one byte per
+tile and evicts the least recently used levels once maxBytes is
+exceeded. If a directory is given, levels are also written
+there, zlib compressed in the levelFormat encoding, one file
+per key, and levels evicted from memory can be read back from
+disk. A file on disk that can't be read back (corrupt,
+truncated or from a newer version of levelFormat) counts as a
+miss and is deleted. Every call to getLevel returns a new list,
+so callers are free to modify it.
+'''
+
+import ast
+import hashlib
+import json
+import os
+import zlib
+from collections import OrderedDict
+
+import dungeonGenerationAlgorithms
+import levelFormat
+
+def sourceFiles(module=dungeonGenerationAlgorithms):
+	'''
+	Returns the paths of module's source file and of every module
+	in the same directory that it imports, directly or through
+	other modules, including imports made inside functions.
+	'''
+	directory = os.path.dirname(os.path.abspath(module.__file__))
+	start = os.path.splitext(os.path.basename(module.__file__))[0]
+	found = []
+	queue = [start]
+	while queue:
+		name = queue.pop(0)
+		path = os.path.join(directory, name + ".py")
+		if path in found or not os.path.exists(path):
+			continue # already seen, or not part of this project
+		found.append(path)
+		with open(path, "rb") as f:
+			tree = ast.parse(f.read(), path)
+		for node in ast.walk(tree):
+			if isinstance(node, ast.Import):
+				queue.extend(alias.name.split(".")[0] for alias in node.names)
+			elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+				queue.append(node.module.split(".")[0])
+	return sorted(found)
+
+_codeVersion = None
+
+def codeVersion(algorithm):
+	# a hash of all the code that generating a level can run
+	global _codeVersion
+	if algorithm not in dungeonGenerationAlgorithms.GENERATORS:
+		raise ValueError("unknown algorithm %r" % (algorithm,))
+	if _codeVersion is None:
+		digest = hashlib.sha256()
+		for path in sourceFiles():
+			with open(path, "rb") as f:
+				digest.update(os.path.basename(path).encode("utf-8") + b"\0" + f.read() + b"\0")
+		_codeVersion = digest.hexdigest()[:16]
+	return _codeVersion
+
+def cacheKey(algorithm, width, height, seed, params=None):
+	description = json.dumps({
+		"algorithm": algorithm,
+		"params": params or {},
+		"width": width,
+		"height": height,
+		"seed": seed,
+		"version": codeVersion(algorithm),
+		}, sort_keys=True, separators=(",",":"))
+	return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+def packLevel(level):
+	# one byte per tile, column by column
+	return bytes(bytearray(tile for column in level for tile in column))
+
+def unpackLevel(data, width, height):
+	return [list(bytearray(data[x*height:(x+1)*height])) for x in range(width)]
+
+class LevelCache:
+	def __init__(self, maxBytes=64*1024*1024, directory=None):
+		self.maxBytes = maxBytes
+		self.directory = directory # None keeps the cache in memory only
+
+		self._entries = OrderedDict() # key -> (width, height, packed level), oldest first
+		self.currentBytes = 0
+
+		self.hits = 0
+		self.diskHits = 0
+		self.misses = 0
+		self.evictions = 0
+
+		if self.directory and not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+
+	def getLevel(self, algorithm, width, height, seed, params=None):
+		'''
+		Returns the level for these arguments, from the cache if
+		it is there, and otherwise generating and caching it.
+		'''
+		key = cacheKey(algorithm, width, height, seed, params)
+		level = self.get(key)
+		if level is None:
+			level = dungeonGenerationAlgorithms.generateSeededLevel(
+				algorithm, width, height, seed, params)
+			self.put(key, level)
+		return level
+
+	def get(self, key):
+		# returns the cached level for key, or None
+		if key in self._entries:
+			self._entries.move_to_end(key)
+			self.hits += 1
+			width, height, data = self._entries[key]
+			return unpackLevel(data, width, height)
+
+		entry = self._readFromDisk(key)
+		if entry:
+			self.diskHits += 1
+			self._remember(key, *entry)
+			width, height, data = entry
+			return unpackLevel(data, width, height)
+
+		self.misses += 1
+		return None
+
+	def put(self, key, level):
+		width = len(level)
+		height = len(level[0]) if width else 0
+		data = packLevel(level)
+		self._remember(key, width, height, data)
+		if self.directory:
+			self._writeToDisk(key, width, height, data)
+
+	def _remember(self, key, width, height, data):
+		if key in self._entries:
+			self.currentBytes -= len(self._entries.pop(key)[2])
+		if len(data) > self.maxBytes:
+			return # would evict everything else and still not fit
+		self._entries[key] = (width, height, data)
+		self.currentBytes += len(data)
+
+		while self.currentBytes > self.maxBytes:
+			oldKey, (oldWidth, oldHeight, oldData) = self._entries.popitem(last=False)
+			self.currentBytes -= len(oldData)
+			self.evictions += 1
+
+	# ==== Disk Tier ====
+	def _path(self, key):
+		return os.path.join(self.directory, key+".dlvl")
+
+	def _writeToDisk(self, key, width, height, data):
+		path = self._path(key)
+		if os.path.exists(path):
+			return
+		encoded = levelFormat.encodeLevel(unpackLevel(data, width, height), compress=True)
+		# write to a temporary file first so that readers never see half a level
+		temporaryPath = "%s.%d.tmp" % (path, os.getpid())
+		with open(temporaryPath, "wb") as f:
+			f.write(encoded)
+		os.replace(temporaryPath, path)
+
+	def _readFromDisk(self, key):
+		if not self.directory:
+			return None
+		try:
+			with open(self._path(key), "rb") as f:
+				encoded = f.read()
+		except (IOError, OSError):
+			return None
+		try:
+			level = levelFormat.decodeLevel(encoded)
+		except (levelFormat.LevelFormatError, zlib.error, ValueError):
+			# a corrupt, truncated or newer file counts as a miss, and is
+			# removed so the level can be written again
+			try:
+				os.remove(self._path(key))
+			except OSError:
+				pass
+			return None
+		return level.width, level.height, packLevel(level.tiles)
+
+	def clear(self):
+		# forget everything held in memory (the disk tier is left alone)
+		self._entries.clear()
+		self.currentBytes = 0
+
+	def stats(self):
+		return {
+			"hits": self.hits,
+			"diskHits": self.diskHits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+			"entries": len(self._entries),
+			"bytes": self.currentBytes,
+			}
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, key):
+		return key in self._entries or bool(self.directory and os.path.exists(self._path(key)))
@@ -0,0 +1,303 @@
+'''
+============
+Level Format
+============
+
+A compact binary format for levels made of walls (1) and
+floors (0), for storing and sending pre-generated levels.
+
+	data = encodeLevel(level, "BSPTree", seed=1234)
+	record = decodeLevel(data)
+	record.algorithm, record.seed, record[x][y]
+
+Every encoded level starts with a header:
+
+	magic      4 bytes  b"DLVL"
+	version    1 byte
+	flags      1 byte   encoding in the low bits, COMPRESSED if zlib was applied
+	width      4 bytes  unsigned, big endian
+	height     4 bytes  unsigned, big endian
+	seed       8 bytes  signed, big endian
+	algorithm  2 byte length, then utf-8
+
+followed by the tiles, column by column (level[0][0],
+level[0][1], ... level[1][0], ...), in one of two encodings:
+
+	BITS  one bit per tile, padded with zeros to a whole byte
+	RUNS  run lengths of alternating tiles, starting with a run
+	      of walls (which may be 0 long), each as a LEB128 varint
+
+BITS costs width*height/8 bytes no matter what the level looks
+like. RUNS is usually smaller for levels made of large rooms
+and long corridors, and larger for noisy caves. Either one can
+be zlib compressed on top.
+
+LevelWriter and LevelReader store any number of levels in a
+single file as a short file header followed by length-prefixed
+records, so a file can be read one level at a time.
+
+Requires Python 3.
+'''
+
+import struct
+import zlib
+
+MAGIC = b"DLVL"
+VERSION = 1
+
+BITS = 0
+RUNS = 1
+ENCODINGS = {"bits": BITS, "runs": RUNS}
+COMPRESSED = 0x80
+
+_header = struct.Struct(">4sBBIIqH")
+
+# byte translation tables between one-byte-per-tile and "0"/"1" text
+_tilesToText = bytes.maketrans(b"\x00\x01", b"01")
+_textToTiles = bytes.maketrans(b"01", b"\x00\x01")
+
+class LevelFormatError(ValueError):
+	pass
+
+class Level(object):
+	'''
+	A level together with where it came from. Indexing a Level
+	indexes its tiles, so record[x][y] works like level[x][y].
+	'''
+	__slots__ = ("tiles", "algorithm", "seed")
+
+	def __init__(self, tiles, algorithm="", seed=0):
+		self.tiles = tiles
+		self.algorithm = algorithm
+		self.seed = seed
+
+	@property
+	def width(self):
+		return len(self.tiles)
+
+	@property
+	def height(self):
+		return len(self.tiles[0]) if self.tiles else 0
+
+	def __getitem__(self, x):
+		return self.tiles[x]
+
+	def __len__(self):
+		return len(self.tiles)
+
+	def __eq__(self, other):
+		if not isinstance(other, Level):
+			return NotImplemented
+		return (self.tiles, self.algorithm, self.seed) == (other.tiles, other.algorithm, other.seed)
+
+	def encode(self, encoding=BITS, compress=False):
+		return encodeLevel(self.tiles, self.algorithm, self.seed, encoding, compress)
+
+	@staticmethod
+	def decode(data):
+		return decodeLevel(data)
+
+# ==== Encoding ====
+def tileBytes(level):
+	# all of the tiles in a level, column by column, one byte each
+	flat = b"".join(bytes(column) for column in level)
+	if flat.translate(None, b"\x00\x01"):
+		raise LevelFormatError("levels may only contain 0 and 1 tiles")
+	return flat
+
+def packBits(flat):
+	if not flat:
+		return b""
+	text = flat.translate(_tilesToText)
+	text += b"0"*(-len(text) % 8)
+	return int(text, 2).to_bytes(len(text)//8, "big")
+
+def unpackBits(data, count):
+	if len(data)*8 < count:
+		raise LevelFormatError("%d bytes of bits can't hold %d tiles" % (len(data), count))
+	if not count:
+		return b""
+	text = format(int.from_bytes(data, "big"), "0%db" % (len(data)*8))
+	return text[:count].encode("ascii").translate(_textToTiles)
+
+def packRuns(flat):
+	out = bytearray()
+	value = 1
+	position = 0
+	end = len(flat)
+	while position < end:
+		# find where the current run of value stops
+		nextPosition = flat.find(b"\x00" if value else b"\x01", position)
+		if nextPosition < 0:
+			nextPosition = end
+		writeVarint(out, nextPosition-position)
+		position = nextPosition
+		value ^= 1
+	return bytes(out)
+
+def unpackRuns(data, count):
+	out = bytearray()
+	value = 1
+	position = 0
+	while position < len(data):
+		length, position = readVarint(data, position)
+		out += (b"\x01" if value else b"\x00")*length
+		value ^= 1
+	if len(out) != count:
+		raise LevelFormatError("runs cover %d tiles, expected %d" % (len(out), count))
+	return bytes(out)
+
+def writeVarint(out, n):
+	while n >= 0x80:
+		out.append((n & 0x7f) | 0x80)
+		n >>= 7
+	out.append(n)
+
+def readVarint(data, position):
+	n = 0
+	shift = 0
+	while True:
+		if position >= len(data):
+			raise LevelFormatError("the runs end partway through a number")
+		byte = data[position]
+		position += 1
+		n |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			return n, position
+		shift += 7
+
+def encodeLevel(level, algorithm="", seed=0, encoding=BITS, compress=False):
+	'''
+	Returns level (a list of columns, or a Level) encoded as
+	bytes. encoding can be BITS or RUNS, or their names.
+	'''
+	if isinstance(level, Level):
+		level = level.tiles
+	encoding = ENCODINGS.get(encoding, encoding)
+	width = len(level)
+	height = len(level[0]) if width else 0
+
+	flat = tileBytes(level)
+	if encoding == BITS:
+		payload = packBits(flat)
+	elif encoding == RUNS:
+		payload = packRuns(flat)
+	else:
+		raise LevelFormatError("unknown encoding %r" % (encoding,))
+
+	flags = encoding
+	if compress:
+		payload = zlib.compress(payload)
+		flags |= COMPRESSED
+
+	name = algorithm.encode("utf-8")
+	return _header.pack(MAGIC, VERSION, flags, width, height, seed, len(name)) + name + payload
+
+def decodeLevel(data):
+	# returns the Level encoded in data
+	if len(data) < _header.size:
+		raise LevelFormatError("too short to be a level")
+	magic, version, flags, width, height, seed, nameLength = _header.unpack_from(data)
+	if magic != MAGIC:
+		raise LevelFormatError("not a level (bad magic %r)" % (magic,))
+	if version > VERSION:
+		raise LevelFormatError("level format version %d is newer than %d" % (version, VERSION))
+
+	start = _header.size
+	if len(data) < start+nameLength:
+		raise LevelFormatError("the level ends partway through its algorithm name")
+	try:
+		algorithm = bytes(data[start:start+nameLength]).decode("utf-8")
+	except UnicodeDecodeError as e:
+		raise LevelFormatError("bad algorithm name: %s" % e)
+	payload = bytes(data[start+nameLength:])
+	if flags & COMPRESSED:
+		try:
+			payload = zlib.decompress(payload)
+		except zlib.error as e:
+			raise LevelFormatError("bad compressed payload: %s" % e)
+
+	encoding = flags & ~COMPRESSED
+	count = width*height
+	if encoding == BITS:
+		flat = unpackBits(payload, count)
+	elif encoding == RUNS:
+		flat = unpackRuns(payload, count)
+	else:
+		raise LevelFormatError("unknown encoding %d" % encoding)
+
+	tiles = [list(flat[x*height:(x+1)*height]) for x in range(width)]
+	return Level(tiles, algorithm, seed)
+
+# ==== Level Files ====
+FILE_MAGIC = b"DLVS"
+_fileHeader = struct.Struct(">4sB")
+_recordLength = struct.Struct(">I")
+
+class LevelWriter:
+	'''
+	Writes levels to a binary file object, one length-prefixed
+	record each.
+
+		with open("levels.dlvs", "wb") as f:
+			writer = LevelWriter(f, encoding=RUNS)
+			for seed in range(1000000):
+				writer.write(generateSeededLevel("BSPTree", 80, 50, seed), "BSPTree", seed)
+	'''
+	def __init__(self, f, encoding=BITS, compress=False):
+		self.f = f
+		self.encoding = encoding
+		self.compress = compress
+		self.count = 0
+		self.f.write(_fileHeader.pack(FILE_MAGIC, VERSION))
+
+	def write(self, level, algorithm="", seed=0):
+		if isinstance(level, Level):
+			level, algorithm, seed = level.tiles, level.algorithm, level.seed
+		self.writeEncoded(encodeLevel(level, algorithm, seed, self.encoding, self.compress))
+
+	def writeEncoded(self, data):
+		# write a level that is already encoded
+		self.f.write(_recordLength.pack(len(data)))
+		self.f.write(data)
+		self.count += 1
+
+class LevelReader:
+	'''
+	Reads levels back from a file written by LevelWriter, one at
+	a time, so that files of any size can be read.
+
+		with open("levels.dlvs", "rb") as f:
+			for level in LevelReader(f):
+				...
+	'''
+	def __init__(self, f):
+		self.f = f
+		header = self.f.read(_fileHeader.size)
+		if len(header) < _fileHeader.size:
+			raise LevelFormatError("too short to be a level file")
+		magic, version = _fileHeader.unpack(header)
+		if magic != FILE_MAGIC:
+			raise LevelFormatError("not a level file (bad magic %r)" % (magic,))
+		if version > VERSION:
+			raise LevelFormatError("level file version %d is newer than %d" % (version, VERSION))
+
+	def readEncoded(self):
+		# returns the next encoded level, or None at the end of the file
+		prefix = self.f.read(_recordLength.size)
+		if not prefix:
+			return None
+		if len(prefix) < _recordLength.size:
+			raise LevelFormatError("truncated record length")
+		length, = _recordLength.unpack(prefix)
+		data = self.f.read(length)
+		if len(data) < length:
+			raise LevelFormatError("truncated level record")
+		return data
+
+	def __iter__(self):
+		while True:
+			data = self.readEncoded()
+			if data is None:
+				return
+			yield decodeLevel(data)
@@ -0,0 +1,381 @@
+'''
+=============
+Level Metrics
+=============
+
+Quality measurements for finished levels, cheap enough to run
+on every level that gets baked.
+
+	metrics = measureLevel(level)
+	if metrics["largestRegionShare"] < 0.9:
+		... reject the level
+
+measureLevel returns:
+
+	floorRatio          floor tiles / all tiles
+	regions             number of separate floor regions (4-connected)
+	largestRegionShare  floor tiles in the largest region / floor tiles
+	deadEnds            floor tiles with exactly one floor neighbor
+	corridorRatio       corridor tiles / room tiles, where a room tile is
+	                    any floor tile that is part of a 2x2 block of floor
+	longestPath         length of the longest shortest path through the
+	                    largest region, estimated with a double BFS (exact
+	                    when the region has no loops, a lower bound when it does)
+
+Neighbor counts are done with whole array shifts when numpy is
+installed, and with a column at a time sweep when it isn't. The
+BFS behind longestPath moves its whole frontier one step at a
+time with array offsets when numpy is installed and the region
+is big enough for that to pay off, and a tile at a time
+otherwise; both give the same path lengths.
+Regions are labeled in one pass over runs of floor, so labeling
+costs about one step per run rather than one per tile.
+
+MetricsAggregator keeps running statistics of these metrics per
+algorithm: mean, standard deviation, min, max and quantiles
+(estimated with the P-square algorithm), in a fixed amount of
+memory no matter how many levels are added.
+'''
+
+from collections import OrderedDict
+
+try:
+	import numpy
+	numpyAvailable = True
+except ImportError:
+	numpyAvailable = False
+
+# ==== Regions ====
+def floorRuns(column):
+	# returns the (top, bottom) of each run of floor in a column, bottom exclusive
+	tiles = bytes(bytearray(column))
+	runs = []
+	top = tiles.find(b"\x00")
+	while top >= 0:
+		bottom = tiles.find(b"\x01", top)
+		if bottom < 0:
+			bottom = len(tiles)
+		runs.append((top, bottom))
+		top = tiles.find(b"\x00", bottom)
+	return runs
+
+def findRegions(level):
+	'''
+	Returns a list of the separate floor regions of level, each
+	one a list of (x, top, bottom) runs of floor.
+	'''
+	runs = [] # (x, top, bottom)
+	parent = []
+
+	def find(i):
+		while parent[i] != i:
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+
+	previous = [] # indices of the runs in the previous column
+	for x, column in enumerate(level):
+		current = []
+		for top, bottom in floorRuns(column):
+			i = len(runs)
+			runs.append((x, top, bottom))
+			parent.append(i)
+			current.append(i)
+
+		# runs are sorted by top, so the overlapping pairs can be found in one merge
+		a = b = 0
+		while a < len(previous) and b < len(current):
+			previousRun = runs[previous[a]]
+			currentRun = runs[current[b]]
+			if previousRun[1] < currentRun[2] and currentRun[1] < previousRun[2]:
+				rootA = find(previous[a])
+				rootB = find(current[b])
+				if rootA != rootB:
+					parent[rootB] = rootA
+			if previousRun[2] < currentRun[2]:
+				a += 1
+			else:
+				b += 1
+		previous = current
+
+	regions = OrderedDict()
+	for i, run in enumerate(runs):
+		regions.setdefault(find(i), []).append(run)
+	return list(regions.values())
+
+def regionSize(region):
+	return sum(bottom-top for x, top, bottom in region)
+
+# ==== Neighbor Counts ====
+def _countTilesNumpy(level):
+	floor = (numpy.asarray(level, dtype=numpy.uint8) == 0).astype(numpy.uint8)
+	padded = numpy.zeros((floor.shape[0]+2, floor.shape[1]+2), dtype=numpy.uint8)
+	padded[1:-1,1:-1] = floor
+	neighbors = padded[:-2,1:-1] + padded[2:,1:-1] + padded[1:-1,:-2] + padded[1:-1,2:]
+	deadEnds = int(numpy.count_nonzero(floor & (neighbors == 1)))
+
+	# a tile is a room tile if it is one corner of a 2x2 block of floor
+	blocks = floor[:-1,:-1] & floor[1:,:-1] & floor[:-1,1:] & floor[1:,1:]
+	roomTiles = numpy.zeros_like(floor)
+	roomTiles[:-1,:-1] |= blocks
+	roomTiles[1:,:-1] |= blocks
+	roomTiles[:-1,1:] |= blocks
+	roomTiles[1:,1:] |= blocks
+
+	return int(floor.sum()), deadEnds, int(roomTiles.sum())
+
+def _countTilesPython(level):
+	height = len(level[0])
+	walls = [1]*height
+	floorTiles = deadEnds = roomTiles = 0
+	for x in range(len(level)):
+		left = level[x-1] if x > 0 else walls
+		column = level[x]
+		right = level[x+1] if x+1 < len(level) else walls
+		for y in range(height):
+			if column[y] != 0:
+				continue
+			floorTiles += 1
+			up = y > 0 and column[y-1] == 0
+			down = y+1 < height and column[y+1] == 0
+			west = left[y] == 0
+			east = right[y] == 0
+			if up + down + west + east == 1:
+				deadEnds += 1
+			if ((up and ((west and left[y-1] == 0) or (east and right[y-1] == 0))) or
+				(down and ((west and left[y+1] == 0) or (east and right[y+1] == 0)))):
+				roomTiles += 1
+	return floorTiles, deadEnds, roomTiles
+
+def countTiles(level):
+	# returns the number of floor tiles, dead ends and room tiles in level
+	if numpyAvailable:
+		return _countTilesNumpy(level)
+	return _countTilesPython(level)
+
+# ==== Paths ====
+def _bfsNumpy(passable, start, height):
+	# _bfs, moving the whole frontier at once with array offsets
+	unseen = numpy.frombuffer(bytes(passable), dtype=numpy.uint8).astype(bool)
+	unseen[start] = False
+	# which entry of the next frontier each tile came from, to drop tiles reached twice without sorting
+	entry = numpy.zeros(len(passable), dtype=numpy.intp)
+	offsets = numpy.array([-1, 1, -height, height])
+	frontier = numpy.array([start])
+	distance = 0
+	while True:
+		neighbors = (frontier[:,None] + offsets).ravel()
+		neighbors = neighbors[unseen[neighbors]]
+		if not len(neighbors):
+			return int(frontier.max()), distance
+		order = numpy.arange(len(neighbors))
+		entry[neighbors] = order
+		neighbors = neighbors[entry[neighbors] == order]
+		unseen[neighbors] = False
+		frontier = neighbors
+		distance += 1
+
+def _bfsPython(passable, start, height):
+	seen = bytearray(len(passable))
+	seen[start] = 1
+	frontier = [start]
+	distance = 0
+	while True:
+		nextFrontier = []
+		for i in frontier:
+			for j in (i-1, i+1, i-height, i+height):
+				if passable[j] and not seen[j]:
+					seen[j] = 1
+					nextFrontier.append(j)
+		if not nextFrontier:
+			return max(frontier), distance
+		frontier = nextFrontier
+		distance += 1
+
+def _bfs(passable, start, height, useNumpy):
+	# returns the farthest index from start (the highest, if there are several), and its distance
+	if useNumpy:
+		return _bfsNumpy(passable, start, height)
+	return _bfsPython(passable, start, height)
+
+def longestShortestPath(region, height):
+	'''
+	Estimates the longest shortest path through a region by
+	running a BFS from any tile, then another one from the
+	farthest tile that the first one found.
+	'''
+	if not region:
+		return 0
+	# index tiles in a grid with a one tile border, so that the BFS never needs bounds checks
+	paddedHeight = height+2
+	width = max(x for x, top, bottom in region)+3
+	passable = bytearray(width*paddedHeight)
+	for x, top, bottom in region:
+		start = (x+1)*paddedHeight + top+1
+		passable[start:start+bottom-top] = b"\x01"*(bottom-top)
+
+	# small regions have frontiers too small for numpy to pay off
+	useNumpy = numpyAvailable and regionSize(region) >= 4096
+	x, top, bottom = region[0]
+	farthest, _ = _bfs(passable, (x+1)*paddedHeight + top+1, paddedHeight, useNumpy)
+	return _bfs(passable, farthest, paddedHeight, useNumpy)[1]
+
+def measureLevel(level):
+	# returns an OrderedDict of the metrics described at the top of this file
+	width = len(level)
+	height = len(level[0]) if width else 0
+	floorTiles, deadEnds, roomTiles = countTiles(level) if width and height else (0, 0, 0)
+	regions = findRegions(level)
+	largest = max(regions, key=regionSize) if regions else []
+	corridorTiles = floorTiles - roomTiles
+
+	metrics = OrderedDict()
+	metrics["floorRatio"] = float(floorTiles)/(width*height) if width*height else 0.0
+	metrics["regions"] = len(regions)
+	metrics["largestRegionShare"] = float(regionSize(largest))/floorTiles if floorTiles else 0.0
+	metrics["deadEnds"] = deadEnds
+	metrics["corridorRatio"] = float(corridorTiles)/roomTiles if roomTiles else float("inf")
+	metrics["longestPath"] = longestShortestPath(largest, height)
+	return metrics
+
+# ==== Streaming Statistics ====
+class RunningStats:
+	# mean and variance with Welford's method
+	def __init__(self):
+		self.count = 0
+		self.mean = 0.0
+		self._m2 = 0.0
+		self.minimum = None
+		self.maximum = None
+
+	def add(self, value):
+		self.count += 1
+		delta = value - self.mean
+		self.mean += delta/self.count
+		self._m2 += delta*(value - self.mean)
+		if self.minimum is None or value < self.minimum:
+			self.minimum = value
+		if self.maximum is None or value > self.maximum:
+			self.maximum = value
+
+	@property
+	def variance(self):
+		return self._m2/(self.count-1) if self.count > 1 else 0.0
+
+	@property
+	def standardDeviation(self):
+		return self.variance**0.5
+
+class P2Quantile:
+	'''
+	Estimates one quantile of a stream of values with the
+	P-square algorithm (Jain and Chlamtac, 1985), using five
+	markers instead of storing the values.
+	'''
+	def __init__(self, q):
+		self.q = q
+		self.heights = []
+		self.positions = [1, 2, 3, 4, 5]
+		self.desired = [1, 1+2*q, 1+4*q, 3+2*q, 5]
+		self.increments = [0, q/2.0, q, (1+q)/2.0, 1]
+
+	def add(self, value):
+		heights = self.heights
+		if len(heights) < 5:
+			heights.append(value)
+			heights.sort()
+			return
+
+		# find the cell that value falls in, and move the markers above it
+		if value < heights[0]:
+			heights[0] = value
+			k = 0
+		elif value >= heights[4]:
+			heights[4] = max(heights[4], value)
+			k = 3
+		else:
+			k = 0
+			while value >= heights[k+1]:
+				k += 1
+		for i in range(k+1, 5):
+			self.positions[i] += 1
+		for i in range(5):
+			self.desired[i] += self.increments[i]
+
+		# adjust the middle markers towards where they should be
+		for i in range(1, 4):
+			d = self.desired[i] - self.positions[i]
+			if ((d >= 1 and self.positions[i+1] - self.positions[i] > 1) or
+				(d <= -1 and self.positions[i-1] - self.positions[i] < -1)):
+				d = 1 if d > 0 else -1
+				height = self._parabolic(i, d)
+				if not heights[i-1] < height < heights[i+1]:
+					height = self._linear(i, d)
+				heights[i] = height
+				self.positions[i] += d
+
+	def _parabolic(self, i, d):
+		n = self.positions
+		h = self.heights
+		return h[i] + float(d)/(n[i+1]-n[i-1])*(
+			(n[i]-n[i-1]+d)*(h[i+1]-h[i])/(n[i+1]-n[i]) +
+			(n[i+1]-n[i]-d)*(h[i]-h[i-1])/(n[i]-n[i-1]))
+
+	def _linear(self, i, d):
+		n = self.positions
+		h = self.heights
+		return h[i] + d*(h[i+d]-h[i])/float(n[i+d]-n[i])
+
+	@property
+	def value(self):
+		if not self.heights:
+			return None
+		if len(self.heights) < 5:
+			# not enough values for the markers yet, so use the exact quantile
+			return self.heights[min(len(self.heights)-1, int(self.q*len(self.heights)))]
+		return self.heights[2]
+
+class MetricsAggregator:
+	'''
+	Running statistics of level metrics, kept separately for
+	each algorithm.
+
+		aggregator = MetricsAggregator()
+		for level in iterLevels("BSPTree", 1000000):
+			aggregator.add("BSPTree", measureLevel(level))
+		aggregator.summary()
+	'''
+	QUANTILES = (0.05, 0.5, 0.95)
+
+	def __init__(self, quantiles=QUANTILES):
+		self.quantiles = quantiles
+		self.stats = OrderedDict() # algorithm -> metric -> (RunningStats, [P2Quantile])
+
+	def add(self, algorithm, metrics):
+		statsByMetric = self.stats.setdefault(algorithm, OrderedDict())
+		for name, value in metrics.items():
+			if value != value or value in (float("inf"), float("-inf")):
+				continue # NaN and infinity would poison the mean
+			if name not in statsByMetric:
+				statsByMetric[name] = (RunningStats(), [P2Quantile(q) for q in self.quantiles])
+			running, estimators = statsByMetric[name]
+			running.add(value)
+			for estimator in estimators:
+				estimator.add(value)
+
+	def summary(self):
+		summary = OrderedDict()
+		for algorithm, statsByMetric in self.stats.items():
+			summary[algorithm] = OrderedDict()
+			for name, (running, estimators) in statsByMetric.items():
+				entry = OrderedDict([
+					("count", running.count),
+					("mean", running.mean),
+					("std", running.standardDeviation),
+					("min", running.minimum),
+					("max", running.maximum),
+					])
+				for estimator in estimators:
+					entry["p%g" % (estimator.q*100)] = estimator.value
+				summary[algorithm][name] = entry
+		return summary
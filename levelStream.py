@@ -0,0 +1,101 @@
+'''
+============
+Level Stream
+============
+
+Generate any number of levels one at a time, without ever
+holding more than a few of them in memory.
+
+	for level in iterLevels("CellularAutomata", 1000000, seed=42):
+		writer.write(level)
+
+Level i of a run is generated from levelSeed(seed, i), so every
+level can be regenerated on its own, and an interrupted run can
+be picked up again by passing the number of levels already
+consumed as startIndex:
+
+	for level in iterLevels("CellularAutomata", 1000000, seed=42, startIndex=531200):
+		...
+
+Levels are generated ahead of the consumer in a pool of worker
+processes, in batches of batchSize. At most prefetch batches are
+queued or in flight at once, so a slow consumer holds up the
+workers instead of letting finished levels pile up. Pass
+processes=0 to generate the levels in this process instead.
+
+By default iterLevels yields levelFormat.Level objects. Pass an
+encoding ("bits" or "runs") to get the encoded bytes instead,
+ready to hand to a LevelWriter or a socket.
+
+Requires Python 3.
+'''
+
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import dungeonGenerationAlgorithms
+import levelFormat
+
+def levelSeed(seed, index):
+	# the seed for level index of a run started from seed
+	digest = hashlib.sha256(("%d:%d" % (seed, index)).encode("ascii")).digest()
+	return int.from_bytes(digest[:8], "big", signed=True)
+
+def _generateBatch(algorithm, width, height, seeds, params, encoding, compress):
+	# runs in a worker process, and returns the levels encoded
+	return [levelFormat.encodeLevel(
+		dungeonGenerationAlgorithms.generateSeededLevel(algorithm, width, height, s, params),
+		algorithm, s, encoding, compress) for s in seeds]
+
+def iterLevels(algorithm, count, seed=0, params=None,
+	width=dungeonGenerationAlgorithms.MAP_WIDTH, height=dungeonGenerationAlgorithms.MAP_HEIGHT,
+	startIndex=0, encoding=None, compress=False,
+	processes=None, batchSize=8, prefetch=None, executor=None):
+	'''
+	Yields levels startIndex to count-1 of the run, in order.
+	'''
+	# check the arguments here rather than in a worker
+	dungeonGenerationAlgorithms.createGenerator(algorithm, params)
+
+	if processes == 0 and executor is None:
+		for index in range(startIndex, count):
+			s = levelSeed(seed, index)
+			level = dungeonGenerationAlgorithms.generateSeededLevel(algorithm, width, height, s, params)
+			if encoding is None:
+				yield levelFormat.Level(level, algorithm, s)
+			else:
+				yield levelFormat.encodeLevel(level, algorithm, s, encoding, compress)
+		return
+
+	ownsExecutor = executor is None
+	if ownsExecutor:
+		executor = ProcessPoolExecutor(max_workers=processes)
+	if prefetch is None:
+		prefetch = 2*(processes or os.cpu_count() or 1)
+
+	# workers send levels back bit packed, which is the cheapest to pickle
+	workerEncoding = levelFormat.BITS if encoding is None else encoding
+	batches = deque()
+	nextIndex = startIndex
+
+	try:
+		while batches or nextIndex < count:
+			while len(batches) < prefetch and nextIndex < count:
+				seeds = [levelSeed(seed, index) for index in range(nextIndex, min(nextIndex+batchSize, count))]
+				batches.append(executor.submit(_generateBatch, algorithm, width, height,
+					seeds, params, workerEncoding, compress))
+				nextIndex += len(seeds)
+
+			for data in batches.popleft().result():
+				if encoding is None:
+					yield levelFormat.decodeLevel(data)
+				else:
+					yield data
+	finally:
+		# runs when the consumer stops early, too
+		for batch in batches:
+			batch.cancel()
+		if ownsExecutor:
+			executor.shutdown(wait=False, cancel_futures=True)
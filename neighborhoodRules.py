@@ -0,0 +1,201 @@
+'''
+==================
+Neighborhood Rules
+==================
+
+Most of the local rules in these generators (smoothing, filling,
+cellular automata steps, dead end removal) decide what to do
+with a tile by looking only at the 3x3 block of tiles around
+it. A 3x3 block of walls (1) and floors (0) fits in 9 bits, so
+any such rule can be worked out ahead of time for all 512
+possible blocks and stored in a table. Applying the rule is
+then a single table lookup.
+
+The bit for the tile at (x+dx, y+dy) is (dy+1)*3 + (dx+1):
+
+	bit 0  bit 1  bit 2        (-1,-1) ( 0,-1) ( 1,-1)
+	bit 3  bit 4  bit 5   =    (-1, 0) ( 0, 0) ( 1, 0)
+	bit 6  bit 7  bit 8        (-1, 1) ( 0, 1) ( 1, 1)
+
+so bit 4 is the tile itself.
+
+	# open up walls with at most one wall to the north, south, east or west
+	smooth = compileRule(lambda n: 0 if n.center == 1 and n.walls4 <= 1 else n.center)
+	sweep(level, smooth)
+
+sweep and sweepRows apply a table to every tile in a rectangle,
+in place, in the same order as the loops they replace (column
+by column, or row by row). Rather than reading all nine tiles
+for every tile, they slide the block along: moving one tile
+down drops the top row of the block and reads only the new
+bottom row. When a tile changes, its bit in the block is
+patched so that the rest of the sweep sees the new value, just
+as the original in place loops did.
+
+Tiles must be 0 or 1.
+'''
+
+class Neighborhood(object):
+	# the 3x3 block passed to a rule while it is compiled
+	__slots__ = ("mask",)
+
+	def __init__(self, mask):
+		self.mask = mask
+
+	def tile(self, dx, dy):
+		return (self.mask >> ((dy+1)*3 + dx+1)) & 1
+
+	@property
+	def center(self):
+		return (self.mask >> 4) & 1
+
+	@property
+	def walls4(self):
+		# walls to the north, south, east and west
+		return self.tile(0,-1) + self.tile(0,1) + self.tile(-1,0) + self.tile(1,0)
+
+	@property
+	def walls8(self):
+		# walls in all 8 directions
+		return bin(self.mask & ~16).count("1")
+
+def compileRule(rule):
+	'''
+	Returns a 512 entry table of rule(Neighborhood) for every
+	possible 3x3 block. rule must return an int from 0 to 255.
+	'''
+	return bytearray(rule(Neighborhood(mask)) for mask in range(512))
+
+# tables for counting walls around a tile
+WALLS4 = compileRule(lambda n: n.walls4)
+WALLS8 = compileRule(lambda n: n.walls8)
+
+# fill in floors that have at most one exit
+FILL_DEAD_ENDS = compileRule(lambda n: 1 if n.center == 0 and n.walls4 >= 3 else n.center)
+
+# walls with floor on at least two sides, which might join two regions
+CONNECTOR_CANDIDATES = compileRule(lambda n: 1 if n.center == 1 and n.walls4 <= 2 else 0)
+
+_compiledRules = {}
+
+def smoothingRule(smoothing, filling=None):
+	'''
+	Opens walls with at most smoothing walls around them (north,
+	south, east and west), then, if filling is given, fills in
+	floors with at least filling walls around them.
+	'''
+	key = ("smoothing", smoothing, filling)
+	if key not in _compiledRules:
+		def rule(n):
+			center = n.center
+			if center == 1 and n.walls4 <= smoothing:
+				center = 0
+			if filling is not None and center == 0 and n.walls4 >= filling:
+				center = 1
+			return center
+		_compiledRules[key] = compileRule(rule)
+	return _compiledRules[key]
+
+def automataRule(neighbors):
+	# a tile becomes a wall with more than neighbors walls around it, and floor with fewer
+	key = ("automata", neighbors)
+	if key not in _compiledRules:
+		def rule(n):
+			if n.walls8 > neighbors:
+				return 1
+			if n.walls8 < neighbors:
+				return 0
+			return n.center
+		_compiledRules[key] = compileRule(rule)
+	return _compiledRules[key]
+
+def composeTables(first, second):
+	# a table that applies first to a tile, then second to the result
+	return bytearray(second[(mask & ~16) | (first[mask] << 4)] for mask in range(512))
+
+def neighborhoodMask(level, x, y):
+	# the 3x3 block around (x,y), which must not be on the edge of level
+	left = level[x-1]
+	column = level[x]
+	right = level[x+1]
+	return (left[y-1] | column[y-1]<<1 | right[y-1]<<2 |
+		left[y]<<3 | column[y]<<4 | right[y]<<5 |
+		left[y+1]<<6 | column[y+1]<<7 | right[y+1]<<8)
+
+def _bounds(level, x1, y1, x2, y2):
+	# default to every tile that is not on the edge of the level
+	if x2 is None:
+		x2 = len(level)-1
+	if y2 is None:
+		y2 = len(level[0])-1
+	return x1, y1, x2, y2
+
+def sweep(level, table, x1=1, y1=1, x2=None, y2=None):
+	'''
+	Sets every tile with x1 <= x < x2 and y1 <= y < y2 to
+	table[its 3x3 block], column by column, in place. Returns
+	the number of tiles that changed.
+	'''
+	x1, y1, x2, y2 = _bounds(level, x1, y1, x2, y2)
+	if x2 <= x1 or y2 <= y1:
+		return 0
+	changed = 0
+	for x in range(x1, x2):
+		left = level[x-1]
+		column = level[x]
+		right = level[x+1]
+		# the top two rows of the first block
+		mask = (left[y1-1] | column[y1-1]<<1 | right[y1-1]<<2 |
+			left[y1]<<3 | column[y1]<<4 | right[y1]<<5)
+		for y in range(y1, y2):
+			mask |= (left[y+1] | column[y+1]<<1 | right[y+1]<<2) << 6
+			value = table[mask]
+			if value != column[y]:
+				column[y] = value
+				changed += 1
+				mask = (mask & ~16) | (value << 4)
+			mask >>= 3
+	return changed
+
+def sweepRows(level, table, x1=1, y1=1, x2=None, y2=None):
+	# sweep, but row by row, for loops that run over x inside y
+	x1, y1, x2, y2 = _bounds(level, x1, y1, x2, y2)
+	if x2 <= x1 or y2 <= y1:
+		return 0
+	changed = 0
+	for y in range(y1, y2):
+		left = level[x1-1]
+		center = level[x1]
+		# the left two columns of the first block
+		mask = (left[y-1] | center[y-1]<<1 |
+			left[y]<<3 | center[y]<<4 |
+			left[y+1]<<6 | center[y+1]<<7)
+		for x in range(x1, x2):
+			right = level[x+1]
+			mask |= right[y-1]<<2 | right[y]<<5 | right[y+1]<<8
+			value = table[mask]
+			if value != level[x][y]:
+				level[x][y] = value
+				changed += 1
+				mask = (mask & ~16) | (value << 4)
+			mask = (mask >> 1) & 0b011011011
+	return changed
+
+def findTiles(level, table, x1=1, y1=1, x2=None, y2=None):
+	# returns the (x,y) of every tile whose 3x3 block has a nonzero entry in table, column by column
+	x1, y1, x2, y2 = _bounds(level, x1, y1, x2, y2)
+	found = []
+	if x2 <= x1 or y2 <= y1:
+		return found
+	for x in range(x1, x2):
+		left = level[x-1]
+		column = level[x]
+		right = level[x+1]
+		mask = (left[y1-1] | column[y1-1]<<1 | right[y1-1]<<2 |
+			left[y1]<<3 | column[y1]<<4 | right[y1]<<5)
+		for y in range(y1, y2):
+			mask |= (left[y+1] | column[y+1]<<1 | right[y+1]<<2) << 6
+			if table[mask]:
+				found.append((x,y))
+			mask >>= 3
+	return found
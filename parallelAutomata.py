@@ -0,0 +1,533 @@
+'''
+==================
+Parallel Automata
+==================
+
+Runs the bitboard cellular automata from bitboardAutomata on a
+single huge map with several processes at once.
+
+	world = ParallelAutomata(8000, 8000, processes=8)
+	world.randomFill(seed=1234, wallProbability=0.5)
+	world.run(generations=5, neighbors=4)
+	world.smooth(passes=5, smoothing=1)
+	regions = world.labelRegions()
+	gaps = world.regionGaps(regions)
+	level = world.toLevel()
+	world.close()
+
+The map lives in shared memory, one byte per tile, column by
+column, so every process can see all of it without copying.
+The interior columns are split into one strip per process. Each
+process keeps its strip as bitboard columns and steps it on its
+own. After every step it publishes the first and last columns of
+its strip (its halo) and waits at a barrier for the others, then
+reads the columns on either side of its strip from its
+neighbors. Halos are double buffered by step, so a process that
+runs ahead can never overwrite a halo that a slower neighbor
+hasn't read yet.
+
+Levels are stored as columns (level[x][y]), so the strips are
+ranges of x rather than of y.
+
+smooth runs the cleanUpMap smoothing passes the same way, with
+bitboardAutomata.smoothStep. Like the automata steps these are
+synchronous, so they don't give exactly the same level as the in
+place sweeps of cleanUpMap.
+
+labelRegions labels the floor regions of each strip in its own
+process, then joins regions that meet across the seams between
+strips with a union-find in this process. regionGaps is
+postProcessing.regionGaps split into strips: each process grows
+the regions outward through the walls of its own strip, one
+step at a time, and swaps the tiles it claimed in its first and
+last columns with its neighbors after every step. Where two
+fronts reach a tile at the same step, the one that grew from the
+region tile nearest the start of the map wins, so the gaps found
+don't depend on the number of processes. columns gives a level[x][y] view that
+writes straight to the shared map, for the carving helpers.
+
+CellularAutomata's parallel engine runs every phase that looks
+at the whole map this way. Only carving (filling in small caves
+and digging the tunnels), which touches a run of tiles at a
+time, and copying the finished level out with toLevel are done
+in one process.
+
+If a strip's worker dies, the others are woken from the barrier
+instead of waiting for it forever, and run, smooth or regionGaps
+raises RuntimeError.
+
+Random fills are seeded per column, so the same seed gives the
+same map whatever the number of processes.
+
+Requires Python 3.8 or later.
+'''
+
+import array
+import bisect
+import multiprocessing
+import multiprocessing.connection
+import random
+import threading
+from multiprocessing import shared_memory
+
+import bitboardAutomata
+import levelMetrics
+
+def _stripBounds(start, end, strips):
+	# splits range(start, end) into strips nearly equal ranges
+	size = end - start
+	return [(start + size*i//strips, start + size*(i+1)//strips) for i in range(strips)]
+
+def _fillStrip(gridName, width, height, x0, x1, seed, wallProbability):
+	grid = shared_memory.SharedMemory(name=gridName)
+	try:
+		for x in range(x0, x1):
+			column = bytearray(b"\x01"*height)
+			if 0 < x < width-1:
+				rand = random.Random("%d:%d" % (seed, x))
+				for y in range(1, height-1):
+					if rand.random() >= wallProbability:
+						column[y] = 0
+			grid.buf[x*height:(x+1)*height] = column
+	finally:
+		grid.close()
+
+def _callWorker(target, sender, *arguments):
+	# runs in a worker process, and sends target's result back
+	sender.send(target(*arguments))
+	sender.close()
+
+def _wait(barrier, timeout):
+	try:
+		barrier.wait(timeout)
+	except threading.BrokenBarrierError:
+		# another strip failed, so this one can't finish either
+		raise SystemExit(1)
+
+def _runStrip(gridName, haloName, width, height, strips, index, x0, x1, generations, stepFunction, stepArguments,
+	barrier, timeout):
+	'''
+	Steps columns x0 to x1-1 generations times with
+	stepFunction(board, height, *stepArguments), swapping halo
+	columns with the neighboring strips after every step. If
+	another strip's worker dies the barrier is broken, and this
+	one gives up too.
+	'''
+	grid = shared_memory.SharedMemory(name=gridName)
+	halo = shared_memory.SharedMemory(name=haloName)
+	try:
+		slotSize = (height+7)//8
+		def slot(parity, strip, side):
+			start = ((parity*strips + strip)*2 + side)*slotSize
+			return slice(start, start+slotSize)
+
+		# the strip, with a fixed column on each side
+		board = [bitboardAutomata.packColumn(grid.buf[x*height:(x+1)*height]) for x in range(x0-1, x1+1)]
+		for generation in range(generations):
+			board = stepFunction(board, height, *stepArguments)
+			if generation == generations-1:
+				break
+
+			parity = generation % 2
+			halo.buf[slot(parity, index, 0)] = board[1].to_bytes(slotSize, "little")
+			halo.buf[slot(parity, index, 1)] = board[-2].to_bytes(slotSize, "little")
+			_wait(barrier, timeout)
+			if index > 0:
+				board[0] = int.from_bytes(halo.buf[slot(parity, index-1, 1)], "little")
+			if index < strips-1:
+				board[-1] = int.from_bytes(halo.buf[slot(parity, index+1, 0)], "little")
+
+		for x, column in zip(range(x0, x1), board[1:-1]):
+			grid.buf[x*height:(x+1)*height] = bitboardAutomata.unpackColumn(column, height)
+	finally:
+		grid.close()
+		halo.close()
+
+def _labelStrip(gridName, height, x0, x1):
+	'''
+	Labels the floor regions of columns x0 to x1-1. Returns each
+	region as a list of (x, top, bottom) runs, and the region of
+	each floor run in the first and last columns.
+	'''
+	grid = shared_memory.SharedMemory(name=gridName)
+	try:
+		columns = [bytes(grid.buf[x*height:(x+1)*height]) for x in range(x0, x1)]
+	finally:
+		grid.close()
+	regions = []
+	firstRuns = []
+	lastRuns = []
+	for r, region in enumerate(levelMetrics.findRegions(columns)):
+		regions.append([(x+x0, top, bottom) for x, top, bottom in region])
+		for x, top, bottom in region:
+			if x == 0:
+				firstRuns.append((top, bottom, r))
+			if x == x1-x0-1:
+				lastRuns.append((top, bottom, r))
+	firstRuns.sort()
+	lastRuns.sort()
+	return regions, firstRuns, lastRuns
+
+def _gapStrip(haloName, flagsName, height, strips, index, x0, x1, runs, barrier, timeout):
+	'''
+	postProcessing.regionGaps for columns x0 to x1-1. runs are
+	the (x, top, bottom, region) runs of floor in the strip.
+	Returns {(regionA, regionB): (length, tileA, tileB)}, with
+	tiles as indexes into the padded map that regionGaps uses.
+	'''
+	halo = shared_memory.SharedMemory(name=haloName)
+	flags = shared_memory.SharedMemory(name=flagsName)
+	try:
+		# the strip, then a halo column on each side for the neighbors' tiles, then a column
+		# of nothing on each side of that, so that no tile's neighbors run off the arrays
+		paddedHeight = height+2
+		columns = x1-x0
+		size = (columns+4)*paddedHeight
+		shift = (x0-1)*paddedHeight # a tile's index here, plus shift, is its index in the padded map
+		firstColumn = 2*paddedHeight
+		lastColumn = (columns+1)*paddedHeight
+		label = array.array("i", [-1])*size
+		origin = array.array("q", [0])*size
+		distance = array.array("i", [0])*size
+		# walls that tunnels may pass through
+		passable = bytearray(size)
+		interior = b"\x01"*(height-2)
+		for c in range(2, columns+2):
+			start = c*paddedHeight + 2
+			passable[start:start+height-2] = interior
+
+		frontier = []
+		for x, top, bottom, r in runs:
+			start = (x-x0+2)*paddedHeight + top+1
+			for i in range(start, start+bottom-top):
+				label[i] = r
+				origin[i] = i+shift
+				passable[i] = 0
+			frontier.extend(range(start, start+bottom-top))
+		# tiles claimed during a step can change hands until the step is over
+		claimable = bytearray(passable)
+		# the frontier's tiles in the first and last columns
+		edges = ([i for i in frontier if i < firstColumn+paddedHeight],
+			[i for i in frontier if i >= lastColumn])
+
+		slotSize = 8*(1 + 4*height)
+		def slot(parity, strip, side):
+			start = ((parity*strips + strip)*2 + side)*slotSize
+			return start, start+slotSize
+
+		def publish(parity, side, tiles):
+			# count, then the y, label, origin and distance of each tile
+			values = array.array("q", [len(tiles)])
+			for i in tiles:
+				values.extend((i%paddedHeight - 1, label[i], origin[i], distance[i]))
+			data = values.tobytes()
+			start, end = slot(parity, index, side)
+			halo.buf[start:start+len(data)] = data
+
+		def receive(parity, strip, side, column, found):
+			start, end = slot(parity, strip, side)
+			count = int.from_bytes(halo.buf[start:start+8], "little", signed=True)
+			values = array.array("q")
+			values.frombytes(halo.buf[start+8:start+8+32*count])
+			for k in range(0, len(values), 4):
+				i = column + values[k]+1
+				label[i] = values[k+1]
+				origin[i] = values[k+2]
+				distance[i] = values[k+3]
+				found.append(i)
+
+		gaps = {}
+		step = 0
+		while True:
+			parity = step % 2
+			publish(parity, 0, edges[0])
+			publish(parity, 1, edges[1])
+			flags.buf[parity*strips + index] = 1 if frontier else 0
+			_wait(barrier, timeout)
+			if not any(flags.buf[parity*strips:(parity+1)*strips]):
+				break
+
+			# the tiles the neighboring strips claimed next to this one grow into it too
+			sources = frontier
+			if index > 0:
+				sources = list(frontier)
+				receive(parity, index-1, 1, paddedHeight, sources)
+			if index < strips-1:
+				if sources is frontier:
+					sources = list(frontier)
+				receive(parity, index+1, 0, lastColumn+paddedHeight, sources)
+
+			nextFrontier = []
+			edges = ([], [])
+			claimed = step+1
+			for i in sources:
+				r = label[i]
+				o = origin[i]
+				for j in (i-1, i+1, i-paddedHeight, i+paddedHeight):
+					if passable[j]:
+						passable[j] = 0
+						label[j] = r
+						origin[j] = o
+						distance[j] = claimed
+						nextFrontier.append(j)
+						if j < firstColumn+paddedHeight:
+							edges[0].append(j)
+						if j >= lastColumn:
+							edges[1].append(j)
+					elif claimable[j] and distance[j] == claimed:
+						# claimed this step, so it may still change hands, and
+						# any gap through it is found from its side next step
+						if o < origin[j]:
+							label[j] = r
+							origin[j] = o
+					else:
+						other = label[j]
+						if other != -1 and other != r:
+							# two fronts have met
+							length = distance[i]+distance[j]+1
+							if r < other:
+								key, gap = (r, other), (length, o, origin[j])
+							else:
+								key, gap = (other, r), (length, origin[j], o)
+							if key not in gaps or gap < gaps[key]:
+								gaps[key] = gap
+			frontier = nextFrontier
+			step += 1
+		return gaps
+	finally:
+		halo.close()
+		flags.close()
+
+class _SharedColumn(object):
+	# one column of the shared map, indexed like a list
+	__slots__ = ("buf", "start", "height")
+
+	def __init__(self, buf, start, height):
+		self.buf = buf
+		self.start = start
+		self.height = height
+
+	def __len__(self):
+		return self.height
+
+	def __getitem__(self, y):
+		if isinstance(y, slice):
+			top, bottom, stride = y.indices(self.height)
+			return list(self.buf[self.start+top:self.start+bottom:stride])
+		return self.buf[self.start + (y if y >= 0 else y+self.height)]
+
+	def __setitem__(self, y, value):
+		if isinstance(y, slice):
+			top, bottom, stride = y.indices(self.height)
+			self.buf[self.start+top:self.start+bottom:stride] = bytes(value)
+		else:
+			self.buf[self.start + (y if y >= 0 else y+self.height)] = value
+
+class ParallelAutomata:
+	def __init__(self, width, height, processes=None, context=None):
+		if width < 3 or height < 3:
+			raise ValueError("the map must be at least 3x3")
+		self.width = width
+		self.height = height
+		self.processes = processes or multiprocessing.cpu_count()
+		self.context = context or multiprocessing.get_context()
+		self.barrierTimeout = 600.0 # seconds a strip waits for its neighbors before giving up
+		self._grid = shared_memory.SharedMemory(create=True, size=width*height)
+		self._grid.buf[:width*height] = b"\x01"*(width*height)
+
+	@classmethod
+	def fromLevel(cls, level, processes=None, context=None):
+		world = cls(len(level), len(level[0]), processes, context)
+		height = world.height
+		for x, column in enumerate(level):
+			world._grid.buf[x*height:(x+1)*height] = bytearray(column)
+		return world
+
+	def _runWorkers(self, target, argumentLists, barrier=None):
+		# runs target once for each list of arguments, each in its own process, and returns their results
+		pipes = [self.context.Pipe(duplex=False) for arguments in argumentLists]
+		workers = [self.context.Process(target=_callWorker, args=(target, sender) + tuple(arguments))
+			for (receiver, sender), arguments in zip(pipes, argumentLists)]
+		for worker in workers:
+			worker.start()
+		for receiver, sender in pipes:
+			sender.close()
+
+		results = [None]*len(workers)
+		receiving = dict((receiver, i) for i, (receiver, sender) in enumerate(pipes))
+		running = list(workers)
+		while running or receiving:
+			ready = multiprocessing.connection.wait(list(receiving) + [worker.sentinel for worker in running])
+			# read results as they come, so that a big one can't keep its worker from exiting
+			for receiver in [receiver for receiver in receiving if receiver in ready]:
+				try:
+					results[receiving[receiver]] = receiver.recv()
+				except EOFError:
+					pass # the worker died without sending anything
+				del receiving[receiver]
+				receiver.close()
+			for worker in [worker for worker in running if worker.sentinel in ready]:
+				worker.join()
+				running.remove(worker)
+				if worker.exitcode != 0 and barrier is not None:
+					# wake the other strips instead of leaving them waiting for this one
+					barrier.abort()
+		if any(worker.exitcode != 0 for worker in workers):
+			raise RuntimeError("a %s worker failed" % target.__name__)
+		return results
+
+	def randomFill(self, seed=0, wallProbability=0.5):
+		# fill the map with random walls, leaving a solid border
+		self._runWorkers(_fillStrip, [
+			(self._grid.name, self.width, self.height, x0, x1, seed, wallProbability)
+			for x0, x1 in _stripBounds(0, self.width, self.processes)])
+
+	def _interiorStrips(self):
+		# the interior columns, one strip per process
+		return _stripBounds(1, self.width-1, min(self.processes, self.width-2))
+
+	def _stepStrips(self, generations, stepFunction, stepArguments):
+		if generations < 1:
+			return
+		strips = self._interiorStrips()
+		slotSize = (self.height+7)//8
+		halo = shared_memory.SharedMemory(create=True, size=2*len(strips)*2*slotSize)
+		try:
+			barrier = self.context.Barrier(len(strips))
+			self._runWorkers(_runStrip, [
+				(self._grid.name, halo.name, self.width, self.height, len(strips), index,
+					x0, x1, generations, stepFunction, stepArguments, barrier, self.barrierTimeout)
+				for index, (x0, x1) in enumerate(strips)], barrier)
+		finally:
+			halo.close()
+			halo.unlink()
+
+	def run(self, generations=5, neighbors=4):
+		# step the whole map generations times
+		self._stepStrips(generations, bitboardAutomata.step, (neighbors,))
+
+	def smooth(self, passes=5, smoothing=1, filling=None):
+		# passes synchronous smoothing passes over the whole map
+		self._stepStrips(passes, bitboardAutomata.smoothStep, (smoothing, filling))
+
+	def labelRegions(self):
+		'''
+		Returns the floor regions of the map, largest first, each
+		one a list of (x, top, bottom) runs of floor, the same as
+		levelMetrics.findRegions.
+		'''
+		strips = _stripBounds(0, self.width, min(self.processes, self.width))
+		pool = self.context.Pool(len(strips))
+		try:
+			results = pool.starmap(_labelStrip,
+				[(self._grid.name, self.height, x0, x1) for x0, x1 in strips])
+		finally:
+			pool.close()
+			pool.join()
+
+		# give each strip's regions global numbers
+		offsets = []
+		regions = []
+		for stripRegions, firstRuns, lastRuns in results:
+			offsets.append(len(regions))
+			regions.extend(stripRegions)
+
+		parent = list(range(len(regions)))
+		def find(i):
+			while parent[i] != i:
+				parent[i] = parent[parent[i]]
+				i = parent[i]
+			return i
+
+		# join regions whose runs overlap across each seam
+		for i in range(len(results)-1):
+			leftRuns = results[i][2]
+			rightRuns = results[i+1][1]
+			a = b = 0
+			while a < len(leftRuns) and b < len(rightRuns):
+				leftTop, leftBottom, leftRegion = leftRuns[a]
+				rightTop, rightBottom, rightRegion = rightRuns[b]
+				if leftTop < rightBottom and rightTop < leftBottom:
+					rootA = find(offsets[i] + leftRegion)
+					rootB = find(offsets[i+1] + rightRegion)
+					if rootA != rootB:
+						parent[rootB] = rootA
+				if leftBottom < rightBottom:
+					a += 1
+				else:
+					b += 1
+
+		merged = {}
+		for i, region in enumerate(regions):
+			merged.setdefault(find(i), []).extend(region)
+		# sorted by their runs as well as their size, so that the order doesn't depend on the strips
+		regions = list(merged.values())
+		for region in regions:
+			region.sort()
+		return sorted(regions, key=lambda region: (-levelMetrics.regionSize(region), region[0]))
+
+	def regionGaps(self, regions):
+		'''
+		postProcessing.regionGaps for the shared map, with regions
+		as lists of (x, top, bottom) runs. Returns the same
+		{(regionA, regionB): (length, tileA, tileB)}.
+		'''
+		height = self.height
+		if self.width < 3 or height < 3:
+			return {}
+		strips = self._interiorStrips()
+		stripRuns = [[] for strip in strips]
+		starts = [x0 for x0, x1 in strips]
+		for r, region in enumerate(regions):
+			for x, top, bottom in region:
+				if 1 <= x < self.width-1:
+					stripRuns[bisect.bisect_right(starts, x)-1].append((x, top, bottom, r))
+
+		slotSize = 8*(1 + 4*height)
+		halo = shared_memory.SharedMemory(create=True, size=2*len(strips)*2*slotSize)
+		flags = shared_memory.SharedMemory(create=True, size=2*len(strips))
+		try:
+			barrier = self.context.Barrier(len(strips))
+			results = self._runWorkers(_gapStrip, [
+				(halo.name, flags.name, height, len(strips), index, x0, x1, stripRuns[index],
+					barrier, self.barrierTimeout)
+				for index, (x0, x1) in enumerate(strips)], barrier)
+		finally:
+			halo.close()
+			halo.unlink()
+			flags.close()
+			flags.unlink()
+
+		gaps = {}
+		for stripGaps in results:
+			for key, gap in stripGaps.items():
+				if key not in gaps or gap < gaps[key]:
+					gaps[key] = gap
+		paddedHeight = height+2
+		def tile(i):
+			return (i//paddedHeight - 1, i%paddedHeight - 1)
+		return dict((key, (length, tile(a), tile(b))) for key, (length, a, b) in gaps.items())
+
+	def columns(self):
+		'''
+		Returns a level[x][y] view of the shared map, for carving
+		into it without copying it out. The view can't be used
+		after close.
+		'''
+		buf = self._grid.buf
+		return [_SharedColumn(buf, x*self.height, self.height) for x in range(self.width)]
+
+	def toLevel(self):
+		height = self.height
+		buf = self._grid.buf
+		return [list(buf[x*height:(x+1)*height]) for x in range(self.width)]
+
+	def close(self):
+		self._grid.close()
+		self._grid.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
@@ -0,0 +1,299 @@
+'''
+===============
+Post Processing
+===============
+
+Clean up steps that can be run on a level from any generator,
+either one at a time or chained together in a Pipeline.
+
+repairConnectivity joins every separate floor region of a
+level into one. It labels the regions once, grows all of them
+outward through the walls at the same time (a multi-source
+BFS), and notes the shortest gap between each pair of regions
+where their fronts meet. A minimum spanning tree over those
+gaps picks the cheapest set of links that connects everything,
+and each link is carved as an L shaped tunnel. Every step is
+about linear in the area of the map, unlike checking every
+pair of regions against each other.
+
+Every generator has a repairConnectivity attribute that runs
+this after it has finished its level:
+
+	generator = DrunkardsWalk()
+	generator.repairConnectivity = True
+	level = generator.generateLevel(80, 50)
+'''
+
+import array
+import random
+import time
+from collections import OrderedDict
+
+import carving
+import neighborhoodRules
+from levelMetrics import findRegions
+
+# ==== Connectivity ====
+def regionGaps(level, regions):
+	'''
+	Returns {(regionA, regionB): (length, tileA, tileB)}, the
+	shortest tunnel through walls found between each pair of
+	regions that can reach each other, where tileA and tileB are
+	(x, y) floor tiles in each region. Tunnels never pass through
+	the outer edge of the map.
+	'''
+	width = len(level)
+	height = len(level[0])
+	# tiles are indexed in a grid with a one tile border, so neighbors never wrap around
+	paddedHeight = height+2
+	size = (width+2)*paddedHeight
+
+	# flat arrays rather than lists, which take several times the memory on big maps
+	label = array.array("i", [-1])*size
+	origin = array.array("l", [0])*size
+	distance = array.array("i", [0])*size
+	# walls that tunnels may pass through
+	passable = bytearray(size)
+	interior = b"\x01"*(height-2)
+	for x in range(1, width-1):
+		start = (x+1)*paddedHeight + 2
+		passable[start:start+height-2] = interior
+
+	frontier = []
+	for r, region in enumerate(regions):
+		for x, top, bottom in region:
+			start = (x+1)*paddedHeight + top+1
+			for i in range(start, start+bottom-top):
+				label[i] = r
+				origin[i] = i
+				passable[i] = 0
+			frontier.extend(range(start, start+bottom-top))
+
+	gaps = {}
+	while frontier:
+		nextFrontier = []
+		for i in frontier:
+			r = label[i]
+			for j in (i-1, i+1, i-paddedHeight, i+paddedHeight):
+				if passable[j]:
+					passable[j] = 0
+					label[j] = r
+					origin[j] = origin[i]
+					distance[j] = distance[i]+1
+					nextFrontier.append(j)
+				elif label[j] not in (-1, r):
+					# two fronts have met
+					length = distance[i]+distance[j]+1
+					if r < label[j]:
+						key, ends = (r, label[j]), (origin[i], origin[j])
+					else:
+						key, ends = (label[j], r), (origin[j], origin[i])
+					if key not in gaps or length < gaps[key][0]:
+						gaps[key] = (length,) + ends
+		frontier = nextFrontier
+
+	def tile(i):
+		return (i//paddedHeight - 1, i%paddedHeight - 1)
+	return dict((key, (length, tile(a), tile(b))) for key, (length, a, b) in gaps.items())
+
+def repairConnectivity(level, regions=None):
+	'''
+	Carves tunnels between the separate floor regions of level
+	until they are all connected. Returns the number of tunnels.
+	regions, if given, must be findRegions(level), for callers
+	that have already labeled the level.
+	'''
+	if regions is None:
+		regions = findRegions(level)
+	if len(regions) < 2:
+		return 0
+	return connectGaps(level, len(regions), regionGaps(level, regions))
+
+def connectGaps(level, regionCount, gaps):
+	'''
+	Carves the cheapest set of gaps from regionGaps that joins
+	all regionCount regions (Kruskal's algorithm). Returns the
+	number of tunnels.
+	'''
+	parent = list(range(regionCount))
+	def find(i):
+		while parent[i] != i:
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+
+	tunnels = 0
+	for (a, b), (length, (x1, y1), (x2, y2)) in sorted(gaps.items(), key=lambda gap: gap[1]):
+		rootA = find(a)
+		rootB = find(b)
+		if rootA == rootB:
+			continue
+		parent[rootB] = rootA
+		# 50% chance that a tunnel will start horizontally
+		carving.carveLHall(level, x1, y1, x2, y2, random.randint(0,1) == 1)
+		tunnels += 1
+		if tunnels == regionCount-1:
+			break
+	return tunnels
+
+# ==== Pipeline ====
+'''
+A Pipeline runs a level through an ordered list of stages:
+
+	pipeline = Pipeline([Smooth(), Fill(), RemoveDeadEnds(), CullSmallRegions(16), RepairConnectivity()])
+	pipeline.run(level)
+	pipeline.timings
+
+Smooth, Fill and RemoveDeadEnds are cell stages: each one looks
+at the 3x3 block around one tile at a time and changes the tile
+in place, the same way the cleanUpMap methods do. A cell stage
+is a neighborhoodRules table, so a new one only needs a rule
+method. Runs of
+cell stages next to each other in the list that make the same
+number of passes are fused, so that each pass is one sweep over
+the map that applies every stage to a tile before moving on to
+the next tile, the same way MessyBSPTree.cleanUpMap applies its
+smoothing and filling together. For example, smoothing until
+nothing changes and removing dead ends are done in one sweep
+per pass by
+
+	Pipeline([Smooth(passes=None), RemoveDeadEnds()])
+
+Because tiles change in place, a fused sweep can give a
+slightly different level than running the stages one after
+another.
+
+Every stage is timed, and pipeline.timings holds the seconds
+spent in each one after a run. Fused stages share one entry,
+named after all of them, such as "smooth+fill".
+
+Setting a generator's pipeline attribute runs it on every level
+that generator makes.
+'''
+
+class CellStage(object):
+	# changes one tile at a time, and can be fused with other cell stages
+	name = "cell"
+	passes = 1 # None repeats the pass until nothing changes
+
+	def rule(self, n):
+		# returns the new value of the tile at the center of Neighborhood n
+		raise NotImplementedError
+
+	def table(self):
+		return neighborhoodRules.compileRule(self.rule)
+
+class Smooth(CellStage):
+	# open up walls that have few walls around them (CellularAutomata.cleanUpMap)
+	name = "smooth"
+
+	def __init__(self, smoothing=1, passes=1):
+		self.smoothing = smoothing
+		self.passes = passes
+
+	def table(self):
+		return neighborhoodRules.smoothingRule(self.smoothing)
+
+class Fill(CellStage):
+	# fill in floors that are mostly surrounded by walls (MessyBSPTree.cleanUpMap)
+	name = "fill"
+
+	def __init__(self, filling=3, passes=1):
+		self.filling = filling
+		self.passes = passes
+
+	def rule(self, n):
+		if n.center == 0 and n.walls4 >= self.filling:
+			return 1
+		return n.center
+
+class RemoveDeadEnds(CellStage):
+	# fill in floors with one exit or fewer, until there are none left (MazeWithRooms.removeDeadEnds)
+	name = "removeDeadEnds"
+	passes = None
+
+	def table(self):
+		return neighborhoodRules.FILL_DEAD_ENDS
+
+class CullSmallRegions(object):
+	# fill in floor regions smaller than minSize tiles (CellularAutomata.getCaves)
+	name = "cullSmallRegions"
+
+	def __init__(self, minSize=16):
+		self.minSize = minSize
+
+	def run(self, level):
+		for region in findRegions(level):
+			if sum(bottom-top for x, top, bottom in region) < self.minSize:
+				for x, top, bottom in region:
+					carving.carveVertical(level, top, bottom-1, x, 1)
+
+class RepairConnectivity(object):
+	name = "repairConnectivity"
+
+	def run(self, level):
+		repairConnectivity(level)
+
+class FusedCellStages(object):
+	'''
+	Sweeps the interior of a level once per pass, applying each
+	of stages to every tile in turn. The stages' tables are
+	composed into one, so each tile is only looked up once.
+	'''
+	def __init__(self, stages):
+		self.stages = stages
+		self.passes = stages[0].passes
+		self.name = "+".join(stage.name for stage in stages)
+
+	def table(self):
+		table = self.stages[0].table()
+		for stage in self.stages[1:]:
+			table = neighborhoodRules.composeTables(table, stage.table())
+		return table
+
+	def run(self, level):
+		table = self.table()
+		if self.passes is None:
+			# a stage that only ever opens or only ever fills tiles settles within this many passes
+			for i in range(len(level)*len(level[0])):
+				if not neighborhoodRules.sweep(level, table):
+					break
+		else:
+			for i in range(self.passes):
+				neighborhoodRules.sweep(level, table)
+
+class Pipeline(object):
+	def __init__(self, stages):
+		self.stages = list(stages)
+		self.timings = OrderedDict()
+
+	def plan(self):
+		# returns the stages to run, with neighboring cell stages fused
+		plan = []
+		for stage in self.stages:
+			if isinstance(stage, CellStage):
+				last = plan[-1] if plan else None
+				if isinstance(last, FusedCellStages) and last.passes == stage.passes:
+					last.stages.append(stage)
+					last.name += "+" + stage.name
+				else:
+					plan.append(FusedCellStages([stage]))
+			else:
+				plan.append(stage)
+		return plan
+
+	def run(self, level):
+		for step in self.runSteps(level):
+			pass
+		return level
+
+	def runSteps(self, level):
+		# run, yielding the name of each stage after it finishes
+		self.timings = OrderedDict()
+		if not level or len(level[0]) < 3:
+			return
+		for stage in self.plan():
+			startTime = time.time()
+			stage.run(level)
+			self.timings[stage.name] = self.timings.get(stage.name, 0.0) + time.time()-startTime
+			yield stage.name
@@ -0,0 +1,144 @@
+'''
+==============
+Streaming Maze
+==============
+
+A perfect maze (no loops, no dead regions) built one row at a
+time with Eller's algorithm, so that only one row of state is
+ever held no matter how tall the maze is.
+
+	for row in mazeRows(81, 1000001, seed=7):
+		... row[x] is the tile at (x, y), 1 for wall and 0 for floor
+
+	with open("maze.txt", "w") as f:
+		writeMaze(f, 81, 1000001, seed=7, text=True)
+
+Unlike the rest of this project, mazes come out a row (fixed y)
+at a time rather than a column at a time, since rows are what
+can be finished in order. toLevel turns the rows of a small
+maze back into an ordinary level[x][y].
+
+Cells sit on odd x and odd y, the same as in MazeWithRooms.
+Every cell of the current row belongs to a set of cells that
+are already joined together. For each row, neighboring cells
+in different sets are joined at random, then every set is
+carried down into the next row through at least one opening,
+and cells that nothing opened into start new sets. The last
+row joins every set that is left. Sets are relabeled 0 to n-1
+after every row, so the state is a handful of lists of length
+n, the number of cells across.
+
+Passing height=None keeps making rows forever.
+'''
+
+import random
+
+def _cellRow(labels, rand, joinChance, last):
+	# joins cells of the row, returning the row of tiles and the new labels
+	cells = len(labels)
+	parent = list(range(cells))
+	def find(i):
+		while parent[i] != i:
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+
+	row = bytearray(b"\x01"*(2*cells+1))
+	for i in range(cells):
+		row[2*i+1] = 0
+	for i in range(cells-1):
+		a = find(labels[i])
+		b = find(labels[i+1])
+		if a != b and (last or rand.random() < joinChance):
+			parent[b] = a
+			row[2*i+2] = 0
+	return row, [find(label) for label in labels]
+
+def _openingRow(labels, rand, downChance):
+	# carries every set down at least once, returning the row of tiles and the next row's labels
+	cells = len(labels)
+	members = {}
+	for i, label in enumerate(labels):
+		members.setdefault(label, []).append(i)
+
+	down = bytearray(cells)
+	for label, group in members.items():
+		opened = False
+		for i in group:
+			if rand.random() < downChance:
+				down[i] = 1
+				opened = True
+		if not opened:
+			down[rand.choice(group)] = 1
+
+	row = bytearray(b"\x01"*(2*cells+1))
+	nextLabels = [0]*cells
+	renamed = {}
+	for i in range(cells):
+		if down[i]:
+			row[2*i+1] = 0
+			if labels[i] not in renamed:
+				renamed[labels[i]] = len(renamed)
+			nextLabels[i] = renamed[labels[i]]
+	# cells with nothing above them start new sets
+	fresh = len(renamed)
+	for i in range(cells):
+		if not down[i]:
+			nextLabels[i] = fresh
+			fresh += 1
+	return row, nextLabels
+
+def mazeRows(width, height=None, seed=None, joinChance=0.5, downChance=0.3):
+	'''
+	Yields the rows of a width x height maze, top to bottom, as
+	bytearrays of width tiles. As with MazeWithRooms, an even
+	width or height leaves an extra wall along the right or
+	bottom edge. seed gives the maze its own random.Random, so
+	it doesn't touch the random module's state.
+	'''
+	if width < 3 or (height is not None and height < 3):
+		raise ValueError("mazes must be at least 3x3")
+	rand = random.Random(seed) if seed is not None else random
+	cells = (width-1)//2
+	padding = bytearray(b"\x01"*(width - (2*cells+1)))
+	wallRow = bytearray(b"\x01"*width)
+
+	yield bytearray(wallRow)
+	labels = list(range(cells))
+	y = 1
+	while True:
+		last = height is not None and y+3 >= height
+		row, labels = _cellRow(labels, rand, joinChance, last)
+		yield row + padding
+		if last:
+			break
+		row, labels = _openingRow(labels, rand, downChance)
+		yield row + padding
+		y += 2
+	y += 1
+	# the bottom edge, plus an extra wall row if height is even
+	while y < height:
+		yield bytearray(wallRow)
+		y += 1
+
+def writeMaze(f, width, height, seed=None, text=False, joinChance=0.5, downChance=0.3):
+	'''
+	Writes a maze to the file f as it is made, one byte per tile,
+	row by row. With text=True rows are written as lines of "#"
+	and "." instead. A socket can be written to through
+	sock.makefile("wb") (or "w" for text). Returns the number of
+	rows written.
+	'''
+	rows = 0
+	for row in mazeRows(width, height, seed, joinChance, downChance):
+		if text:
+			f.write(row.decode("latin-1").replace("\x01", "#").replace("\x00", ".") + "\n")
+		else:
+			f.write(bytes(row))
+		rows += 1
+	return rows
+
+def toLevel(rows):
+	# turns rows of tiles into a level[x][y]
+	rows = list(rows)
+	return [list(column) for column in zip(*rows)]
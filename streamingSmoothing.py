@@ -0,0 +1,117 @@
+'''
+===================
+Streaming Smoothing
+===================
+
+Runs the cleanUpMap smoothing passes over a map that is too big
+to hold in memory, reading it in and writing it back out one
+column at a time.
+
+	# the same 5 passes as CellularAutomata.cleanUpMap, in place
+	smoothFile("huge.tiles", width, height, passes=5, smoothing=1)
+
+	# the same 3 passes as MessyBSPTree.cleanUpMap, from one file to another
+	with open("huge.tiles", "rb") as src, open("smooth.tiles", "wb") as dst:
+		smoothStream(src, dst, height, passes=3, smoothing=1, filling=3)
+
+Maps are stored as one byte per tile, column after column, the
+same layout as levelCache.packLevel.
+
+neighborhoodRules.sweep changes tiles in place, column by
+column, so a pass over column x sees column x-1 as this pass
+left it and column x+1 as the last pass left it. That means
+pass k can run on column x as soon as pass k-1 has finished
+column x+1. Each time a column is read in, pass 1 runs on the
+column before it, pass 2 on the one before that, and so on,
+with the earlier passes going first. Only the last passes+2
+columns are ever in memory, and a column is written out as soon
+as the last pass no longer needs it. The result is exactly the
+same as running the passes one after another over the whole
+map.
+
+Levels are stored as columns (level[x][y]), so the map streams
+along x: memory depends on the height of the map and the number
+of passes, not on its width.
+'''
+
+import mmap
+
+import neighborhoodRules
+
+def smoothColumns(columns, passes, table):
+	'''
+	Yields the columns of a map after passes sweeps of table over
+	its interior. columns can be any iterable of columns, which
+	are read one at a time, as late as possible.
+	'''
+	window = [] # the columns still needed, starting with column base
+	base = 0
+	height = 0
+	x = -1
+	for x, column in enumerate(columns):
+		window.append(bytearray(column))
+		height = len(window[-1])
+		for k in range(1, passes+1):
+			# column x-k is never the last column, since column x comes after it
+			if x-k >= 1:
+				neighborhoodRules.sweep(window, table, x-k-base, 1, x-k-base+1, height-1)
+		while len(window) > passes+1:
+			yield window.pop(0)
+			base += 1
+
+	# finish the passes that were waiting for the columns after them
+	width = x+1
+	for last in range(width, width+passes):
+		for k in range(1, passes+1):
+			if 1 <= last-k <= width-2:
+				neighborhoodRules.sweep(window, table, last-k-base, 1, last-k-base+1, height-1)
+	for column in window:
+		yield column
+
+def _table(smoothing, filling):
+	return neighborhoodRules.smoothingRule(smoothing, filling)
+
+def smoothStream(src, dst, height, passes=5, smoothing=1, filling=None):
+	'''
+	Reads a map from the file src, smooths it, and writes it to
+	dst. Returns the number of columns written.
+	'''
+	def read():
+		while True:
+			column = src.read(height)
+			if not column:
+				return
+			if len(column) != height:
+				raise ValueError("the map ends partway through a column")
+			yield column
+
+	written = 0
+	for column in smoothColumns(read(), passes, _table(smoothing, filling)):
+		dst.write(bytes(column))
+		written += 1
+	return written
+
+def smoothFile(path, width, height, passes=5, smoothing=1, filling=None, offset=0):
+	'''
+	Smooths the map stored at offset bytes into the file at path,
+	in place. Columns are read and written through an mmap, and
+	each column is written back only after it has been read.
+	'''
+	size = width*height
+	with open(path, "r+b") as f:
+		mapped = mmap.mmap(f.fileno(), 0)
+		try:
+			if len(mapped) < offset+size:
+				raise ValueError("%s is too small for a %dx%d map" % (path, width, height))
+			def read():
+				for x in range(width):
+					start = offset + x*height
+					yield mapped[start:start+height]
+
+			start = offset
+			for column in smoothColumns(read(), passes, _table(smoothing, filling)):
+				mapped[start:start+height] = bytes(column)
+				start += height
+			mapped.flush()
+		finally:
+			mapped.close()
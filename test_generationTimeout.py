@@ -0,0 +1,29 @@
+import pickle
+import unittest
+
+import dungeonGenerationAlgorithms
+
+class GenerationTimeoutTest(unittest.TestCase):
+	def test_pickles(self):
+		# process pools send timeouts back to the caller pickled
+		diagnostics = {"generator": "RoomAddition", "phase": "generateRoomAutomata", "steps": 10}
+		timeout = dungeonGenerationAlgorithms.GenerationTimeout("steps", diagnostics, [[1, 0], [0, 1]])
+		for protocol in range(pickle.HIGHEST_PROTOCOL+1):
+			copy = pickle.loads(pickle.dumps(timeout, protocol))
+			self.assertIsInstance(copy, dungeonGenerationAlgorithms.GenerationTimeout)
+			self.assertEqual(copy.reason, "steps")
+			self.assertEqual(copy.diagnostics, diagnostics)
+			self.assertEqual(copy.level, [[1, 0], [0, 1]])
+			self.assertEqual(str(copy), str(timeout))
+
+	def test_budget(self):
+		generator = dungeonGenerationAlgorithms.createGenerator("RoomAddition",
+			{"budget": dungeonGenerationAlgorithms.GenerationBudget(maxSteps=10)})
+		with self.assertRaises(dungeonGenerationAlgorithms.GenerationTimeout) as caught:
+			generator.generateLevel(80, 50)
+		copy = pickle.loads(pickle.dumps(caught.exception))
+		self.assertEqual(copy.reason, "steps")
+		self.assertEqual(len(copy.level), 80)
+
+if __name__ == "__main__":
+	unittest.main()